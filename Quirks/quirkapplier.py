@@ -18,32 +18,59 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 from glob import glob
+import hashlib
 import os
 import sys
 import tempfile
 import logging
-from typing import List, Dict, Any
-
-import xkit.xutils
-import xkit.xorgparser
+from typing import List, Dict, Any, Optional, Set
 
 import Quirks.quirkreader
 from Quirks.quirkreader import Quirk
 import Quirks.quirkinfo
+import Quirks.quirkstore
+from Quirks.quirkindex import QuirkIndex, tag_matches
+
+# first line of the files that quirks-handler writes for a handler
+_file_header = "# Written by quirks-handler for %s, do not edit\n"
+
+
+def _file_hash(path: str) -> Optional[str]:
+    """Return the SHA-256 of the file at path, or None if it is missing"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (OSError, IOError):
+        return None
 
 
 class QuirkChecker:
-    def __init__(self, handler: str, path: str = "/usr/share/jockey/quirks") -> None:
+    def __init__(
+        self,
+        handler: str,
+        path: str = "/usr/share/jockey/quirks",
+        cache_path: Optional[str] = None,
+    ) -> None:
         self._handler = handler
         self.quirks_path = path
         self._quirks: List[Quirk] = []
-        self.get_quirks_from_path()
+        # built from _quirks the first time it is needed
+        self._index: Optional[QuirkIndex] = None
+        if cache_path:
+            # only the quirks for this handler, from the compiled store
+            store = Quirks.quirkstore.QuirkStore(path, cache_path)
+            self._quirks = store.get_quirks(handler)
+        else:
+            self.get_quirks_from_path()
         self._system_info = self.get_system_info()
         self._xorg_conf_d_path = "/usr/share/X11/xorg.conf.d"
+        # what the last enable_quirks() or disable_quirks() did
+        self.changes: Dict[str, List[str]] = {}
 
     def get_quirks_from_path(self) -> List[Quirk]:
         """check all the files in a directory looking for quirks"""
         self._quirks = []
+        self._index = None
         if os.path.isdir(self.quirks_path):
             for f in glob(os.path.join(self.quirks_path, "*")):
                 if os.path.isfile(f):
@@ -67,45 +94,51 @@ class QuirkChecker:
 
     def matches_tags(self, quirk: Quirk) -> bool:
         """See if tags match system info"""
-        result = True
-        for tag in quirk.match_tags.keys():
-            for val in quirk.match_tags[tag]:
-                if (
-                    self._system_info.get(tag)
-                    and self._system_info.get(tag) != val
-                    and len(quirk.match_tags[tag]) <= 1
-                ):
-                    logging.debug(
-                        "Failure to match %s with %s"
-                        % (self._system_info.get(tag), val)
-                    )
-                    return False
+        for tag, values in quirk.match_tags.items():
+            if not tag_matches(values, self._system_info.get(tag)):
+                logging.debug(
+                    "Failure to match %s with %s"
+                    % (self._system_info.get(tag), "|".join(values))
+                )
+                return False
         logging.debug("Success")
-        return result
-
-    def _check_quirks(self, enable: bool = True) -> None:
-        """Process quirks and do something with them"""
-        for quirk in self._quirks:
-            if self._handler.lower() in [x.lower().strip() for x in quirk.handler]:
-                logging.debug("Processing quirk %s" % quirk.id)
-                if self.matches_tags(quirk):
-                    # Do something here
-                    if enable:
-                        logging.info("Applying quirk %s" % quirk.id)
-                        self._apply_quirk(quirk)
-                    else:
-                        logging.info("Unapplying quirk %s" % quirk.id)
-                        self._unapply_quirk(quirk)
-                else:
-                    logging.debug("Quirk doesn't match")
+        return True
 
-    def enable_quirks(self) -> None:
+    def _check_quirks(self, enable: bool = True) -> Dict[str, List[str]]:
+        """Process quirks and do something with them
+
+        Only the files whose content changes are written, and the files of
+        this handler that no matching quirk wants any more are removed.
+        Return the paths that were written, left unchanged and removed.
+        """
+        self.changes = {"written": [], "unchanged": [], "removed": []}
+        wanted = set()
+        # only the quirks for this handler, vendor and product name are left
+        if self._index is None:
+            self._index = QuirkIndex(self._quirks, self._handler)
+        for quirk in self._index.candidates(self._handler, self._system_info):
+            logging.debug("Processing quirk %s" % quirk.id)
+            if self.matches_tags(quirk):
+                # Do something here
+                if enable:
+                    logging.info("Applying quirk %s" % quirk.id)
+                    self._apply_quirk(quirk)
+                    wanted.add(self._get_destination_path(quirk))
+                else:
+                    logging.info("Unapplying quirk %s" % quirk.id)
+                    self._unapply_quirk(quirk)
+            else:
+                logging.debug("Quirk doesn't match")
+        self._remove_stale_files(wanted)
+        return self.changes
+
+    def enable_quirks(self) -> Dict[str, List[str]]:
         """Enable all quirks for a handler"""
-        self._check_quirks(True)
+        return self._check_quirks(True)
 
-    def disable_quirks(self) -> None:
+    def disable_quirks(self) -> Dict[str, List[str]]:
         """Disable all quirks for a handler"""
-        self._check_quirks(False)
+        return self._check_quirks(False)
 
     def _get_destination_path(self, quirk: Any) -> str:
         """Return the path to the X config file"""
@@ -115,39 +148,76 @@ class QuirkChecker:
             quirk.id.lower().replace(" ", "-"),
         )
 
+    def _get_file_content(self, quirk: Quirk) -> str:
+        """Return what the X config file of quirk should contain"""
+        return _file_header % self._handler + quirk.get_x_config()
+
+    def _is_own_file(self, path: str) -> bool:
+        """See if path was written by quirks-handler for this handler"""
+        try:
+            with open(path) as f:
+                return f.readline() == _file_header % self._handler
+        except (OSError, IOError, UnicodeDecodeError):
+            return False
+
     def _apply_quirk(self, quirk: Quirk) -> bool:
-        """Get the xorg snippet and apply it"""
-        # Get the relevant x_snippet
-        # Write conf file to /usr/share/X11/xorg.conf.d/file.conf
+        """Get the xorg snippet and apply it, unless it is there already"""
         destination = self._get_destination_path(quirk)
-        tmp_file = tempfile.NamedTemporaryFile(mode="w", delete=False)
-        tmp_file.write(quirk.x_snippet)
-        tmp_file.close()
-        tmp_xkit = xkit.xorgparser.Parser(tmp_file.name)
-        # TODO: REMOVE THIS
-        logging.debug(tmp_xkit.globaldict)
-        os.unlink(tmp_file.name)
+        content = self._get_file_content(quirk).encode("utf-8")
+        if _file_hash(destination) == hashlib.sha256(content).hexdigest():
+            logging.debug("%s is up to date" % destination)
+            self.changes.setdefault("unchanged", []).append(destination)
+            return True
+
+        # write a new file and move it into place, so that X never reads a
+        # partial one
         try:
             logging.debug("Creating %s" % destination)
-            tmp_xkit.write(destination)
-        except IOError:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self._xorg_conf_d_path, prefix=".quirk-", suffix=".tmp"
+            )
+        except (OSError, IOError):
+            logging.exception("Error during write()")
+            return False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, destination)
+        except (OSError, IOError):
             logging.exception("Error during write()")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
             return False
+        self.changes.setdefault("written", []).append(destination)
         return True
 
     def _unapply_quirk(self, quirk: Quirk) -> bool:
-        """Remove the file with the xorg snippet"""
-        # Get the relevant x_snippet
-        # Write conf file to /usr/share/X11/xorg.conf.d/file.conf
-        destination = self._get_destination_path(quirk)
+        """Remove the file with the xorg snippet, if there is one"""
+        return self._remove_file(self._get_destination_path(quirk))
+
+    def _remove_file(self, destination: str) -> bool:
+        if not os.path.lexists(destination):
+            return True
         logging.debug("Removing %s ..." % destination)
         try:
             os.unlink(destination)
         except (OSError, IOError):
             logging.exception("Cannot unlink destination")
             return False
+        self.changes.setdefault("removed", []).append(destination)
         return True
 
+    def _remove_stale_files(self, wanted: Set[str]) -> None:
+        """Remove the files of this handler that are not in wanted"""
+        pattern = os.path.join(self._xorg_conf_d_path, "10-%s-*.conf" % self._handler)
+        for path in sorted(glob(pattern)):
+            if path not in wanted and self._is_own_file(path):
+                logging.info("Removing stale %s" % path)
+                self._remove_file(path)
+
 
 def main() -> int:
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# (c) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Quirks.quirkreader import Quirk
+
+# (position in the quirk list, quirk); by vendor, then by product name, where
+# None stands for quirks that do not match on that tag
+_Buckets = Dict[Optional[str], Dict[Optional[str], List[Tuple[int, Quirk]]]]
+
+
+def tag_matches(values: List[str], system_value: Optional[str]) -> bool:
+    """Return whether a Match tag with these alternatives matches.
+
+    A tag without values, or one that the system does not report, always
+    matches.
+    """
+    return not values or not system_value or system_value in values
+
+
+class QuirkIndex:
+    """Quirks indexed by handler, sys_vendor and product_name.
+
+    candidates() only returns the quirks whose handler, vendor and product
+    name can match the system; the other tags still need to be checked.
+    """
+
+    def __init__(self, quirks: Iterable[Quirk], handler: Optional[str] = None) -> None:
+        """Index quirks, or only those for handler"""
+        only = handler.lower().strip() if handler else None
+        self._handlers: Dict[str, _Buckets] = {}
+        for position, quirk in enumerate(quirks):
+            handlers = {x.lower().strip() for x in quirk.handler}
+            if only is not None:
+                if only not in handlers:
+                    continue
+                handlers = {only}
+            vendors: List[Optional[str]] = [
+                *quirk.match_tags.get("sys_vendor", [])
+            ] or [None]
+            products: List[Optional[str]] = [
+                *quirk.match_tags.get("product_name", [])
+            ] or [None]
+            for name in handlers:
+                buckets = self._handlers.setdefault(name, {})
+                for vendor in vendors:
+                    by_product = buckets.setdefault(vendor, {})
+                    for product in products:
+                        by_product.setdefault(product, []).append((position, quirk))
+
+    def candidates(self, handler: str, system_info: Dict[str, str]) -> List[Quirk]:
+        """Return the quirks for handler that can match system_info.
+
+        They are in the order in which they were indexed.
+        """
+        buckets = self._handlers.get(handler.lower().strip())
+        if not buckets:
+            return []
+
+        vendor = system_info.get("sys_vendor")
+        product = system_info.get("product_name")
+        # an unknown vendor or product name matches any
+        if vendor:
+            vendor_buckets = [buckets.get(vendor, {}), buckets.get(None, {})]
+        else:
+            vendor_buckets = list(buckets.values())
+        found: Dict[int, Quirk] = {}
+        for by_product in vendor_buckets:
+            if product:
+                found.update(by_product.get(product, []))
+                found.update(by_product.get(None, []))
+            else:
+                for entries in by_product.values():
+                    found.update(entries)
+        return [found[position] for position in sorted(found)]
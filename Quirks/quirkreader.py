@@ -18,13 +18,12 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import xkit.xutils
+import io
+import logging
+import re
 import xkit.xorgparser
 import Quirks.quirkinfo
-from typing import Optional, Dict, List, Any
-
-import tempfile
-import os
+from typing import Optional, Dict, List, IO, Iterable, Iterator, Union
 
 
 class Quirk:
@@ -42,121 +41,112 @@ class Quirk:
         self.match_tags: Dict[str, List[str]] = {
             k: [] for k in Quirks.quirkinfo.dmi_keys
         }
+        # x_snippet as written by xkit, once it has been parsed
+        self.x_config: Optional[str] = None
+
+    def get_x_config(self) -> str:
+        """Return the XorgSnippet as xkit writes it to xorg.conf.d.
+
+        The snippet is parsed in memory, and only the first time.
+        """
+        if self.x_config is None:
+            parser = xkit.xorgparser.Parser(io.StringIO(self.x_snippet))
+            logging.debug(parser.globaldict)
+            output = io.StringIO()
+            parser.write(output)
+            self.x_config = output.getvalue()
+        return self.x_config
+
+
+# a quoted value (which may lack its closing quote at the end of the line),
+# a comment, or a bare word
+_token_re = re.compile(r'"([^"]*)"?|(#)|([^\s"#]+)')
+
+
+def tokenize(line: str) -> List[str]:
+    """Split the values of a line.
+
+    Quotes are removed from values, and a comment ends the line.
+    """
+    # the usual line only has quoted values, with blanks between them
+    parts = line.split('"')
+    if len(parts) % 2 and not "".join(parts[::2]).strip():
+        return parts[1::2]
+
+    tokens = []
+    for quoted, comment, word in _token_re.findall(line):
+        if comment:
+            break
+        tokens.append(word or quoted)
+    return tokens
+
+
+def iter_quirks(lines: Iterable[str]) -> Iterator[Quirk]:
+    """Parse the quirks in lines, yielding each one as its section ends.
+
+    Every line is classified once by its keyword, and only the values of
+    the lines that need them are tokenized. Quirks without an Identifier are
+    skipped.
+    """
+    quirk: Optional[Quirk] = None
+
+    lines = iter(lines)
+    for line in lines:
+        words = line.split(None, 1)
+        if not words or words[0][0] == "#":
+            continue
+        keyword = words[0].lower()
+        rest = words[1] if len(words) > 1 else ""
+
+        if quirk is None:
+            if keyword == "section":
+                values = tokenize(rest)
+                if values and values[0].lower() == "quirk":
+                    quirk = Quirk()
+        elif keyword == "identifier":
+            if quirk.id is None:
+                quirk.id = " ".join(tokenize(rest))
+        elif keyword == "handler":
+            if not quirk.handler:
+                quirk.handler = " ".join(tokenize(rest)).split("|")
+        elif keyword == "match":
+            values = tokenize(rest)
+            if len(values) >= 2:
+                quirk.match_tags[values[0]] = values[1].split("|")
+        elif keyword == "xorgsnippet":
+            # the snippet is kept as it is, up to its end
+            x_snippet = []
+            for line in lines:
+                stripped = line.lstrip()
+                if stripped[:1] == "#":
+                    continue
+                if stripped[:14].lower() == "endxorgsnippet":
+                    break
+                x_snippet.append(line)
+            quirk.x_snippet = "".join(x_snippet)
+        elif keyword == "endsection":
+            if quirk.id:
+                yield quirk
+            quirk = None
 
 
 class ReadQuirk:
 
-    def __init__(self, source: Optional[str] = None) -> None:
+    def __init__(self, source: Optional[Union[str, IO[str]]] = None) -> None:
         self.source = source
+        self._quirks: List[Quirk] = []
 
         # See if the source is a file or a file object
         # and act accordingly
-        file = self.source
-        lines_list: List[str] = []
-        if file == None:
-            lines_list = []
-        else:
-            if not hasattr(file, "write"):  # it is a file
-                if isinstance(file, str):
-                    myfile = open(file, "r", encoding="utf-8")
-                    try:
-                        lines_list = myfile.readlines()
-                        myfile.close()
-                    except UnicodeDecodeError:
-                        lines_list = []
-                    myfile.close()
-            else:
-                # it is a file object
-                if hasattr(file, "readlines"):
-                    lines_list = file.readlines()  # type: ignore[union-attr]
-
-        inside_quirk = False
-        has_id = False
-        has_handler = False
-        inside_x_snippet = False
-        self._quirks: List[Quirk] = []
-
-        it = 0
-        for line in lines_list:
-            if line.strip().startswith("#"):
-                continue
-            if inside_quirk:
-                if inside_x_snippet:
-
-                    if line.lower().strip().startswith("endxorgsnippet"):
-                        inside_x_snippet = False
-                        continue
-                    else:
-                        self._quirks[it].x_snippet += line
-                else:
-                    # not in x_snippet
-                    if not has_id and line.lower().strip().startswith("identifier"):
-                        has_id = True
-                        temp_str = "identifier"
-                        id = (
-                            line[line.lower().rfind(temp_str) + len(temp_str) :]
-                            .strip()
-                            .replace('"', "")
-                        )
-                        self._quirks[it].id = id
-                        del temp_str
-                    elif not has_handler and line.lower().strip().startswith("handler"):
-                        has_handler = True
-                        temp_str = "handler"
-                        handler = (
-                            line[line.lower().rfind(temp_str) + len(temp_str) :]
-                            .strip()
-                            .replace('"', "")
-                        )
-                        handlers_list = handler.split("|")
-                        self._quirks[it].handler = handlers_list
-                        del temp_str
-                    elif line.lower().strip().startswith("match"):
-                        temp_str = "match"
-                        temp_bits = (
-                            line[line.lower().rfind(temp_str) + len(temp_str) :]
-                            .strip()
-                            .split('"')
-                        )
-                        tag_match = ""
-                        tag_value = ""
-                        tag_values: List[str] = []
-                        for elem in temp_bits:
-                            if elem.strip():
-                                if not tag_match:
-                                    tag_match = elem.strip()
-                                    # tag_values = []
-                                else:
-                                    tag_value = elem.strip()
-                                    tag_values = tag_value.split("|")
-                                    self._quirks[it].match_tags[tag_match] = tag_values
-                                    break
-                        del temp_bits
-                        del temp_str
-                        del tag_values
-                    elif line.lower().strip().startswith("xorgsnippet"):
-                        inside_x_snippet = True
-                        self._quirks[it].x_snippet = ""
-                        continue
-
-                    elif line.lower().strip().startswith("endsection"):
-                        # End Quirk
-                        inside_quirk = False
-                        if not self._quirks[it].id:
-                            self._quirks.pop(it)
-                        else:
-                            it += 1
-            else:
-                if (
-                    line.lower().strip().startswith("section")
-                    and "quirk" in line.lower()
-                ):
-                    # Begin Quirk
-                    inside_quirk = True
-                    temp_quirk = Quirk()
-                    self._quirks.append(temp_quirk)
-                    del temp_quirk
-                    continue
+        try:
+            if isinstance(source, str):
+                with open(source, "r", encoding="utf-8") as f:
+                    self._quirks = list(iter_quirks(f))
+            elif source is not None:
+                # a file object
+                self._quirks = list(iter_quirks(source))
+        except UnicodeDecodeError:
+            self._quirks = []
 
     def get_quirks(self) -> List[Quirk]:
         return self._quirks
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# (c) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import xkit.xorgparser
+
+import Quirks.quirkreader
+from Quirks.quirkreader import Quirk
+
+# where quirks-handler keeps the parsed quirks of the system's quirks directory
+cache_path = "/var/cache/ubuntu-drivers-common/quirks.json"
+
+# bump when the format of the cache, or what ReadQuirk parses, changes
+CACHE_VERSION = 3
+
+
+class QuirkStore:
+    """The quirks of a directory, parsed once and indexed by handler.
+
+    The parsed quirks, and their XorgSnippets as xkit writes them, are kept
+    in a JSON cache file, which is only rebuilt when a quirk file is added
+    or removed, or its mtime or size changes.
+    Without write access to the cache file, the quirks are parsed every time.
+    """
+
+    def __init__(self, path: str, cache_path: str = cache_path) -> None:
+        self.quirks_path = path
+        self.cache_path = cache_path
+        self._quirks: List[Dict[str, Any]] = []
+        # handler (lower case) -> indexes of its quirks in _quirks
+        self._handlers: Dict[str, List[int]] = {}
+        self._load()
+
+    def _signature(self) -> List[List[Any]]:
+        """Return name, mtime and size of every quirk file"""
+        signature = []
+        try:
+            entries = list(os.scandir(self.quirks_path))
+        except OSError:
+            logging.debug("%s does not exist" % self.quirks_path)
+            return []
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            signature.append([entry.name, stat.st_mtime_ns, stat.st_size])
+        return sorted(signature)
+
+    def _load(self) -> None:
+        signature = self._signature()
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if (
+                cache["version"] == CACHE_VERSION
+                and cache["path"] == self.quirks_path
+                and cache["signature"] == signature
+            ):
+                logging.debug("Using the quirks cached in %s" % self.cache_path)
+                self._quirks = cache["quirks"]
+                self._handlers = cache["handlers"]
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        logging.debug("Parsing the quirks in %s" % self.quirks_path)
+        self._quirks = []
+        self._handlers = {}
+        for name, _mtime, _size in signature:
+            quirk_file = os.path.join(self.quirks_path, name)
+            logging.debug("Parsing %s" % quirk_file)
+            for quirk in Quirks.quirkreader.ReadQuirk(quirk_file).get_quirks():
+                try:
+                    quirk.get_x_config()
+                except xkit.xorgparser.ParseException as e:
+                    # applying the quirk reports this
+                    logging.debug("Cannot parse the snippet of %s: %s" % (quirk.id, e))
+                for handler in {x.lower().strip() for x in quirk.handler}:
+                    self._handlers.setdefault(handler, []).append(len(self._quirks))
+                self._quirks.append(
+                    {
+                        "id": quirk.id,
+                        "handler": quirk.handler,
+                        "x_snippet": quirk.x_snippet,
+                        "match_tags": quirk.match_tags,
+                        "x_config": quirk.x_config,
+                    }
+                )
+        self._save(signature)
+
+    def _save(self, signature: List[List[Any]]) -> None:
+        cache_dir = os.path.dirname(self.cache_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # replace the cache atomically, so that readers see either one
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".quirks-")
+        except OSError as e:
+            logging.debug("Cannot write %s: %s" % (self.cache_path, e))
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "version": CACHE_VERSION,
+                        "path": self.quirks_path,
+                        "signature": signature,
+                        "quirks": self._quirks,
+                        "handlers": self._handlers,
+                    },
+                    f,
+                )
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.debug("Cannot write %s: %s" % (self.cache_path, e))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def get_quirks(self, handler: Optional[str] = None) -> List[Quirk]:
+        """Return the quirks for handler, or all quirks"""
+        if handler is None:
+            selected = self._quirks
+        else:
+            selected = [
+                self._quirks[i] for i in self._handlers.get(handler.lower().strip(), [])
+            ]
+
+        quirks = []
+        for record in selected:
+            quirk = Quirk(id=record["id"], handler=list(record["handler"]))
+            quirk.x_snippet = record["x_snippet"]
+            quirk.x_config = record["x_config"]
+            quirk.match_tags.update(
+                (tag, list(values)) for tag, values in record["match_tags"].items()
+            )
+            quirks.append(quirk)
+        return quirks
@@ -0,0 +1,259 @@
+"""One walk over the packages of an apt cache for all of its consumers.
+
+The kernel checks, the modalias index, the NVIDIA driver lookup and the
+queries for installed packages each used to iterate over all packages of the
+cache on their own, some of them once per driver.  Instead, each of them has a
+collector here that picks what it needs out of the packages.  The first lookup
+in the CacheScan of a cache walks the cache once and fills all of the
+collectors, whose results are then kept for that cache.
+
+The results are only kept while someone holds on to the CacheScan, so that
+the cache can be freed once its users are done with it: code that looks up
+several things in a row should do so in a scanning() block, or keep the
+return value of scan() around.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import contextlib
+import re
+import threading
+import weakref
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Type
+
+import apt_pkg
+
+import UbuntuDrivers.detect
+
+# kernel image packages, as opposed to the linux-image-* metapackages
+_KERNEL_IMAGE_RE = re.compile(
+    r"linux-image-(\d+\.\d+\.\d+-\d+|\w*unsigned-\d+\.\d+\.\d+-\d+)"
+)
+
+
+class Collector(object):
+    """Gather what one consumer needs from the packages of an apt cache.
+
+    add() is called for every package whose name starts with one of
+    *prefixes*, or for every package if there are none.
+    """
+
+    prefixes: Tuple[str, ...] = ()
+
+    def __init__(self, apt_cache: apt_pkg.Cache, depcache: apt_pkg.DepCache) -> None:
+        self.apt_cache = apt_cache
+        self.depcache = depcache
+
+    def add(self, package: apt_pkg.Package) -> None:
+        raise NotImplementedError
+
+
+class KernelCollector(Collector):
+    """The installed linux-image packages, in cache order."""
+
+    prefixes = ("linux-image",)
+
+    def __init__(self, apt_cache: apt_pkg.Cache, depcache: apt_pkg.DepCache) -> None:
+        super().__init__(apt_cache, depcache)
+        # linux-image* packages except linux-image-extra-*, for
+        # KernelDetection._get_linux_metapackage()
+        self.images: List[str] = []
+        # linux-image-* metapackages, for is_running_kernel_outdated()
+        self.metapackages: List[apt_pkg.Package] = []
+
+    def add(self, package: apt_pkg.Package) -> None:
+        if not package.current_ver:
+            return
+        name = package.name
+        if "extra" not in name:
+            self.images.append(name)
+        if name.startswith("linux-image-") and not _KERNEL_IMAGE_RE.match(name):
+            self.metapackages.append(package)
+
+
+class ModaliasCollector(Collector):
+    """The native packages with a Modaliases header, and that header."""
+
+    def __init__(self, apt_cache: apt_pkg.Cache, depcache: apt_pkg.DepCache) -> None:
+        super().__init__(apt_cache, depcache)
+        self.records = apt_pkg.PackageRecords(apt_cache)
+        self.architectures = ("all", UbuntuDrivers.detect.get_apt_arch())
+        self.packages: List[Tuple[apt_pkg.Package, str]] = []
+
+    def add(self, package: apt_pkg.Package) -> None:
+        # skip packages without a modalias field
+        try:
+            candidate = self.depcache.get_candidate_ver(package)
+            self.records.lookup(candidate.file_list[0])
+            modaliases = self.records["Modaliases"]
+            if not modaliases:
+                return
+        except (KeyError, AttributeError, UnicodeDecodeError):
+            return
+
+        # skip foreign architectures, we usually only want native
+        # driver packages
+        if package.architecture not in self.architectures:
+            UbuntuDrivers.detect.plan_decision(
+                "skipped",
+                package=package.get_fullname(),
+                reason="foreign-arch",
+                arch=package.architecture,
+            )
+            return
+        self.packages.append((package, modaliases))
+
+
+class InstalledCollector(Collector):
+    """The names of all installed packages."""
+
+    def __init__(self, apt_cache: apt_pkg.Cache, depcache: apt_pkg.DepCache) -> None:
+        super().__init__(apt_cache, depcache)
+        self.names: List[str] = []
+
+    def add(self, package: apt_pkg.Package) -> None:
+        if package.current_ver:
+            self.names.append(package.name)
+
+
+class NvidiaCollector(Collector):
+    """The names of all nvidia-driver-* packages, installable or not."""
+
+    prefixes = ("nvidia-driver-",)
+
+    def __init__(self, apt_cache: apt_pkg.Cache, depcache: apt_pkg.DepCache) -> None:
+        super().__init__(apt_cache, depcache)
+        self.names: Set[str] = set()
+
+    def add(self, package: apt_pkg.Package) -> None:
+        self.names.add(package.name)
+
+
+COLLECTORS: Dict[str, Type[Collector]] = {
+    "kernel": KernelCollector,
+    "modalias": ModaliasCollector,
+    "installed": InstalledCollector,
+    "nvidia": NvidiaCollector,
+}
+
+
+class CacheScan(object):
+    """The collectors filled from one apt cache so far."""
+
+    def __init__(self, apt_cache: apt_pkg.Cache) -> None:
+        self.apt_cache = apt_cache
+        self.collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def collect(self, names: Tuple[str, ...]) -> None:
+        """Make sure that the collectors *names* are filled.
+
+        If any of them is not, all collectors that are not filled yet are
+        filled in one walk over the packages, so that later lookups do not
+        walk the cache again.
+        """
+        with self._lock:
+            self._collect(names)
+
+    def _collect(self, names: Tuple[str, ...]) -> None:
+        if all(name in self.collectors for name in names):
+            return
+
+        missing = [name for name in COLLECTORS if name not in self.collectors]
+
+        depcache = apt_pkg.DepCache(self.apt_cache)
+        new = {name: COLLECTORS[name](self.apt_cache, depcache) for name in missing}
+        every_package = [c for c in new.values() if not c.prefixes]
+        by_prefix = [(prefix, c) for c in new.values() for prefix in c.prefixes]
+        with UbuntuDrivers.detect.detection_phase("apt-scan"):
+            for package in self.apt_cache.packages:
+                for collector in every_package:
+                    collector.add(package)
+                if by_prefix:
+                    name = package.name
+                    for prefix, collector in by_prefix:
+                        if name.startswith(prefix):
+                            collector.add(package)
+        self.collectors.update(new)
+
+    @property
+    def kernel(self) -> KernelCollector:
+        self.collect(("kernel",))
+        collector = self.collectors["kernel"]
+        assert isinstance(collector, KernelCollector)
+        return collector
+
+    @property
+    def modalias(self) -> ModaliasCollector:
+        self.collect(("modalias",))
+        collector = self.collectors["modalias"]
+        assert isinstance(collector, ModaliasCollector)
+        return collector
+
+    @property
+    def installed(self) -> InstalledCollector:
+        self.collect(("installed",))
+        collector = self.collectors["installed"]
+        assert isinstance(collector, InstalledCollector)
+        return collector
+
+    @property
+    def nvidia(self) -> NvidiaCollector:
+        self.collect(("nvidia",))
+        collector = self.collectors["nvidia"]
+        assert isinstance(collector, NvidiaCollector)
+        return collector
+
+
+# the scan of the cache that was used last, as long as it is in use; a scan
+# holds its cache, so while it is alive no other cache can take the address of
+# that one
+_last_scan: "Optional[weakref.ref[CacheScan]]" = None
+_lock = threading.Lock()
+
+
+def scan(apt_cache: apt_pkg.Cache, *collectors: str) -> CacheScan:
+    """Return the CacheScan of *apt_cache*.
+
+    If any of *collectors* (names of COLLECTORS) is not filled yet, this fills
+    all collectors in one walk over the cache; otherwise that happens on the
+    first lookup.
+    """
+    global _last_scan
+
+    with _lock:
+        cache_scan = _last_scan() if _last_scan is not None else None
+        if cache_scan is None or cache_scan.apt_cache is not apt_cache:
+            cache_scan = CacheScan(apt_cache)
+            _last_scan = weakref.ref(cache_scan)
+    cache_scan.collect(collectors)
+    return cache_scan
+
+
+@contextlib.contextmanager
+def scanning(apt_cache: apt_pkg.Cache, *collectors: str) -> Iterator[CacheScan]:
+    """Share one CacheScan of *apt_cache* between all scan() calls in the
+    block, like scan() for *collectors*.
+
+    The scan is kept until the end of the block, and then released unless an
+    enclosing block or another holder still uses it.
+    """
+    global _last_scan
+
+    with _lock:
+        current = _last_scan() if _last_scan is not None else None
+        held = current is not None and current.apt_cache is apt_cache
+        del current
+    cache_scan = scan(apt_cache, *collectors)
+    try:
+        yield cache_scan
+    finally:
+        if not held:
+            with _lock:
+                if _last_scan is not None and _last_scan() is cache_scan:
+                    _last_scan = None
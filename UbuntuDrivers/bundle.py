@@ -0,0 +1,325 @@
+"""Offline installation bundles.
+
+A bundle is a directory with a flat, unsigned apt repository that holds the
+driver packages "ubuntu-drivers install" would install, together with all of
+their dependencies, and the list of those driver packages.  Machines without
+archive access install from it with "ubuntu-drivers install --from-bundle",
+which neither detects nor downloads anything.
+
+The packages of a bundle are trusted without any verification, like those of
+a "trusted=yes" apt source, so it must come over a trusted path.  Bundles that
+other users could have changed are refused.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import apt_pkg
+import apt.progress.base
+import apt.progress.text
+
+import UbuntuDrivers.detect
+
+# the packages to install, and the options they were planned with
+PLAN_FILE = "ubuntu-drivers-bundle.json"
+BUNDLE_VERSION = 1
+
+
+class BundleError(Exception):
+    """A bundle could not be created or read."""
+
+
+def _pick(
+    depcache: apt_pkg.DepCache,
+    or_group: List[apt_pkg.Dependency],
+    chosen: Dict[str, apt_pkg.Version],
+) -> Optional[apt_pkg.Version]:
+    """Return the candidate version that satisfies *or_group*.
+
+    Like apt, this prefers the first alternative, but one that is already
+    part of the closure satisfies the group as well.
+    """
+    first = None
+    for dep in or_group:
+        for target in dep.all_targets():
+            package = target.parent_pkg
+            candidate = depcache.get_candidate_ver(package)
+            if candidate is None or candidate.id != target.id:
+                continue
+            if package.get_fullname(True) in chosen:
+                return candidate
+            if first is None:
+                first = candidate
+    return first
+
+
+def dependency_closure(
+    cache: apt_pkg.Cache, packages: Iterable[str]
+) -> List[apt_pkg.Version]:
+    """Return the candidate versions of *packages* and of everything they
+    depend on, whether it is installed on this system or not.
+
+    Recommends are followed too if apt installs them (APT::Install-Recommends).
+
+    Raises:
+        BundleError: if a package or dependency has no candidate.
+    """
+    depcache = apt_pkg.DepCache(cache)
+    dep_types = ["PreDepends", "Depends"]
+    if apt_pkg.config.find_b("APT::Install-Recommends", True):
+        dep_types.append("Recommends")
+
+    chosen: Dict[str, apt_pkg.Version] = {}
+    queue = []
+    for name in packages:
+        try:
+            candidate = depcache.get_candidate_ver(cache[name])
+        except KeyError:
+            candidate = None
+        if candidate is None:
+            raise BundleError(f"Package {name} has no installation candidate")
+        queue.append(candidate)
+
+    while queue:
+        version = queue.pop()
+        name = version.parent_pkg.get_fullname(True)
+        if name in chosen:
+            continue
+        chosen[name] = version
+        for dep_type in dep_types:
+            for or_group in version.depends_list.get(dep_type, []):
+                target = _pick(depcache, or_group, chosen)
+                if target is not None:
+                    queue.append(target)
+                elif dep_type != "Recommends":
+                    raise BundleError(
+                        "Cannot satisfy %s of %s: %s"
+                        % (
+                            dep_type,
+                            name,
+                            " | ".join(dep.target_pkg.name for dep in or_group),
+                        )
+                    )
+    return sorted(chosen.values(), key=lambda v: v.parent_pkg.get_fullname(True))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_bundle(
+    cache: apt_pkg.Cache,
+    to_install: List[str],
+    output: str,
+    options: Optional[Dict[str, Any]] = None,
+    progress: Optional[apt.progress.base.AcquireProgress] = None,
+) -> List[str]:
+    """Write a bundle for installing *to_install* into directory *output*.
+
+    *options* are recorded in the plan file for reference.  All packages are
+    downloaded in one apt_pkg.Acquire run, which fetches from all mirrors in
+    parallel.
+
+    Return the file names of the packages in the bundle.
+
+    Raises:
+        BundleError: if the packages cannot be resolved or downloaded.
+    """
+    versions = dependency_closure(cache, to_install)
+    os.makedirs(output, exist_ok=True)
+
+    sources = apt_pkg.SourceList()
+    sources.read_main_list()
+    records = apt_pkg.PackageRecords(cache)
+    fetcher = apt_pkg.Acquire(progress or apt.progress.text.AcquireProgress())
+    stanzas = []
+    # the fetcher drops items that are garbage collected
+    items = []
+    for version in versions:
+        for package_file, index in version.file_list:
+            index_file = sources.find_index(package_file)
+            if index_file is not None:
+                break
+        else:
+            raise BundleError(
+                f"{version.parent_pkg.get_fullname(True)} {version.ver_str} "
+                "is not available from any archive"
+            )
+        records.lookup((package_file, index))
+        filename = os.path.basename(records.filename)
+        item = apt_pkg.AcquireFile(
+            fetcher,
+            uri=index_file.archive_uri(records.filename),
+            hash=records.hashes,
+            size=version.size,
+            descr=filename,
+            short_descr=version.parent_pkg.name,
+            destfile=os.path.join(output, filename),
+        )
+        items.append(item)
+        stanzas.append((records.record, filename))
+
+    # copy packages from file: archives, rather than linking to them
+    source_symlinks = apt_pkg.config.find("Acquire::Source-Symlinks")
+    apt_pkg.config["Acquire::Source-Symlinks"] = "false"
+    try:
+        with UbuntuDrivers.detect.detection_phase("apt-fetch"):
+            fetcher.run()
+    finally:
+        if source_symlinks:
+            apt_pkg.config["Acquire::Source-Symlinks"] = source_symlinks
+        else:
+            apt_pkg.config.clear("Acquire::Source-Symlinks")
+    failed = [
+        f"{item.desc_uri}: {item.error_text}"
+        for item in items
+        if item.status != item.STAT_DONE
+    ]
+    if failed:
+        raise BundleError("Failed to fetch " + ", ".join(failed))
+
+    packages_index = os.path.join(output, "Packages")
+    # unbuffered, as TagSection.write() writes to the file descriptor
+    with open(packages_index, "wb", buffering=0) as f:
+        for record, filename in stanzas:
+            apt_pkg.TagSection(record).write(
+                f,
+                apt_pkg.REWRITE_PACKAGE_ORDER,
+                [apt_pkg.TagRewrite("Filename", filename)],
+            )
+            f.write(b"\n")
+
+    # apt wants a Release file even for a trusted repository
+    with open(os.path.join(output, "Release"), "w") as f:
+        f.write(
+            "Date: %s\nSHA256:\n %s %i Packages\n"
+            % (
+                time.strftime("%a, %d %b %Y %H:%M:%S UTC", time.gmtime()),
+                _sha256(packages_index),
+                os.path.getsize(packages_index),
+            )
+        )
+
+    with open(os.path.join(output, PLAN_FILE), "w") as f:
+        json.dump(
+            {
+                "version": BUNDLE_VERSION,
+                "packages": to_install,
+                "options": options or {},
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+    # installing refuses bundles that other users can change, whatever the
+    # umask was
+    written = [filename for _record, filename in stanzas]
+    for name in ["", "Packages", "Release", PLAN_FILE] + written:
+        path = os.path.join(output, name)
+        os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWGRP | stat.S_IWOTH))
+
+    return written
+
+
+def read_plan(bundle: str) -> List[str]:
+    """Return the packages that *bundle* is meant to install.
+
+    Raises:
+        BundleError: if it is not a bundle.
+    """
+    try:
+        with open(os.path.join(bundle, PLAN_FILE)) as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as ex:
+        raise BundleError(f"{bundle} is not an ubuntu-drivers bundle: {ex}") from ex
+    if plan.get("version") != BUNDLE_VERSION:
+        raise BundleError(f"Unsupported bundle version {plan.get('version')}")
+    packages: List[str] = plan["packages"]
+    return packages
+
+
+def check_bundle_owner(bundle: str) -> None:
+    """Make sure that only root, or the user running this, can have changed
+    *bundle* or the files in it.
+
+    Raises:
+        BundleError: if any of them belongs to another user, is writable by
+            its group or by others, or is a symbolic link.
+    """
+    owners = {0, os.geteuid()}
+    try:
+        paths = [bundle] + [os.path.join(bundle, name) for name in os.listdir(bundle)]
+        for path in paths:
+            info = os.stat(path) if path == bundle else os.lstat(path)
+            if stat.S_ISLNK(info.st_mode):
+                raise BundleError(f"{path} is a symbolic link")
+            if info.st_uid not in owners:
+                raise BundleError(f"{path} is not owned by root")
+            if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                raise BundleError(f"{path} is writable by other users")
+    except OSError as ex:
+        raise BundleError(f"Cannot check {bundle}: {ex}") from ex
+
+
+def open_bundle_cache(
+    bundle: str, progress: Optional[apt.progress.base.AcquireProgress] = None
+) -> apt_pkg.Cache:
+    """Open an apt cache in which *bundle* is the only archive.
+
+    This changes the apt configuration of this process for good, so that
+    installing from the cache uses the bundle, too.  The package lists of the
+    system are neither used nor changed.  The bundle is not signed, and its
+    packages are trusted without verification once check_bundle_owner()
+    accepts it.
+
+    Raises:
+        BundleError: if the bundle could have been changed by other users, or
+            its index cannot be read.
+    """
+    bundle = os.path.abspath(bundle)
+    check_bundle_owner(bundle)
+    state = tempfile.mkdtemp(prefix="ubuntu-drivers-bundle-")
+    atexit.register(shutil.rmtree, state, True)
+    # apt removes anything but package lists from the lists directory
+    lists = os.path.join(state, "lists")
+    os.makedirs(os.path.join(lists, "partial"))
+    sources_list = os.path.join(state, "sources.list")
+    with open(sources_list, "w") as f:
+        f.write(f"deb [trusted=yes] file:{bundle} ./\n")
+
+    with UbuntuDrivers.detect.detection_phase("apt-open"):
+        apt_pkg.config["Dir::Etc::SourceList"] = sources_list
+        apt_pkg.config["Dir::Etc::SourceParts"] = "/dev/null"
+        apt_pkg.config["Dir::State::Lists"] = lists
+        # do not replace the system's cache files with ones for the bundle
+        apt_pkg.config["Dir::Cache::pkgcache"] = ""
+        apt_pkg.config["Dir::Cache::srcpkgcache"] = ""
+        sources = apt_pkg.SourceList()
+        sources.read_main_list()
+        try:
+            if not apt_pkg.Cache(None).update(
+                progress or apt.progress.base.AcquireProgress(), sources
+            ):
+                raise BundleError(f"Cannot read the package index of {bundle}")
+            return apt_pkg.Cache(None)
+        except SystemError as ex:
+            raise BundleError(str(ex)) from ex
@@ -10,17 +10,19 @@
 
 import os
 import logging
+import contextlib
 import fnmatch
 import subprocess
 import functools
+import hashlib
 import re
 import json
-from typing import Optional, Dict, List, Set, Tuple, Any, TypedDict
+from typing import Optional, Dict, List, Set, Tuple, Any, TypedDict, Callable, Iterator
 from functools import cmp_to_key
 
 import apt_pkg
 
-from UbuntuDrivers import kerneldetection
+from UbuntuDrivers import aptscan, kerneldetection, welcome
 
 
 class DriverInfo(TypedDict, total=False):
@@ -57,12 +59,55 @@ class PackageInfo(TypedDict, total=False):
     support: Optional[str]
     open_preferred: bool
     metapackage: str
+    runtimepm: bool
 
 
 system_architecture = ""
 lookup_cache: Dict[str, Dict[str, Any]] = {}
 custom_supported_gpus_json = "/etc/custom_supported_gpus.json"
 
+# Callables invoked as hook(phase, started) at the start and at the end of each
+# phase of detection, see detection_phase().
+phase_hooks: List[Callable[[str, bool], None]] = []
+
+# Callables invoked as hook(decision) for every decision of the driver
+# installation planner, see plan_decision().
+decision_hooks: List[Callable[[Dict[str, Any]], None]] = []
+
+
+@contextlib.contextmanager
+def detection_phase(name: str) -> Iterator[None]:
+    """Run the enclosed code as detection phase name.
+
+    The phases are "apt-open", "apt-scan", "modalias-scan", "index-build",
+    "device-resolution" (once per device), "hwdb", "plugins", "linux-modules"
+    (once per get_linux_modules_metapackage() call) and "spawn" (around every
+    external command run). The ubuntu-drivers command adds "kernel-check" and
+    "apt-get". Phases can nest. Hooks can raise an exception to abort detection
+    between phases.
+    """
+    for hook in phase_hooks:
+        hook(name, True)
+    try:
+        yield
+    finally:
+        for hook in phase_hooks:
+            hook(name, False)
+
+
+def plan_decision(step: str, **details: Any) -> None:
+    """Report a decision of the driver installation planner to decision_hooks.
+
+    step is one of "skipped" (with a "reason"), "ranked", "selected",
+    "kept" and "modules-probe"; details describe the decision, usually
+    including the "package" it is about. This does nothing without hooks.
+    """
+    if not decision_hooks:
+        return
+    decision = dict(details, step=step)
+    for hook in decision_hooks:
+        hook(decision)
+
 
 class NvidiaPkgNameInfo(object):
     """Class to process NVIDIA package names"""
@@ -157,6 +202,11 @@ def system_modaliases(sys_path: Optional[str] = None) -> Dict[str, str]:
 
     Return a modalias → sysfs path map.
     """
+    with detection_phase("modalias-scan"):
+        return _system_modaliases(sys_path)
+
+
+def _system_modaliases(sys_path: Optional[str]) -> Dict[str, str]:
     aliases = {}
     devices = f"{sys_path}/devices" if sys_path else "/sys/devices"
     for path, dirs, files in os.walk(devices):
@@ -197,8 +247,24 @@ def system_modaliases(sys_path: Optional[str] = None) -> Dict[str, str]:
     return aliases
 
 
+def hardware_fingerprint(modaliases: Dict[str, str]) -> str:
+    """Get a stable digest of a system_modaliases() map.
+
+    Two systems (or two boots of one system) with the same fingerprint expose
+    the same devices at the same sysfs paths, and therefore get the same
+    detection result from the same apt state.
+
+    Return a hex string.
+    """
+    digest = hashlib.sha256()
+    for alias, path in sorted(modaliases.items()):
+        digest.update(f"{path}\0{alias}\n".encode())
+    return digest.hexdigest()
+
+
 def _check_video_abi_compat(apt_cache: apt_pkg.Cache, package: apt_pkg.Package) -> bool:
     xorg_video_abi = None
+    driver_name = package.name
 
     if package.name.startswith("nvidia-driver-"):
         xorg_driver_name = package.name.replace(
@@ -260,6 +326,9 @@ def _check_video_abi_compat(apt_cache: apt_pkg.Cache, package: apt_pkg.Package)
             package.name,
             xorg_video_abi,
         )
+        plan_decision(
+            "skipped", package=driver_name, reason="abi-mismatch", abi=xorg_video_abi
+        )
         logging.debug(
             "%s is not in %s"
             % (package, [x.parent_pkg for x in abi_pkg.rev_depends_list])  # type: ignore[attr-defined]
@@ -280,26 +349,15 @@ def apt_cache_modalias_map(
     Return a map bus -> modalias -> [package, ...], where "bus" is the prefix of
     the modalias up to the first ':' (e. g. "pci" or "usb").
     """
-    depcache = apt_pkg.DepCache(apt_cache)
-    records = apt_pkg.PackageRecords(apt_cache)
+    with detection_phase("index-build"):
+        return _apt_cache_modalias_map(apt_cache)
 
-    result: Dict[str, Dict[str, Set[str]]] = {}
-    for package in apt_cache.packages:
-        # skip packages without a modalias field
-        try:
-            candidate = depcache.get_candidate_ver(package)
-            records.lookup(candidate.file_list[0])
-            m = records["Modaliases"]
-            if not m:
-                continue
-        except (KeyError, AttributeError, UnicodeDecodeError):
-            continue
-
-        # skip foreign architectures, we usually only want native
-        # driver packages
-        if package.architecture not in ("all", get_apt_arch()):
-            continue
 
+def _apt_cache_modalias_map(
+    apt_cache: apt_pkg.Cache,
+) -> Dict[str, Tuple[Any, Dict[str, Set[str]]]]:
+    result: Dict[str, Dict[str, Set[str]]] = {}
+    for package, m in aptscan.scan(apt_cache).modalias.packages:
         if not _check_video_abi_compat(apt_cache, package):
             continue
 
@@ -375,8 +433,6 @@ def packages_for_modalias(
 
     Return a list of apt.Package objects.
     """
-    pkgs = set()
-
     if modalias_map is None:
         modalias_map = apt_cache_modalias_map(apt_cache)
 
@@ -389,23 +445,42 @@ def packages_for_modalias(
         if nvamd is not None:
             nvamdn = "nvidia-driver-%s" % nvamd
             nvamda = "pci:v000010DEd0000%s*" % did
-            for p in apt_cache.packages:
-                if p.get_fullname().split(":")[0] == nvamdn:
-                    bus_map[nvamda] = set([nvamdn])
-                    found = 1
+            if nvamdn in aptscan.scan(apt_cache).nvidia.names:
+                bus_map[nvamda] = set([nvamdn])
+                found = 1
         if nvamd is not None and not found:
             logging.debug("%s is not in the package pool." % nvamdn)
 
-    if not found:
-        if pat is None or not pat.match(modalias):
-            return []
+    if found:
+        pkgs = _bus_map_packages(bus_map, modalias)
+    else:
+        pkgs = modalias_map_packages(modalias_map, modalias)
+
+    return [apt_cache[p] for p in pkgs]
 
+
+def _bus_map_packages(bus_map: Dict[str, Set[str]], modalias: str) -> Set[str]:
+    pkgs = set()
     for alias in bus_map:
         if fnmatch.fnmatchcase(modalias.lower(), alias.lower()):
-            for p in bus_map[alias]:
-                pkgs.add(p)
+            pkgs.update(bus_map[alias])
+    return pkgs
 
-    return [apt_cache[p] for p in pkgs]
+
+def modalias_map_packages(
+    modalias_map: Dict[str, Tuple[Any, Dict[str, Set[str]]]], modalias: str
+) -> Set[str]:
+    """Search an apt_cache_modalias_map() for packages which match modalias.
+
+    Unlike packages_for_modalias() this does not need an apt cache, and thus
+    does not consider the custom supported GPUs list.
+
+    Return a set of package names.
+    """
+    pat, bus_map = modalias_map.get(modalias.split(":", 1)[0], (None, {}))
+    if pat is None or not pat.match(modalias):
+        return set()
+    return _bus_map_packages(bus_map, modalias)
 
 
 def _is_package_free(apt_cache: apt_pkg.Cache, pkg: apt_pkg.Package) -> bool:
@@ -626,10 +701,11 @@ def _is_manual_install(apt_cache: apt_pkg.Cache, pkg: apt_pkg.Package) -> bool:
         return False
 
     try:
-        modinfo = subprocess.Popen(
-            ["modinfo", module], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        modinfo.communicate()
+        with detection_phase("spawn"):
+            modinfo = subprocess.Popen(
+                ["modinfo", module], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            modinfo.communicate()
     except (OSError, FileNotFoundError, subprocess.CalledProcessError) as e:
         logging.debug("_is_manual_install failed: %s", str(e))
         return False
@@ -656,9 +732,10 @@ def _get_db_name(syspath: str, alias: str) -> Tuple[Optional[str], Optional[str]
     Values are None if unknown.
     """
     try:
-        out = subprocess.check_output(
-            ["systemd-hwdb", "query", alias], universal_newlines=True
-        )
+        with detection_phase("spawn"):
+            out = subprocess.check_output(
+                ["systemd-hwdb", "query", alias], universal_newlines=True
+            )
     except (OSError, subprocess.CalledProcessError) as e:
         logging.debug(
             "_get_db_name(%s, %s): systemd-hwdb failed: %s", syspath, alias, str(e)
@@ -713,11 +790,69 @@ options nvidia-drm modeset=%d\n""" % (
     kms_fd.close()
 
 
+def _device_driver_packages(
+    apt_cache: apt_pkg.Cache,
+    alias: str,
+    syspath: str,
+    modalias_map: Dict[str, Tuple[Any, Dict[str, Set[str]]]],
+    freeonly: bool,
+    include_oem: bool,
+    names: bool = True,
+) -> Dict[str, PackageInfo]:
+    """Get the driver packages for a single device.
+
+    Return the same structure as system_driver_packages(), without the
+    "recommended" flags. If names is False, the vendor and model names are not
+    looked up.
+    """
+    packages: Dict[str, PackageInfo] = {}
+    for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
+        if freeonly and not _is_package_free(apt_cache, p):
+            continue
+        if not include_oem and fnmatch.fnmatch(p.name, "oem-*-meta"):
+            continue
+        packages[p.name] = {
+            "modalias": alias,
+            "syspath": syspath,
+            "free": _is_package_free(apt_cache, p),
+            "from_distro": _is_package_from_distro(apt_cache, p),
+            "support": _pkg_get_support(apt_cache, p),
+            "runtimepm": _is_runtimepm_supported(apt_cache, p, alias),
+            "open_preferred": _is_open_prefered(apt_cache, p),
+        }
+        if not names:
+            continue
+        with detection_phase("hwdb"):
+            (vendor, model) = _get_db_name(syspath, alias)
+        if vendor is not None:
+            packages[p.name]["vendor"] = vendor
+        if model is not None:
+            packages[p.name]["model"] = model
+    return packages
+
+
+def _mark_recommended_nvidia(packages: Dict[str, PackageInfo]) -> None:
+    """Add "recommended" flags for NVidia alternatives in packages."""
+    nvidia_packages = [p for p in packages if p.startswith("nvidia-")]
+    if nvidia_packages:
+        # Create a cache for looking up drivers to pick the best
+        # candidate
+        for key, value in packages.items():
+            if key.startswith("nvidia-"):
+                lookup_cache[key] = value
+        nvidia_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives))
+        recommended = nvidia_packages[-1]
+        for p in nvidia_packages:
+            packages[p]["recommended"] = p == recommended
+
+
 def system_driver_packages(
     apt_cache: Optional[apt_pkg.Cache] = None,
     sys_path: Optional[str] = None,
     freeonly: bool = False,
     include_oem: bool = True,
+    on_device: Optional[Callable[[str, Dict[str, PackageInfo]], None]] = None,
+    modalias_map: Optional[Dict[str, Tuple[Any, Dict[str, Set[str]]]]] = None,
 ) -> Dict[str, PackageInfo]:
     """Get driver packages that are available for the system.
 
@@ -753,6 +888,15 @@ def system_driver_packages(
       'recommended': Some drivers (nvidia, fglrx) come in multiple variants and
                      versions; these have this flag, where exactly one has
                      recommended == True, and all others False.
+
+    If on_device is given, it is called with the sysfs path (or the plugin
+    name) and the packages of every device as soon as that device has been
+    resolved, in the structure described above. Their "recommended" flags only
+    consider the packages of that device, so they can differ from the returned
+    ones when several devices match the same driver packages.
+
+    If you already have an apt_cache_modalias_map() for apt_cache, you can pass
+    it as modalias_map for efficiency.
     """
     modaliases = system_modaliases(sys_path)
 
@@ -763,56 +907,42 @@ def system_driver_packages(
             logging.error(ex)
             return {}
 
-    packages = {}
-    modalias_map = apt_cache_modalias_map(apt_cache)
-    for alias, syspath in modaliases.items():
-        for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
-            if freeonly and not _is_package_free(apt_cache, p):
-                continue
-            if not include_oem and fnmatch.fnmatch(p.name, "oem-*-meta"):
-                continue
-            packages[p.name] = {
-                "modalias": alias,
-                "syspath": syspath,
-                "free": _is_package_free(apt_cache, p),
-                "from_distro": _is_package_from_distro(apt_cache, p),
-                "support": _pkg_get_support(apt_cache, p),
-                "runtimepm": _is_runtimepm_supported(apt_cache, p, alias),
-                "open_preferred": _is_open_prefered(apt_cache, p),
-            }
-            (vendor, model) = _get_db_name(syspath, alias)
-            if vendor is not None:
-                packages[p.name]["vendor"] = vendor
-            if model is not None:
-                packages[p.name]["model"] = model
-
-    # Add "recommended" flags for NVidia alternatives
-    nvidia_packages = [p for p in packages if p.startswith("nvidia-")]
-    if nvidia_packages:
-        # Create a cache for looking up drivers to pick the best
-        # candidate
-        for key, value in packages.items():
-            if key.startswith("nvidia-"):
-                lookup_cache[key] = value
-        nvidia_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives))
-        recommended = nvidia_packages[-1]
-        for p in nvidia_packages:
-            packages[p]["recommended"] = p == recommended
-
-    # add available packages which need custom detection code
-    for plugin, pkgs in detect_plugin_packages(apt_cache).items():
-        for p in pkgs:
-            try:
-                apt_p = apt_cache[p]
-                packages[p] = {
-                    "free": _is_package_free(apt_cache, apt_p),
-                    "from_distro": _is_package_from_distro(apt_cache, apt_p),
-                    "plugin": plugin,
-                }
-            except KeyError:
-                logging.debug("Package %s plugin not available. Skipping." % p)
+    # all lookups below share one walk over the cache
+    with aptscan.scanning(apt_cache):
+        packages: Dict[str, PackageInfo] = {}
+        if modalias_map is None:
+            modalias_map = apt_cache_modalias_map(apt_cache)
+        for alias, syspath in modaliases.items():
+            with detection_phase("device-resolution"):
+                device_packages = _device_driver_packages(
+                    apt_cache, alias, syspath, modalias_map, freeonly, include_oem
+                )
+            packages.update(device_packages)
+            if on_device is not None and device_packages:
+                device_packages = {k: v.copy() for k, v in device_packages.items()}
+                _mark_recommended_nvidia(device_packages)
+                on_device(syspath, device_packages)
+
+        _mark_recommended_nvidia(packages)
+
+        # add available packages which need custom detection code
+        for plugin, pkgs in detect_plugin_packages(apt_cache).items():
+            plugin_packages: Dict[str, PackageInfo] = {}
+            for p in pkgs:
+                try:
+                    apt_p = apt_cache[p]
+                    plugin_packages[p] = {
+                        "free": _is_package_free(apt_cache, apt_p),
+                        "from_distro": _is_package_from_distro(apt_cache, apt_p),
+                        "plugin": plugin,
+                    }
+                except KeyError:
+                    logging.debug("Package %s plugin not available. Skipping." % p)
+            packages.update(plugin_packages)
+            if on_device is not None and plugin_packages:
+                on_device(plugin, {k: v.copy() for k, v in plugin_packages.items()})
 
-    return packages
+        return packages
 
 
 def _get_vendor_model_from_alias(alias: str) -> Tuple[Optional[str], Optional[str]]:
@@ -946,25 +1076,27 @@ def system_device_specific_metapackages(
             logging.error(ex)
             return {}
 
-    packages = {}
-    modalias_map = apt_cache_modalias_map(apt_cache)
-    for alias, syspath in modaliases.items():
-        for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
-            if not fnmatch.fnmatch(p.name, "oem-*-meta") and not fnmatch.fnmatch(
-                p.name, "hwe-*-meta"
-            ):
-                continue
-            packages[p.name] = {
-                "modalias": alias,
-                "syspath": syspath,
-                "free": _is_package_free(apt_cache, p),
-                "from_distro": _is_package_from_distro(apt_cache, p),
-                "recommended": True,
-                "support": _pkg_get_support(apt_cache, p),
-                "open_preferred": _is_open_prefered(apt_cache, p),
-            }
+    # all lookups below share one walk over the cache
+    with aptscan.scanning(apt_cache):
+        packages = {}
+        modalias_map = apt_cache_modalias_map(apt_cache)
+        for alias, syspath in modaliases.items():
+            for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
+                if not fnmatch.fnmatch(p.name, "oem-*-meta") and not fnmatch.fnmatch(
+                    p.name, "hwe-*-meta"
+                ):
+                    continue
+                packages[p.name] = {
+                    "modalias": alias,
+                    "syspath": syspath,
+                    "free": _is_package_free(apt_cache, p),
+                    "from_distro": _is_package_from_distro(apt_cache, p),
+                    "recommended": True,
+                    "support": _pkg_get_support(apt_cache, p),
+                    "open_preferred": _is_open_prefered(apt_cache, p),
+                }
 
-    return packages
+        return packages
 
 
 def system_gpgpu_driver_packages(
@@ -1012,50 +1144,54 @@ def system_gpgpu_driver_packages(
             logging.error(ex)
             return {}
 
-    packages = {}
-    modalias_map = apt_cache_modalias_map(apt_cache)
-    for alias, syspath in modaliases.items():
-        for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
-            (vendor, model) = _get_db_name(syspath, alias)
-            vendor_id, model_id = _get_vendor_model_from_alias(alias)
-            if (vendor_id is not None) and (vendor_id.lower() in vendors_whitelist):
-                packages[p.name] = {
-                    "modalias": alias,
-                    "syspath": syspath,
-                    "free": _is_package_free(apt_cache, p),
-                    "from_distro": _is_package_from_distro(apt_cache, p),
-                    "support": _pkg_get_support(apt_cache, p),
-                    "open_preferred": _is_open_prefered(apt_cache, p),
-                }
-                if vendor is not None:
-                    packages[p.name]["vendor"] = vendor
-                if model is not None:
-                    packages[p.name]["model"] = model
-                metapackage = _get_headless_no_dkms_metapackage(p, apt_cache)
-
-                if metapackage is not None:
-                    packages[p.name]["metapackage"] = metapackage
-
-    # Add "recommended" flags for NVidia alternatives
-    nvidia_packages = [p for p in packages if p.startswith("nvidia-")]
-    if nvidia_packages:
-        # Create a cache for looking up drivers to pick the best
-        # candidate
-        for key, value in packages.items():
-            if key.startswith("nvidia-"):
-                lookup_cache[key] = value
-        nvidia_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives_gpgpu))
-        recommended = nvidia_packages[-1]
-        for p in nvidia_packages:
-            packages[p]["recommended"] = p == recommended
+    # all lookups below share one walk over the cache
+    with aptscan.scanning(apt_cache):
+        packages = {}
+        modalias_map = apt_cache_modalias_map(apt_cache)
+        for alias, syspath in modaliases.items():
+            for p in packages_for_modalias(apt_cache, alias, modalias_map=modalias_map):
+                (vendor, model) = _get_db_name(syspath, alias)
+                vendor_id, model_id = _get_vendor_model_from_alias(alias)
+                if (vendor_id is not None) and (vendor_id.lower() in vendors_whitelist):
+                    packages[p.name] = {
+                        "modalias": alias,
+                        "syspath": syspath,
+                        "free": _is_package_free(apt_cache, p),
+                        "from_distro": _is_package_from_distro(apt_cache, p),
+                        "support": _pkg_get_support(apt_cache, p),
+                        "open_preferred": _is_open_prefered(apt_cache, p),
+                    }
+                    if vendor is not None:
+                        packages[p.name]["vendor"] = vendor
+                    if model is not None:
+                        packages[p.name]["model"] = model
+                    metapackage = _get_headless_no_dkms_metapackage(p, apt_cache)
+
+                    if metapackage is not None:
+                        packages[p.name]["metapackage"] = metapackage
+
+        # Add "recommended" flags for NVidia alternatives
+        nvidia_packages = [p for p in packages if p.startswith("nvidia-")]
+        if nvidia_packages:
+            # Create a cache for looking up drivers to pick the best
+            # candidate
+            for key, value in packages.items():
+                if key.startswith("nvidia-"):
+                    lookup_cache[key] = value
+            nvidia_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives_gpgpu))
+            recommended = nvidia_packages[-1]
+            for p in nvidia_packages:
+                packages[p]["recommended"] = p == recommended
 
-    return packages
+        return packages
 
 
 def system_device_drivers(
     apt_cache: Optional[apt_pkg.Cache] = None,
     sys_path: Optional[str] = None,
     freeonly: bool = False,
+    on_device: Optional[Callable[[str, DeviceInfo], None]] = None,
+    modalias_map: Optional[Dict[str, Tuple[Any, Dict[str, Set[str]]]]] = None,
 ) -> Dict[str, DeviceInfo]:
     """Get by-device driver packages that are available for the system.
 
@@ -1110,8 +1246,15 @@ def system_device_drivers(
                      recommended == True, and all others False.
       'support':     Value of the package's apt "Support" field ("PB", "NFB",
                      "LTSB" or "Legacy"), or None if it declares none.
+
+    If on_device is given, it is called with the name and <device info> of
+    every device as soon as that device has been resolved. As with
+    system_driver_packages(), the "recommended" flags passed to it only
+    consider that device.
+
+    If you already have an apt_cache_modalias_map() for apt_cache, you can pass
+    it as modalias_map for efficiency.
     """
-    result: Dict[str, DeviceInfo] = {}
     if not apt_cache:
         try:
             apt_cache = apt_pkg.Cache(None)
@@ -1119,10 +1262,64 @@ def system_device_drivers(
             logging.error(ex)
             return {}
 
+    cache = apt_cache
+
+    def device_resolved(device_name: str, packages: Dict[str, PackageInfo]) -> None:
+        assert on_device is not None
+        on_device(
+            device_name, device_drivers_from_packages(cache, packages)[device_name]
+        )
+
+    # all lookups below share one walk over the cache
+    with aptscan.scanning(apt_cache):
+        packages = system_driver_packages(
+            apt_cache,
+            sys_path,
+            freeonly=freeonly,
+            on_device=device_resolved if on_device is not None else None,
+            modalias_map=modalias_map,
+        )
+        return device_drivers_from_packages(apt_cache, packages)
+
+
+def modalias_device_drivers(
+    apt_cache: apt_pkg.Cache,
+    modalias: str,
+    syspath: str,
+    freeonly: bool = False,
+    modalias_map: Optional[Dict[str, Tuple[Any, Dict[str, Set[str]]]]] = None,
+) -> Dict[str, DeviceInfo]:
+    """Get the driver packages for a single device, e. g. a hotplugged one.
+
+    Return the same structure as system_device_drivers() for just the device
+    at syspath with the given modalias, or an empty dictionary if no package
+    supports it. Detection plugins are not run, and the "recommended" flags
+    only consider that device.
+
+    If you already have an apt_cache_modalias_map() for apt_cache, you can pass
+    it as modalias_map for efficiency.
+    """
+    if modalias_map is None:
+        modalias_map = apt_cache_modalias_map(apt_cache)
+    with detection_phase("device-resolution"):
+        packages = _device_driver_packages(
+            apt_cache, modalias, syspath, modalias_map, freeonly, True
+        )
+    _mark_recommended_nvidia(packages)
+    return device_drivers_from_packages(apt_cache, packages)
+
+
+def device_drivers_from_packages(
+    apt_cache: apt_pkg.Cache, packages: Dict[str, PackageInfo]
+) -> Dict[str, DeviceInfo]:
+    """Group a system_driver_packages() result by device.
+
+    Return the same structure as system_device_drivers().
+    """
+    result: Dict[str, DeviceInfo] = {}
+
     # copy the system_driver_packages() structure into the by-device structure
-    for pkg, pkginfo in system_driver_packages(
-        apt_cache, sys_path, freeonly=freeonly
-    ).items():
+    for pkg, pkginfo in packages.items():
         if "syspath" in pkginfo:
             device_name = pkginfo["syspath"]
         else:
@@ -1165,14 +1362,8 @@ def get_installed_packages_by_glob(
     Returns:
         List of strings containing the names of all installed packages that match the pattern
     """
-    installed_packages = []
-
-    for package in apt_cache.packages:
-        package_name = package.name
-        if package.current_ver and fnmatch.fnmatch(package_name, glob_pattern):
-            installed_packages.append(package_name)
-
-    return sorted(installed_packages)
+    installed = aptscan.scan(apt_cache).installed.names
+    return sorted(fnmatch.filter(installed, glob_pattern))
 
 
 def get_desktop_package_list(
@@ -1182,14 +1373,24 @@ def get_desktop_package_list(
     include_oem: bool = True,
     driver_string: str = "",
     include_dkms: bool = False,
+    simulate: bool = False,
 ) -> List[str]:
-    """Return the list of packages that should be installed"""
+    """Return the list of packages that should be installed
+
+    With simulate, the system is not prepared for installing them, see
+    auto_install_filter().
+    """
     packages = system_driver_packages(
         apt_cache, sys_path, freeonly=free_only, include_oem=include_oem
     )
 
     to_install = auto_install_filter(
-        apt_cache, include_dkms, packages, driver_string, get_recommended=False
+        apt_cache,
+        include_dkms,
+        packages,
+        driver_string,
+        get_recommended=False,
+        simulate=simulate,
     )
     if not to_install:
         logging.debug("No drivers found for installation.")
@@ -1292,11 +1493,61 @@ def _sort_packages_by_preference(
         List of (package_name, package_info) tuples sorted by preference (most preferred first).
     """
     comparator = _cmp_gfx_alternatives_gpgpu if gpgpu else _cmp_gfx_alternatives
-    return sorted(
+    sorted_packages = sorted(
         packages.items(),
         key=cmp_to_key(lambda left, right: comparator(left[0], right[0])),
         reverse=True,
     )
+    if decision_hooks:
+        fit_level = _get_fit_level_gpgpu if gpgpu else _get_fit_level
+        plan_decision(
+            "ranked",
+            order=[p for p, _ in sorted_packages],
+            # what the comparator looks at, in this order, before the names
+            keys={
+                p: {
+                    "fit_level": fit_level(p),
+                    "support": _pkg_support_from_cache(p),
+                    "open_preferred": bool(_pkg_open_preferred_from_cache(p)),
+                }
+                for p, _ in sorted_packages
+                if p.startswith("nvidia-")
+            },
+        )
+    return sorted_packages
+
+
+def set_runtimepm_supported(cache: apt_pkg.Cache, packages: List[str]) -> None:
+    """Tell nvidia-prime whether one of packages supports runtime PM.
+
+    This creates /run/nvidia_runtimepm_supported, which
+    nvidia_desktop_post_installation_hook() checks, if the candidate of one
+    of the packages has a Runtimepm field. Plans that were made elsewhere,
+    like those of the D-Bus service or of a bundle, only list the packages,
+    so this has to be called for them before installing.
+    """
+    depcache = apt_pkg.DepCache(cache)
+    records = apt_pkg.PackageRecords(cache)
+    for p in packages:
+        try:
+            candidate_ver = depcache.get_candidate_ver(cache[p])
+        except KeyError:
+            continue
+        if candidate_ver is None:
+            continue
+        records.lookup(candidate_ver.file_list[0])
+        # See if runtimepm is supported
+        if records["runtimepm"]:
+            # Create a file for nvidia-prime
+            try:
+                pm_fd = open("/run/nvidia_runtimepm_supported", "w")
+                pm_fd.write("\n")
+                pm_fd.close()
+            except PermissionError:
+                # No need to error out here, since package
+                # installation will fail
+                pass
+            return
 
 
 def _build_installation_list(
@@ -1304,6 +1555,7 @@ def _build_installation_list(
     sorted_packages: List[Tuple[str, PackageInfo]],
     include_dkms: bool,
     gpgpu: bool = False,
+    simulate: bool = False,
 ) -> List[str]:
     """
     Build the list of packages to install including metapackages and modules.
@@ -1313,84 +1565,101 @@ def _build_installation_list(
         sorted_packages: List of (package_name, package_info) tuples sorted by preference.
         include_dkms: Boolean indicating whether to include DKMS packages.
         gpgpu: Boolean flag indicating whether to use GPGPU (server) mode.
+        simulate: Boolean, if True the list is only computed, without
+            preparing the system (nvidia-prime runtime PM flag) for installing it.
 
     Returns:
         List of package names to install including metapackages and module packages.
     """
-    depcache = apt_pkg.DepCache(cache)
     to_install: List[str] = []
 
-    driver_found: bool = False
-    for p, pkg_info in sorted_packages:
-        # in the past, as soon as the driver was found the loop would break
-        # but we want the loop to continue to run to make sure we also get hwe- metas,
-        # for example.
-        logging.debug("Processing package: " + str(p))
-        if not p.startswith("hwe-") and driver_found:
-            continue
-
-        if not gpgpu:
-            candidate_ver = depcache.get_candidate_ver(cache[p])
-            records = apt_pkg.PackageRecords(cache)
-            records.lookup(candidate_ver.file_list[0])
-            # See if runtimepm is supported
-            if records["runtimepm"]:
-                # Create a file for nvidia-prime
-                try:
-                    pm_fd = open("/run/nvidia_runtimepm_supported", "w")
-                    pm_fd.write("\n")
-                    pm_fd.close()
-                except PermissionError:
-                    # No need to error out here, since package
-                    # installation will fail
-                    pass
-
-        candidate = pkg_info.get("metapackage")
-        # Do not add more than one nvidia-driver-* (or associated packages) to to_install
-        if p.startswith("nvidia-driver-"):
-            if any(pkg.startswith("nvidia-driver-") for pkg in to_install):
+    # the kernel lookups for every package share one walk over the cache
+    with aptscan.scanning(cache):
+        driver_found: bool = False
+        for p, pkg_info in sorted_packages:
+            # in the past, as soon as the driver was found the loop would break
+            # but we want the loop to continue to run to make sure we also get hwe- metas,
+            # for example.
+            logging.debug("Processing package: " + str(p))
+            if not p.startswith("hwe-") and driver_found:
+                plan_decision("skipped", package=p, reason="driver-already-selected")
                 continue
 
-        if candidate:
-            if cache[candidate].current_ver:
-                to_install = []
-                driver_found = True
-                continue
+            if not gpgpu and not simulate:
+                set_runtimepm_supported(cache, [p])
+
+            candidate = pkg_info.get("metapackage")
+            # Do not add more than one nvidia-driver-* (or associated packages) to to_install
+            if p.startswith("nvidia-driver-"):
+                if any(pkg.startswith("nvidia-driver-") for pkg in to_install):
+                    plan_decision("skipped", package=p, reason="other-nvidia-driver")
+                    continue
+
+            if candidate:
+                if cache[candidate].current_ver:
+                    plan_decision(
+                        "kept",
+                        package=p,
+                        reason="metapackage-installed",
+                        metapackage=candidate,
+                    )
+                    to_install = []
+                    driver_found = True
+                    continue
+                else:
+                    to_install.append(p)
+                    to_install.append(candidate)
             else:
+                logging.debug("No candidate metapackage found for " + str(p))
                 to_install.append(p)
-                to_install.append(candidate)
-        else:
-            logging.debug("No candidate metapackage found for " + str(p))
-            to_install.append(p)
 
-        logging.debug("Candidate: " + str(candidate))
-        # Add the matching linux modules package
-        modules_package = get_linux_modules_metapackage(cache, p)
-        logging.debug(modules_package)
-        if modules_package and not cache[modules_package].current_ver:
-            if not include_dkms and "dkms" in modules_package:
-                if p in to_install:
-                    to_install.remove(p)
-                if candidate in to_install:
-                    to_install.remove(candidate)
-                continue
-            # Only remove the base package if using --gpgpu
-            # (since that is a headless install, whereas we want utils
-            #  on desktop)
-            if p in to_install and gpgpu:
-                to_install.remove(p)
-            to_install.append(modules_package)
-
-            lrm_meta = get_userspace_lrm_meta(cache, p)
-            if lrm_meta and not cache[lrm_meta].current_ver:
-                # Add the lrm meta and drop the non lrm one
-                to_install.append(lrm_meta)
+            logging.debug("Candidate: " + str(candidate))
+            # Add the matching linux modules package
+            modules_package = get_linux_modules_metapackage(cache, p)
+            logging.debug(modules_package)
+            if modules_package and not cache[modules_package].current_ver:
+                if not include_dkms and "dkms" in modules_package:
+                    plan_decision(
+                        "skipped",
+                        package=p,
+                        reason="dkms-excluded",
+                        linux_modules=modules_package,
+                    )
+                    if p in to_install:
+                        to_install.remove(p)
+                    if candidate in to_install:
+                        to_install.remove(candidate)
+                    continue
+                # Only remove the base package if using --gpgpu
+                # (since that is a headless install, whereas we want utils
+                #  on desktop)
                 if p in to_install and gpgpu:
                     to_install.remove(p)
-            driver_found = True
-            continue
+                to_install.append(modules_package)
+
+                lrm_meta = get_userspace_lrm_meta(cache, p)
+                if lrm_meta and not cache[lrm_meta].current_ver:
+                    # Add the lrm meta and drop the non lrm one
+                    to_install.append(lrm_meta)
+                    if p in to_install and gpgpu:
+                        to_install.remove(p)
+                plan_decision(
+                    "selected",
+                    package=p,
+                    metapackage=candidate,
+                    linux_modules=modules_package,
+                    lrm_metapackage=lrm_meta,
+                )
+                driver_found = True
+                continue
+            plan_decision(
+                "selected",
+                package=p,
+                metapackage=candidate,
+                linux_modules=modules_package,
+            )
 
-    return to_install
+        return to_install
 
 
 def _remove_already_installed(
@@ -1410,6 +1679,7 @@ def _remove_already_installed(
     for p in sorted(packages, reverse=True):
         if cache and cache[p].current_ver:
             logging.debug("Removing already-installed package from to_install: " + p)
+            plan_decision("skipped", package=p, reason="already-installed")
         else:
             filtered.append(p)
     return filtered
@@ -1420,6 +1690,7 @@ def already_installed_filter(
     packages: Dict[str, PackageInfo],
     include_dkms: bool,
     gpgpu: bool = False,
+    simulate: bool = False,
 ) -> List[str]:
     """
     Sort driver branch to install according to preference, then select
@@ -1432,6 +1703,8 @@ def already_installed_filter(
             and is filtered depending on the mode (desktop vs gpgpu) and user preferences.
         include_dkms: Boolean indicating whether to include DKMS packages.
         gpgpu: Boolean flag indicating whether to use GPGPU (server) sorting preferences.
+        simulate: Boolean, if True nothing on the system is changed, see
+            _build_installation_list().
 
     Takes a list of packages of this format:
     {'modalias': 'pci:v000010DEd000010C3sv00003842sd00002670bc03sc03i00',
@@ -1465,7 +1738,9 @@ def already_installed_filter(
     sorted_packages = _sort_packages_by_preference(packages, gpgpu)
 
     # Step 2: Build the installation list with metapackages and modules
-    to_install = _build_installation_list(cache, sorted_packages, include_dkms, gpgpu)
+    to_install = _build_installation_list(
+        cache, sorted_packages, include_dkms, gpgpu, simulate
+    )
 
     # Step 3: Filter out already installed packages
     to_install = _remove_already_installed(cache, to_install)
@@ -1474,55 +1749,13 @@ def already_installed_filter(
     return to_install
 
 
-def gpgpu_install_filter(
-    cache: Optional[apt_pkg.Cache],
-    include_dkms: bool,
-    packages: Dict[str, PackageInfo],
-    drivers_str: str,
-    get_recommended: bool = True,
-    gpgpu: bool = True,
-) -> List[str]:
-    drivers: List[_GpgpuDriver] = []
-    allow: List[str] = []
-    result: Dict[str, PackageInfo] = {}
-    """
-    Sort driver branch to install according to preference, then select
-    most appropriate modules package and filter out already installed packages.
+def _gpgpu_drivers(drivers_str: str) -> List[_GpgpuDriver]:
+    """Parse the driver string of gpgpu_install_filter().
 
-    Args:
-        cache: The apt cache object used to check installed packages.
-        include_dkms: Boolean indicating whether to include DKMS packages.
-        packages: Dict of package candidates to consider for installation.
-            Typically originates from system_driver_packages() or system_gpgpu_driver_packages(),
-            and is filtered depending on the mode (desktop vs gpgpu) and user preferences.
-        drivers_str: String specifying driver(s) and version(s) to filter for.
-        get_recommended: Boolean, if True only recommended packages are considered.
-        gpgpu: Boolean flag indicating whether to use GPGPU (server) sorting preferences.
-
-    Returns:
-        A list of drivers to be installed, of the form
-        ['nvidia-driver-410', 'nvidia-headless-no-dkms-410']
-
-    Ubuntu-drivers syntax
-
-    ubuntu-drivers autoinstall --gpgpu [[driver:]version]
-    ubuntu-drivers autoinstall --gpgpu driver[:version][,driver[:version]]
-
-    If no version is specified, gives the “current” supported version for the GPU in question.
-
-    Examples:
-        ubuntu-drivers autoinstall --gpgpu
-        ubuntu-drivers autoinstall --gpgpu 390
-        ubuntu-drivers autoinstall --gpgpu nvidia:390
-
-    Today this is only nvidia.  In the future there may be amdgpu-pro.
-    Possible syntax, to be confirmed only once there are driver packages that could use it:
-        ubuntu-drivers autoinstall --gpgpu nvidia:390,amdgpu
-        ubuntu-drivers autoinstall --gpgpu amdgpu:version
+    Returns an empty list if it does not name a valid driver, or names more
+    than one version of the same one.
     """
-    if not packages:
-        return list(result.keys())
-
+    drivers: List[_GpgpuDriver] = []
     if drivers_str:
         # Just one driver
         # e.g. --gpgpu 390
@@ -1570,7 +1803,14 @@ def gpgpu_install_filter(
         if not driver.flavour and not driver.vendor:
             drivers[it].vendor = "nvidia"
         it += 1
+    return drivers
+
 
+def _gpgpu_allowed(
+    packages: Dict[str, PackageInfo], drivers: List[_GpgpuDriver]
+) -> List[str]:
+    """Return the candidate packages that the parsed *drivers* select."""
+    allow: List[str] = []
     # Filter the packages
     # any package which matches any of those globs will be accepted
     for driver in drivers:
@@ -1579,7 +1819,62 @@ def gpgpu_install_filter(
         else:
             pattern = "%s*" % (driver.vendor)
         allow.extend(fnmatch.filter(packages, pattern))
-        # print(allow)
+    return allow
+
+
+def gpgpu_install_filter(
+    cache: Optional[apt_pkg.Cache],
+    include_dkms: bool,
+    packages: Dict[str, PackageInfo],
+    drivers_str: str,
+    get_recommended: bool = True,
+    gpgpu: bool = True,
+    simulate: bool = False,
+) -> List[str]:
+    result: Dict[str, PackageInfo] = {}
+    """
+    Sort driver branch to install according to preference, then select
+    most appropriate modules package and filter out already installed packages.
+
+    Args:
+        cache: The apt cache object used to check installed packages.
+        include_dkms: Boolean indicating whether to include DKMS packages.
+        packages: Dict of package candidates to consider for installation.
+            Typically originates from system_driver_packages() or system_gpgpu_driver_packages(),
+            and is filtered depending on the mode (desktop vs gpgpu) and user preferences.
+        drivers_str: String specifying driver(s) and version(s) to filter for.
+        get_recommended: Boolean, if True only recommended packages are considered.
+        gpgpu: Boolean flag indicating whether to use GPGPU (server) sorting preferences.
+        simulate: Boolean, if True nothing on the system is changed.
+
+    Returns:
+        A list of drivers to be installed, of the form
+        ['nvidia-driver-410', 'nvidia-headless-no-dkms-410']
+
+    Ubuntu-drivers syntax
+
+    ubuntu-drivers autoinstall --gpgpu [[driver:]version]
+    ubuntu-drivers autoinstall --gpgpu driver[:version][,driver[:version]]
+
+    If no version is specified, gives the “current” supported version for the GPU in question.
+
+    Examples:
+        ubuntu-drivers autoinstall --gpgpu
+        ubuntu-drivers autoinstall --gpgpu 390
+        ubuntu-drivers autoinstall --gpgpu nvidia:390
+
+    Today this is only nvidia.  In the future there may be amdgpu-pro.
+    Possible syntax, to be confirmed only once there are driver packages that could use it:
+        ubuntu-drivers autoinstall --gpgpu nvidia:390,amdgpu
+        ubuntu-drivers autoinstall --gpgpu amdgpu:version
+    """
+    if not packages:
+        return list(result.keys())
+
+    drivers = _gpgpu_drivers(drivers_str)
+    if len(drivers) < 1:
+        return []
+    allow = _gpgpu_allowed(packages, drivers)
 
     # FIXME: if no flavour is specified, pick the recommended driver ?
     # print('packages: %s' % packages)
@@ -1599,7 +1894,7 @@ def gpgpu_install_filter(
                         result[p] = packages[p]
                         # print('Found "recommended" flavour in %s' % (packages[p]))
                 break
-    return already_installed_filter(cache, result, include_dkms, gpgpu)
+    return already_installed_filter(cache, result, include_dkms, gpgpu, simulate)
 
 
 def auto_install_filter(
@@ -1609,6 +1904,7 @@ def auto_install_filter(
     drivers_str: str = "",
     get_recommended: bool = True,
     gpgpu: bool = False,
+    simulate: bool = False,
 ) -> List[str]:
     """
     Get packages which are appropriate for automatic installation.
@@ -1622,6 +1918,8 @@ def auto_install_filter(
         drivers_str: String specifying driver(s) and version(s) to filter for (optional).
         get_recommended: Boolean, if True only recommended packages are considered.
         gpgpu: Boolean flag indicating whether to use GPGPU (server) sorting preferences.
+        simulate: Boolean, if True nothing on the system is changed, so that
+            the result can be shown without installing it.
 
     Returns:
         The subset of the given list of packages which are appropriate for
@@ -1645,22 +1943,28 @@ def auto_install_filter(
     # If users specify a driver, use gpgpu_install_filter()
     if drivers_str:
         results = gpgpu_install_filter(
-            cache, include_dkms, packages, drivers_str, True, gpgpu
+            cache, include_dkms, packages, drivers_str, True, gpgpu, simulate
         )
         return results
 
     allow = []
     for pattern in whitelist:
         allow.extend(fnmatch.filter(packages, pattern))
+    if decision_hooks:
+        for p in packages:
+            if p not in allow:
+                plan_decision("skipped", package=p, reason="not-auto-installable")
 
     result = {}
     for p in allow:
         if get_recommended:
             if "recommended" not in packages[p] or packages[p]["recommended"]:
                 result[p] = packages[p]
+            else:
+                plan_decision("skipped", package=p, reason="not-recommended")
         else:
             result[p] = packages[p]
-    return already_installed_filter(cache, result, include_dkms, gpgpu)
+    return already_installed_filter(cache, result, include_dkms, gpgpu, simulate)
 
 
 def detect_plugin_packages(
@@ -1680,6 +1984,13 @@ def detect_plugin_packages(
 
     Return pluginname -> [package, ...] map.
     """
+    with detection_phase("plugins"):
+        return _detect_plugin_packages(apt_cache)
+
+
+def _detect_plugin_packages(
+    apt_cache: Optional[apt_pkg.Cache],
+) -> Dict[str, List[str]]:
     packages: Dict[str, List[str]] = {}
     plugindir = os.environ.get(
         "UBUNTU_DRIVERS_DETECT_DIR", "/usr/share/ubuntu-drivers-common/detect/"
@@ -2052,10 +2363,17 @@ def get_linux_image_from_meta(apt_cache, pkg: str) -> Optional[str]:  # type: ig
 
 def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:  # type: ignore[no-untyped-def]
     """Return the linux-modules-$driver metapackage for the system's kernel"""
+    with detection_phase("linux-modules"):
+        return _linux_modules_metapackage(apt_cache, candidate)
+
+
+def _linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:  # type: ignore[no-untyped-def]
     assert candidate is not None
     metapackage = None
     linux_flavour = ""
     linux_modules_match = ""
+    # the package names looked up, for plan_decision()
+    probed: List[str] = []
 
     depcache = apt_pkg.DepCache(apt_cache)
 
@@ -2065,10 +2383,16 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
             "Non NVIDIA linux-modules packages are not supported at this time: %s. Skipping"
             % candidate
         )
+        plan_decision(
+            "modules-probe", package=candidate, probed=probed, reason="not-nvidia"
+        )
         return metapackage
 
     if nvidia_info.has_obsolete_name_scheme():
         logging.debug("Legacy driver detected: %s. Skipping." % candidate)
+        plan_decision(
+            "modules-probe", package=candidate, probed=probed, reason="legacy-name"
+        )
         return metapackage
 
     linux_image_meta = get_linux_image(apt_cache)
@@ -2079,6 +2403,9 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
         linux_flavour = linux_image.replace("linux-image-", "")
     else:
         logging.debug("No linux-image can be found for %s. Skipping." % candidate)
+        plan_decision(
+            "modules-probe", package=candidate, probed=probed, reason="no-linux-image"
+        )
         return metapackage
 
     candidate_flavour = nvidia_info.get_flavour()
@@ -2086,6 +2413,7 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
         candidate_flavour,
         linux_flavour,
     )
+    probed.append(linux_modules_candidate)
 
     try:
         package = apt_cache[linux_modules_candidate]
@@ -2101,6 +2429,8 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
             logging.debug(
                 "linux_modules_abi_candidate: %s" % (linux_modules_abi_candidate)
             )
+            if linux_modules_abi_candidate not in probed:
+                probed.append(linux_modules_abi_candidate)
 
             # Let's check if there is a candidate that is specific to
             # our kernel ABI. If not, things will fail.
@@ -2136,18 +2466,28 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
             candidate_flavour,
             candidate_suffix,
         )
+        if modules_candidate not in probed:
+            probed.append(modules_candidate)
 
         for dep in reverse_deps:
             if dep == modules_candidate:
                 pick = dep
         if pick:
             metapackage = pick
+            plan_decision(
+                "modules-probe",
+                package=candidate,
+                probed=probed,
+                result=metapackage,
+                reason="prebuilt",
+            )
             return metapackage
 
     # If no linux-modules-nvidia package is available for the current kernel
     # we should install the relevant DKMS package
     dkms_package = "nvidia-dkms-%s" % candidate_flavour
     logging.debug("Falling back to %s" % (dkms_package))
+    probed.append(dkms_package)
 
     try:
         package = apt_cache[dkms_package]
@@ -2160,6 +2500,13 @@ def get_linux_modules_metapackage(apt_cache, candidate: str) -> Optional[str]:
         logging.error('No "%s" can be found.', dkms_package)
         pass
 
+    plan_decision(
+        "modules-probe",
+        package=candidate,
+        probed=probed,
+        result=metapackage,
+        reason="dkms-fallback" if metapackage else "not-available",
+    )
     return metapackage
 
 
@@ -2460,45 +2807,7 @@ def check_nvidia_module_status() -> Dict[str, Any]:
 def gather_welcome_page_data() -> Dict[str, Any]:
     """Gather data for the welcome page.
 
-    Returns:
-        dict: A dictionary containing:
-            - cache_error: Error message if cache couldn't be loaded, or None
-            - nvidia_drivers: List of installed NVIDIA driver packages
-            - oem_packages: List of installed OEM packages
-            - nvidia_status: NVIDIA module status dict, or None if not applicable
-            - nvidia_status_error: Error message if status check failed, or None
+    This is kept for API compatibility; see
+    :func:`UbuntuDrivers.welcome.gather_welcome_page_data`.
     """
-    data: Dict[str, Any] = {
-        "cache_error": None,
-        "nvidia_drivers": [],
-        "oem_packages": [],
-        "nvidia_status": None,
-        "nvidia_status_error": None,
-    }
-
-    # Initialize apt cache
-    apt_pkg.init_config()
-    apt_pkg.init_system()
-
-    try:
-        cache = apt_pkg.Cache(None)
-    except Exception as ex:
-        data["cache_error"] = str(ex)
-        return data
-
-    # Get installed NVIDIA drivers
-    data["nvidia_drivers"] = get_installed_packages_by_glob(
-        cache, "nvidia-driver-*"
-    ) or get_installed_packages_by_glob(cache, "linux-modules-nvidia-*")
-
-    # Get installed OEM meta packages
-    data["oem_packages"] = get_installed_packages_by_glob(cache, "oem-*-meta")
-
-    # Check NVIDIA module status if NVIDIA drivers are installed
-    if data["nvidia_drivers"]:
-        try:
-            data["nvidia_status"] = check_nvidia_module_status()
-        except Exception as e:
-            data["nvidia_status_error"] = str(e)
-
-    return data
+    return welcome.gather_welcome_page_data()
@@ -0,0 +1,117 @@
+"""Decision traces of the driver installation planner.
+
+"ubuntu-drivers install --simulate --explain" plans the installation as
+usual, but records every decision the planner reports through
+UbuntuDrivers.detect.plan_decision(), and every detection phase, with the
+time it took, instead of installing anything.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import apt_pkg
+
+import UbuntuDrivers.detect
+from UbuntuDrivers import installer
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class PlanTrace(object):
+    """Collect the planner's decisions and phases while the trace is active.
+
+    Use as a context manager. records holds "decision", "phase" and
+    "transaction" records, in the order in which they finished; "ms" is the
+    time since the trace started, "elapsed_ms" the time since the previous
+    decision (or the start), which is what reaching the decision cost, and
+    "duration_ms" the time a phase took.
+    """
+
+    def __init__(self) -> None:
+        self.records: List[Dict[str, Any]] = []
+        self._start = 0.0
+        self._last = 0.0
+        self._phases: List[Tuple[str, float]] = []
+
+    def __enter__(self) -> "PlanTrace":
+        self._start = self._last = time.monotonic()
+        UbuntuDrivers.detect.phase_hooks.append(self._on_phase)
+        UbuntuDrivers.detect.decision_hooks.append(self._on_decision)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        UbuntuDrivers.detect.phase_hooks.remove(self._on_phase)
+        UbuntuDrivers.detect.decision_hooks.remove(self._on_decision)
+
+    def _on_phase(self, phase: str, started: bool) -> None:
+        now = time.monotonic()
+        if started:
+            self._phases.append((phase, now))
+            return
+        # phases nest, so the innermost open one is ending
+        for i in range(len(self._phases) - 1, -1, -1):
+            if self._phases[i][0] == phase:
+                _, begin = self._phases.pop(i)
+                self.records.append(
+                    {
+                        "type": "phase",
+                        "phase": phase,
+                        "ms": _ms(begin - self._start),
+                        "duration_ms": _ms(now - begin),
+                    }
+                )
+                return
+
+    def _on_decision(self, decision: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        record = dict(decision, type="decision")
+        record["ms"] = _ms(now - self._start)
+        record["elapsed_ms"] = _ms(now - self._last)
+        if self._phases:
+            record["phase"] = self._phases[-1][0]
+        self._last = now
+        self.records.append(record)
+
+    def transaction(
+        self, cache: Optional[apt_pkg.Cache], packages: Iterable[str]
+    ) -> Dict[str, Any]:
+        """Add and return the "transaction" record of installing *packages*.
+
+        This resolves the installation in memory, as apt would, without
+        changing the system. "changes" lists all packages apt would install
+        or upgrade, then those it would remove with a "-" appended, and the
+        sizes are those of the downloads and the change
+        of disk usage.
+        """
+        packages = list(packages)
+        record: Dict[str, Any] = {"type": "transaction", "packages": packages}
+        if cache is not None and packages:
+            begin = time.monotonic()
+            engine = installer.Installer(cache)
+            try:
+                engine.mark_install(packages)
+            except installer.InstallError as ex:
+                record["error"] = str(ex)
+            else:
+                changes = engine.changes()
+                record.update(
+                    changes=changes,
+                    count=len(changes),
+                    download_bytes=engine.depcache.deb_size,
+                    installed_bytes=engine.depcache.usr_size,
+                )
+            record["duration_ms"] = _ms(time.monotonic() - begin)
+        else:
+            record.update(changes=[], count=0, download_bytes=0, installed_bytes=0)
+        record["ms"] = _ms(time.monotonic() - self._start)
+        self.records.append(record)
+        return record
@@ -0,0 +1,203 @@
+"""Driver installation plans for many machines at once.
+
+A build host with an apt snapshot of what its fleet installs from can compute
+what "ubuntu-drivers install" would install on each machine from a manifest
+of the machine's hardware, without access to the machine itself.  The apt
+modalias map is built once, machines with the same hardware are planned
+once, and the distinct hardware is spread over a pool of forked processes,
+which all share the parent's apt cache and modalias map.
+
+A manifest is a JSON object like:
+
+    {
+        "node": "web-042",
+        "modaliases": {"pci:v000010DEd...": "/sys/devices/pci0000:00/..."}
+    }
+
+where "modaliases" is a system_modaliases() map of the machine, or just a
+list of its modaliases, and "node" defaults to the manifest's file name
+without ".json".
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import apt_pkg
+
+import UbuntuDrivers.detect
+
+# the planner that forked pool workers inherit, see plan_hardware()
+_forked_planner: Optional["FleetPlanner"] = None
+
+
+def open_apt_root(path: str) -> apt_pkg.Cache:
+    """Open the apt cache of the apt root directory *path*.
+
+    That is the cache "apt-get -o Dir=PATH" uses, with the dpkg status file
+    in *path* as well, so that the packages installed according to it count
+    as installed on every planned machine.
+    """
+    with UbuntuDrivers.detect.detection_phase("apt-open"):
+        apt_pkg.init_config()
+        apt_pkg.config["Dir"] = path
+        apt_pkg.config["Dir::State::status"] = os.path.join(path, "var/lib/dpkg/status")
+        apt_pkg.init_system()
+        return apt_pkg.Cache(None)
+
+
+def read_manifest(path: str) -> Tuple[str, Dict[str, str]]:
+    """Read the hardware manifest at *path*.
+
+    Return the node name and its modalias → sysfs path map; sysfs paths are
+    empty if the manifest only lists modaliases.
+
+    Raises:
+        OSError: if the file cannot be read.
+        ValueError: if it is not a valid manifest.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError("manifest is not a JSON object")
+    node = manifest.get("node")
+    if node is None:
+        node = os.path.basename(path)
+        if node.endswith(".json"):
+            node = node[:-5]
+    modaliases = manifest.get("modaliases")
+    if isinstance(modaliases, list):
+        modaliases = dict.fromkeys(modaliases, "")
+    if not isinstance(modaliases, dict) or not all(
+        isinstance(alias, str) and isinstance(syspath, str)
+        for alias, syspath in modaliases.items()
+    ):
+        raise ValueError('"modaliases" must be an object or a list of strings')
+    return str(node), modaliases
+
+
+def hardware_key(modaliases: Iterable[str]) -> str:
+    """Return the fingerprint that machines with the same plan share.
+
+    Unlike UbuntuDrivers.detect.hardware_fingerprint() this ignores the sysfs
+    paths, which do not change which drivers apply.
+    """
+    return UbuntuDrivers.detect.hardware_fingerprint(dict.fromkeys(modaliases, ""))
+
+
+class FleetPlanner(object):
+    """Plan driver installations against one apt cache.
+
+    The options mean the same as those of "ubuntu-drivers install".
+    Detection plugins are not run, as they probe the machine they run on.
+    """
+
+    def __init__(
+        self,
+        apt_cache: apt_pkg.Cache,
+        free_only: bool = False,
+        include_oem: bool = True,
+        include_dkms: bool = False,
+    ) -> None:
+        self.apt_cache = apt_cache
+        self.free_only = free_only
+        self.include_oem = include_oem
+        self.include_dkms = include_dkms
+        self.modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(apt_cache)
+        # different hardware often has the same driver candidates, e. g. the
+        # same GPU next to a different network card
+        self._plans: Dict[FrozenSet[str], List[str]] = {}
+
+    def plan(self, modaliases: Iterable[str]) -> List[str]:
+        """Return the packages to install for a machine with *modaliases*."""
+        packages: Dict[str, UbuntuDrivers.detect.PackageInfo] = {}
+        for alias in modaliases:
+            packages.update(
+                UbuntuDrivers.detect._device_driver_packages(
+                    self.apt_cache,
+                    alias,
+                    "",
+                    self.modalias_map,
+                    self.free_only,
+                    self.include_oem,
+                    names=False,
+                )
+            )
+        key = frozenset(packages)
+        if key not in self._plans:
+            UbuntuDrivers.detect._mark_recommended_nvidia(packages)
+            self._plans[key] = UbuntuDrivers.detect.auto_install_filter(
+                self.apt_cache,
+                self.include_dkms,
+                packages,
+                get_recommended=False,
+                simulate=True,
+            )
+        return self._plans[key]
+
+
+def _plan_in_worker(
+    item: Tuple[str, List[str]],
+) -> Tuple[str, Optional[List[str]], Optional[str]]:
+    """Plan one hardware fingerprint with the inherited planner.
+
+    Return the fingerprint, and the plan or why there is none.
+    """
+    key, modaliases = item
+    assert _forked_planner is not None
+    try:
+        return key, _forked_planner.plan(modaliases), None
+    except Exception as ex:
+        logging.debug("Cannot plan %s: %s", key, ex, exc_info=True)
+        return key, None, str(ex)
+
+
+def plan_hardware(
+    planner: FleetPlanner, hardware: Dict[str, List[str]], jobs: int
+) -> Dict[str, Tuple[Optional[List[str]], Optional[str]]]:
+    """Plan every fingerprint → modaliases entry of *hardware*.
+
+    With more than one job, the entries are planned by that many forked
+    processes.
+
+    Return a map fingerprint → (plan, None), or (None, error message) if the
+    fingerprint could not be planned.
+    """
+    global _forked_planner
+
+    items = list(hardware.items())
+    if jobs <= 1 or len(items) <= 1:
+        _forked_planner = planner
+        try:
+            return {
+                key: (plan, error) for key, plan, error in map(_plan_in_worker, items)
+            }
+        finally:
+            _forked_planner = None
+
+    # the workers must be forked after this, to inherit the planner without
+    # pickling the apt cache
+    _forked_planner = planner
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            chunksize = max(1, len(items) // (jobs * 4))
+            return {
+                key: (plan, error)
+                for key, plan, error in executor.map(
+                    _plan_in_worker, items, chunksize=chunksize
+                )
+            }
+    finally:
+        _forked_planner = None
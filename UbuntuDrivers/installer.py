@@ -0,0 +1,254 @@
+"""Install driver packages in-process with apt_pkg.
+
+"ubuntu-drivers install" used to run apt-get install, then apt update for the
+sources list of every OEM metapackage it installed, then apt install again to
+upgrade those metapackages from their archives; each of these re-read the
+package cache from scratch.  An Installer instead marks the packages in the
+cache that ubuntu-drivers already has open, downloads and installs them in
+one dpkg run, and after refreshing only the OEM archives' package lists
+upgrades the OEM metapackages in at most one more.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import sys
+from typing import Iterable, List, Optional
+
+import apt_pkg
+import apt.progress.base
+import apt.progress.text
+
+import UbuntuDrivers.detect
+
+
+class InstallError(Exception):
+    """Packages could not be marked, fetched or installed."""
+
+
+class Installer(object):
+    """Install packages from an open apt_pkg.Cache.
+
+    dpkg_options are added to DPkg::Options, like "apt-get -o
+    DPkg::Options::=OPTION" would. The progress objects default to apt-get's
+    download messages and a silent dpkg run, which still writes its own
+    messages to stdout.
+    """
+
+    def __init__(
+        self,
+        cache: apt_pkg.Cache,
+        dpkg_options: Iterable[str] = (),
+        acquire_progress: Optional[apt.progress.base.AcquireProgress] = None,
+        install_progress: Optional[apt.progress.base.InstallProgress] = None,
+    ) -> None:
+        self.cache = cache
+        self.depcache = apt_pkg.DepCache(cache)
+        self.acquire_progress = acquire_progress or apt.progress.text.AcquireProgress()
+        self.install_progress = install_progress or apt.progress.base.InstallProgress()
+        for option in dpkg_options:
+            if option not in apt_pkg.config.value_list("DPkg::Options"):
+                apt_pkg.config["DPkg::Options::"] = option
+
+    def mark_install(self, packages: Iterable[str]) -> None:
+        """Mark *packages* for installation, with their dependencies.
+
+        Installed packages are upgraded if there is a newer candidate.
+
+        Raises:
+            InstallError: if a package is unknown, or the dependencies
+                cannot be resolved.
+        """
+        marked = []
+        with apt_pkg.ActionGroup(self.depcache):
+            for name in packages:
+                try:
+                    package = self.cache[name]
+                except KeyError:
+                    raise InstallError(f"Unable to locate package {name}")
+                if self.depcache.get_candidate_ver(package) is None:
+                    raise InstallError(f"Package {name} has no installation candidate")
+                self.depcache.mark_install(package, True, True)
+                marked.append(package)
+
+        if self.depcache.broken_count:
+            resolver = apt_pkg.ProblemResolver(self.depcache)
+            for package in marked:
+                resolver.protect(package)
+            try:
+                resolver.resolve(True)
+            except SystemError as ex:
+                raise InstallError(f"Unable to correct problems: {ex}") from ex
+
+    def installs(self) -> List[str]:
+        """Return the names of the packages to be installed or upgraded."""
+        return sorted(
+            package.name
+            for package in self.cache.packages
+            if self.depcache.marked_install(package)
+            or self.depcache.marked_upgrade(package)
+        )
+
+    def removals(self) -> List[str]:
+        """Return the names of the packages that resolving the dependencies
+        marked for removal."""
+        return sorted(
+            package.name
+            for package in self.cache.packages
+            if self.depcache.marked_delete(package)
+        )
+
+    def changes(self) -> List[str]:
+        """Return all marked changes: the packages to be installed or
+        upgraded, then those to be removed, with a "-" appended like on the
+        apt-get command line."""
+        return self.installs() + [name + "-" for name in self.removals()]
+
+    def _check_removals(self) -> None:
+        # like apt-get, never remove essential or important packages
+        protected = [
+            name
+            for name in self.removals()
+            if self.cache[name].essential or self.cache[name].important
+        ]
+        if protected:
+            raise InstallError(
+                "Refusing to remove essential packages: " + " ".join(protected)
+            )
+
+    def _check_trusted(self, sources: apt_pkg.SourceList) -> None:
+        if apt_pkg.config.find_b("APT::Get::AllowUnauthenticated"):
+            return
+        untrusted = []
+        for name in self.installs():
+            version = self.depcache.get_candidate_ver(self.cache[name])
+            if not any(
+                index is not None and index.is_trusted
+                for index in (sources.find_index(f) for f, _ in version.file_list)
+            ):
+                untrusted.append(name)
+        if untrusted:
+            raise InstallError(
+                "Refusing to install packages which cannot be authenticated: "
+                + " ".join(untrusted)
+            )
+
+    def _fetch(self, fetcher: apt_pkg.Acquire) -> None:
+        result = fetcher.run()
+        failed = [
+            f"{item.desc_uri}: {item.error_text}"
+            for item in fetcher.items
+            if item.status not in (item.STAT_DONE, item.STAT_IDLE)
+        ]
+        if result == fetcher.RESULT_CANCELLED:
+            raise InstallError("Download cancelled")
+        if failed:
+            raise InstallError("Failed to fetch " + ", ".join(failed))
+
+    def commit(self) -> bool:
+        """Download and install the marked changes in one dpkg run.
+
+        Return False if there was nothing to do.
+
+        Raises:
+            InstallError: on failure, or if essential packages would be
+                removed.
+        """
+        if not self.depcache.inst_count and not self.depcache.del_count:
+            return False
+
+        self._check_removals()
+        sources = apt_pkg.SourceList()
+        sources.read_main_list()
+        self._check_trusted(sources)
+
+        records = apt_pkg.PackageRecords(self.cache)
+        package_manager = apt_pkg.PackageManager(self.depcache)
+        fetcher = apt_pkg.Acquire(self.acquire_progress)
+        # the child process that runs dpkg must not write our buffers again
+        sys.stdout.flush()
+        sys.stderr.flush()
+        archives_lock = os.path.join(
+            apt_pkg.config.find_dir("Dir::Cache::Archives"), "lock"
+        )
+        with UbuntuDrivers.detect.detection_phase("apt-commit"):
+            try:
+                with apt_pkg.SystemLock(), apt_pkg.FileLock(archives_lock):
+                    while True:
+                        if not package_manager.get_archives(fetcher, sources, records):
+                            raise InstallError("Unable to fetch the packages")
+                        self._fetch(fetcher)
+
+                        # like apt-get, keep the outer lock, so that no other
+                        # frontend runs, but let dpkg take its own
+                        apt_pkg.pkgsystem_unlock_inner()
+                        try:
+                            result = self.install_progress.run(package_manager)
+                        finally:
+                            apt_pkg.pkgsystem_lock_inner()
+                        if result == package_manager.RESULT_COMPLETED:
+                            break
+                        if result == package_manager.RESULT_FAILED:
+                            raise InstallError("Installing the packages failed")
+                        fetcher.shutdown()
+            except SystemError as ex:
+                raise InstallError(str(ex)) from ex
+        return True
+
+    def update_sources(self, sources_list_paths: Iterable[str]) -> None:
+        """Refresh the package lists of just the given sources lists, and
+        reopen the cache, which then reflects the installed packages as well.
+
+        Pending marks are dropped.
+
+        Raises:
+            InstallError: if the package lists cannot be fetched.
+        """
+        paths = [path for path in sources_list_paths if os.path.exists(path)]
+        lists_lock = os.path.join(apt_pkg.config.find_dir("Dir::State::Lists"), "lock")
+        with UbuntuDrivers.detect.detection_phase("apt-update"):
+            saved = {
+                key: apt_pkg.config.find(key)
+                for key in (
+                    "Dir::Etc::SourceList",
+                    "Dir::Etc::SourceParts",
+                    "APT::Get::List-Cleanup",
+                )
+            }
+            try:
+                for path in paths:
+                    apt_pkg.config["Dir::Etc::SourceList"] = path
+                    apt_pkg.config["Dir::Etc::SourceParts"] = "/dev/null"
+                    # keep the package lists of all the other sources
+                    apt_pkg.config["APT::Get::List-Cleanup"] = "false"
+                    sources = apt_pkg.SourceList()
+                    sources.read_main_list()
+                    try:
+                        with apt_pkg.FileLock(lists_lock):
+                            updated = self.cache.update(self.acquire_progress, sources)
+                    except SystemError as ex:
+                        raise InstallError(str(ex)) from ex
+                    if not updated:
+                        raise InstallError(f"Failed to update the sources in {path}")
+            finally:
+                for key, value in saved.items():
+                    if value:
+                        apt_pkg.config[key] = value
+                    else:
+                        apt_pkg.config.clear(key)
+
+        with UbuntuDrivers.detect.detection_phase("apt-open"):
+            self.cache = apt_pkg.Cache(None)
+            self.depcache = apt_pkg.DepCache(self.cache)
+
+
+def oem_sources_list(package: str) -> str:
+    """Return the sources list that OEM metapackage *package* installs."""
+    return os.path.join(
+        apt_pkg.config.find_dir("Dir::Etc::SourceParts"), f"{package}.list"
+    )
@@ -29,6 +29,8 @@ from subprocess import Popen, PIPE
 import os
 import sys
 
+from UbuntuDrivers import aptscan
+
 
 class KernelDetection(object):
 
@@ -67,17 +69,6 @@ class KernelDetection(object):
 
         return flavour
 
-    def _filter_cache(self, pkg: apt_pkg.Package) -> Optional[str]:
-        package_name = pkg.name
-        if (
-            package_name.startswith("linux-image")
-            and "extra" not in package_name
-            and (pkg.current_ver or self.apt_depcache.marked_install(pkg))
-        ):
-            return package_name
-        else:
-            return None
-
     def _get_linux_metapackage(self, target: str) -> str:
         """Get the linux headers, linux-image or linux metapackage"""
         metapackage = ""
@@ -87,19 +78,18 @@ class KernelDetection(object):
 
         pattern = re.compile("linux-image-(?:unsigned-)?(.+)-([0-9]+)-(.+)")
 
-        for package_name in map(self._filter_cache, self.apt_cache.packages):
-            if package_name:
-                match = pattern.match(package_name)
-                # Here we filter out packages other than
-                # the actual image or header packages
-                if match:
-                    current_package = match.group(0)
-                    current_version = "%s-%s" % (match.group(1), match.group(2))
-                    # See if the current version is greater than
-                    # the greatest that we've found so far
-                    if self._is_greater_than(current_version, version):
-                        version = current_version
-                        image_package = current_package
+        for package_name in aptscan.scan(self.apt_cache).kernel.images:
+            match = pattern.match(package_name)
+            # Here we filter out packages other than
+            # the actual image or header packages
+            if match:
+                current_package = match.group(0)
+                current_version = "%s-%s" % (match.group(1), match.group(2))
+                # See if the current version is greater than
+                # the greatest that we've found so far
+                if self._is_greater_than(current_version, version):
+                    version = current_version
+                    image_package = current_package
 
         if version:
             if target == "headers":
@@ -232,19 +222,8 @@ class KernelDetection(object):
         # We make an assumption that any of the installed kernels could be the next default boot
         # option (not necessarily just the currently running one) - and thus we should advise that
         # any update candidates are applied before proceeding.
-        meta_pkgs = []
-        for pkg in self.apt_cache.packages:
-            if not pkg.current_ver:
-                continue
-            if not pkg.name.startswith("linux-image-"):
-                continue
-            # Skip actual kernel image packages
-            if re.match(
-                r"linux-image-(\d+\.\d+\.\d+-\d+|\w*unsigned-\d+\.\d+\.\d+-\d+)",
-                pkg.name,
-            ):
-                continue
-            meta_pkgs.append(pkg)
+        meta_pkgs = aptscan.scan(self.apt_cache).kernel.metapackages
+        for pkg in meta_pkgs:
             logging.debug("Found installed kernel metapackage: %s", pkg.name)
 
         for meta_pkg in meta_pkgs:
@@ -0,0 +1,134 @@
+"""Phase timing for the ubuntu-drivers command.
+
+A Profiler records the wall and CPU time of every detection phase (see
+UbuntuDrivers.detect.detection_phase()) and writes them in the Chrome trace
+event format, which chrome://tracing, https://ui.perfetto.dev and speedscope
+can show. It can also run cProfile over the same time span.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def _children_cpu() -> float:
+    """Return the CPU time of the waited-for child processes, in seconds."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Profiler(object):
+    """Record the phases of one ubuntu-drivers run.
+
+    Between start() and stop(), every detection phase becomes a complete
+    ("X") trace event with its wall time, and with the CPU time of this
+    process and of the external commands it waited for in its args.
+    """
+
+    def __init__(self, command: List[str], cprofile_path: Optional[str] = None) -> None:
+        self._command = command
+        self._cprofile_path = cprofile_path
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._events: List[Dict[str, Any]] = []
+        # thread id → stack of (name, wall, cpu, children cpu) of open phases
+        self._open: Dict[int, List[Tuple[str, float, float, float]]] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def _hook(self, name: str, started: bool) -> None:
+        thread = threading.get_ident()
+        wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+        with self._lock:
+            stack = self._open.setdefault(thread, [])
+            if started:
+                stack.append((name, wall, cpu, children))
+                return
+            # phases nest, but do not let a hook that was added in the middle
+            # of one mismatch the rest
+            while stack:
+                opened = stack.pop()
+                if opened[0] == name:
+                    break
+            else:
+                return
+            self._events.append(
+                {
+                    "name": name,
+                    "cat": "phase",
+                    "ph": "X",
+                    "ts": round((opened[1] - self._origin) * 1e6),
+                    "dur": round((wall - opened[1]) * 1e6),
+                    "pid": os.getpid(),
+                    "tid": thread,
+                    "args": {
+                        "cpu_ms": round((cpu - opened[2]) * 1e3, 3),
+                        "children_cpu_ms": round((children - opened[3]) * 1e3, 3),
+                    },
+                }
+            )
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record the enclosed code as phase *name*."""
+        self._hook(name, True)
+        try:
+            yield
+        finally:
+            self._hook(name, False)
+
+    def start(self) -> None:
+        """Start recording the detection phases."""
+        if self._cprofile_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._hook("ubuntu-drivers", True)
+        # the detection modules are imported lazily, so their import would
+        # otherwise go unaccounted
+        with self.phase("import"):
+            import UbuntuDrivers.detect
+        UbuntuDrivers.detect.phase_hooks.append(self._hook)
+
+    def stop(self) -> None:
+        """Stop recording, and write the cProfile statistics if enabled.
+
+        The events recorded so far are kept.
+        """
+        import UbuntuDrivers.detect
+
+        if self._hook in UbuntuDrivers.detect.phase_hooks:
+            UbuntuDrivers.detect.phase_hooks.remove(self._hook)
+        # close whatever is still open, e. g. after sys.exit() in a phase
+        for name, _wall, _cpu, _children in reversed(
+            list(self._open.get(threading.get_ident(), []))
+        ):
+            self._hook(name, False)
+        if self._cprofile is not None and self._cprofile_path:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._cprofile_path)
+
+    def trace(self) -> Dict[str, Any]:
+        """Return the recorded phases as a Chrome trace object."""
+        with self._lock:
+            events = sorted(self._events, key=lambda e: (e["ts"], -e["dur"]))
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"command": " ".join(self._command)},
+        }
+
+    def write(self, path: str) -> None:
+        """Write the trace to *path*."""
+        with open(path, "w") as f:
+            json.dump(self.trace(), f, indent=1)
+            f.write("\n")
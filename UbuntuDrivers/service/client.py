@@ -0,0 +1,145 @@
+"""Client for the ubuntu-drivers D-Bus service.
+
+The ubuntu-drivers command uses this with --via-service to answer from the
+detection result that com.ubuntu.Drivers keeps, instead of opening the apt
+cache and detecting in-process.  It deliberately does not import the service
+module, nor apt_pkg or UbuntuDrivers.detect.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import fnmatch
+from typing import Any, Dict, List, Optional, Tuple
+
+from gi.repository import Gio, GLib
+
+# Same as DriversService.BUS_NAME and OBJ_PATH
+BUS_NAME = "com.ubuntu.Drivers"
+OBJ_PATH = "/com/ubuntu/Drivers"
+
+# Long enough for an activated service without a cached result to run the
+# detection itself.
+DEFAULT_TIMEOUT_MS = 300 * 1000
+
+
+class ServiceError(Exception):
+    """The service could not be reached, or failed to answer."""
+
+
+def _call(
+    method: str,
+    parameters: Optional[GLib.Variant],
+    reply_type: str,
+    timeout_ms: int,
+) -> Any:
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        reply = bus.call_sync(
+            BUS_NAME,
+            OBJ_PATH,
+            BUS_NAME,
+            method,
+            parameters,
+            GLib.VariantType.new(reply_type),
+            Gio.DBusCallFlags.NONE,
+            timeout_ms,
+            None,
+        )
+    except GLib.Error as ex:
+        raise ServiceError(f"{method}(): {ex.message}") from ex
+    return reply.unpack()[0]
+
+
+def drivers(timeout_ms: int = DEFAULT_TIMEOUT_MS) -> List[Dict[str, Any]]:
+    """Return the service's drivers() list of device dicts.
+
+    Raises:
+        ServiceError: if the call fails.
+    """
+    result: List[Dict[str, Any]] = _call("drivers", None, "(aa{sv})", timeout_ms)
+    return result
+
+
+def plan_install(
+    options: Dict[str, Any], timeout_ms: int = DEFAULT_TIMEOUT_MS
+) -> List[str]:
+    """Return the service's PlanInstall() packages for *options*.
+
+    *options* are the Python values of PlanInstall()'s a{sv} options.
+
+    Raises:
+        ServiceError: if the call fails.
+    """
+    variants = {}
+    for name, value in options.items():
+        variants[name] = GLib.Variant("b" if isinstance(value, bool) else "s", value)
+    parameters = GLib.Variant.new_tuple(GLib.Variant("a{sv}", variants))
+    packages: List[str] = _call("PlanInstall", parameters, "(as)", timeout_ms)
+    return packages
+
+
+def device_drivers(devices: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Convert drivers() *devices* to the structure of
+    UbuntuDrivers.detect.system_device_drivers().
+    """
+    result: Dict[str, Dict[str, Any]] = {}
+    for device in devices:
+        info: Dict[str, Any] = {}
+        for key in ("modalias", "vendor", "model"):
+            if device[key]:
+                info[key] = device[key]
+        info["drivers"] = {}
+        for driver in device["drivers"]:
+            driver_info = {
+                "free": driver["free"],
+                "from_distro": driver["source"] == "distro",
+                "recommended": driver["recommended"],
+            }
+            if driver["builtin"]:
+                driver_info["builtin"] = True
+            else:
+                driver_info["support"] = driver["support"] or None
+            info["drivers"][driver["name"]] = driver_info
+        if device["manual_install"]:
+            info["manual_install"] = True
+        result[device["sys_path"]] = info
+    return result
+
+
+def driver_packages(
+    devices: List[Dict[str, Any]], include_oem: bool = True
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Optional[str]]]:
+    """Convert drivers() *devices* to the structure of
+    UbuntuDrivers.detect.system_driver_packages().
+
+    Returns that and the linux-modules metapackage of each package, as
+    UbuntuDrivers.detect.get_linux_modules_metapackage() would.
+    """
+    packages: Dict[str, Dict[str, Any]] = {}
+    linux_modules: Dict[str, Optional[str]] = {}
+    for device in devices:
+        for driver in device["drivers"]:
+            name = driver["name"]
+            if driver["builtin"]:
+                continue
+            if not include_oem and fnmatch.fnmatch(name, "oem-*-meta"):
+                continue
+            info = {
+                "syspath": device["sys_path"],
+                "free": driver["free"],
+                "from_distro": driver["source"] == "distro",
+                "recommended": driver["recommended"],
+                "support": driver["support"] or None,
+                "open_preferred": driver["open_preferred"],
+            }
+            for key in ("modalias", "vendor", "model"):
+                if device[key]:
+                    info[key] = device[key]
+            packages[name] = info
+            linux_modules[name] = driver["linux_modules"] or None
+    return packages, linux_modules
@@ -2,12 +2,24 @@
 
 from __future__ import annotations
 
+import collections
+import fnmatch
+import hashlib
+import json
 import logging
+import math
+import pickle
+import resource
 import signal
+import subprocess
 import sys
-from typing import Callable, List, Optional
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
 
 import UbuntuDrivers.detect
+from UbuntuDrivers import aptscan
 
 import apt_pkg
 from gi.repository import Gio, GLib
@@ -18,12 +30,73 @@ sys_path = os.environ.get("UBUNTU_DRIVERS_SYS_DIR")
 # D-Bus signature for the drivers() return value.
 _DRIVERS_SIGNATURE = "aa{sv}"
 
-# Seconds of inactivity after which the service shuts down.
+# Seconds of inactivity after which the service shuts down, unless the call
+# history suggests staying up longer, up to MAX_IDLE_TIMEOUT_SECONDS.
 DEFAULT_IDLE_TIMEOUT_SECONDS = 300
-
-# D-Bus error names returned by drivers().
+MAX_IDLE_TIMEOUT_SECONDS = 1800
+
+# Gaps between calls that _IdlePolicy learns from, and where it keeps them
+# across activations.
+DEFAULT_IDLE_HISTORY_SIZE = 64
+DEFAULT_IDLE_HISTORY_PATH = "/var/lib/ubuntu-drivers-common/idle-history.json"
+
+# Package state the detection result depends on: the dpkg database, the
+# downloaded apt indexes and the list of GPUs with custom driver support.
+_STATE_PATHS = (
+    "/var/lib/dpkg/status",
+    "/var/lib/apt/lists",
+    UbuntuDrivers.detect.custom_supported_gpus_json,
+)
+
+# Milliseconds without further changes to the package state before the cached
+# result is refreshed.  A single apt run rewrites these files many times, so
+# reacting to every event would re-run detection over and over.
+DEFAULT_STATE_SETTLE_MS = 2000
+
+# On-disk copy of the last detection result, so that a freshly activated
+# service can answer its first call without opening the apt cache.
+DEFAULT_RESULT_CACHE_PATH = "/var/cache/ubuntu-drivers-common/drivers.gvariant"
+
+# Bump whenever the layout or the meaning of the cached result changes.
+_RESULT_CACHE_VERSION = 2
+
+# Number of past detections whose timings com.ubuntu.Drivers.Debug.Stats()
+# reports.
+DEFAULT_STATS_HISTORY = 10
+
+# D-Bus error names returned by the methods of com.ubuntu.Drivers.
 _ERROR_CACHE_FAILURE = "com.ubuntu.Drivers.Error.CacheFailure"
 _ERROR_FAILED = "com.ubuntu.Drivers.Error.Failed"
+_ERROR_NO_SUCH_DEVICE = "com.ubuntu.Drivers.Error.NoSuchDevice"
+
+# Number of modaliases whose DriversForModaliases() answer is memoized.  Any
+# local user can ask about arbitrary modaliases, so the memo must not grow
+# without bound.
+_MODALIAS_MEMO_SIZE = 1024
+
+# udev subsystems of the devices that driver packages are for; events of the
+# others (block, net, input, ...) are not even delivered to the service.
+_HOTPLUG_SUBSYSTEMS = ("pci", "usb")
+
+# Result of UbuntuDrivers.detect.apt_cache_modalias_map().
+_ModaliasMap = Dict[str, Tuple[Any, Dict[str, Set[str]]]]
+
+# Options of PlanInstall() with their defaults, which match the defaults of
+# "ubuntu-drivers install".
+_PLAN_OPTIONS: Dict[str, Any] = {
+    "free_only": False,
+    "include_oem": True,
+    "include_dkms": False,
+    "driver": "",
+}
+
+# The PlanInstall() options as (free_only, include_oem, include_dkms, driver),
+# where the memo keys use the packages the driver option selects, see
+# _plan_driver().
+_PlanKey = Tuple[bool, bool, bool, str]
+
+# Number of option sets whose PlanInstall() answer is memoized.
+_PLAN_MEMO_SIZE = 32
 
 # gi ships no type information, so GLib.SOURCE_REMOVE is Any and returning it
 # straight from a "-> bool" callback trips mypy's warn_return_any.  Binding it
@@ -45,7 +118,96 @@ def _dbus_error_name(domain: str) -> str:
     return _ERROR_FAILED
 
 
-def _build_drivers_variant() -> GLib.Variant:
+def _driver_details(
+    cache: apt_pkg.Cache, info: UbuntuDrivers.detect.DeviceInfo
+) -> Dict[str, Tuple[str, bool]]:
+    """Look up the linux-modules metapackage (empty if there is none) and
+    whether the open kernel modules are preferred, for each driver package of
+    a device."""
+    details = {}
+    for pkg_name, pkg_info in info.get("drivers", {}).items():
+        if pkg_info.get("builtin"):
+            continue
+        try:
+            linux_modules = UbuntuDrivers.detect.get_linux_modules_metapackage(
+                cache, pkg_name
+            )
+            open_preferred = UbuntuDrivers.detect._is_open_prefered(
+                cache, cache[pkg_name]
+            )
+        except KeyError:
+            linux_modules, open_preferred = None, False
+        details[pkg_name] = (linux_modules or "", open_preferred)
+    return details
+
+
+def _device_variant(
+    device_name: str,
+    info: UbuntuDrivers.detect.DeviceInfo,
+    details: Optional[Dict[str, Tuple[str, bool]]] = None,
+) -> GLib.Variant:
+    """Build the ``a{sv}`` dict for one device, as described in
+    :func:`_build_drivers_variant`.
+
+    *details* are the :func:`_driver_details` of the device; without them
+    ``linux_modules`` is empty and ``open_preferred`` false.
+    """
+    drivers_info = info.get("drivers", {})
+    details = details or {}
+
+    driver_list = []
+    for pkg_name, pkg_info in sorted(
+        drivers_info.items(),
+        key=lambda item: (not item[1].get("recommended", False), item[0]),
+    ):
+        source = "distro" if pkg_info.get("from_distro", False) else "third-party"
+        linux_modules, open_preferred = details.get(pkg_name, ("", False))
+        driver_list.append(
+            GLib.Variant(
+                "a{sv}",
+                {
+                    "name": GLib.Variant("s", pkg_name),
+                    "source": GLib.Variant("s", source),
+                    "free": GLib.Variant("b", bool(pkg_info.get("free", False))),
+                    "builtin": GLib.Variant("b", bool(pkg_info.get("builtin", False))),
+                    "recommended": GLib.Variant(
+                        "b", bool(pkg_info.get("recommended", False))
+                    ),
+                    "support": GLib.Variant("s", pkg_info.get("support") or ""),
+                    "linux_modules": GLib.Variant("s", linux_modules),
+                    "open_preferred": GLib.Variant("b", open_preferred),
+                },
+            )
+        )
+
+    return GLib.Variant(
+        "a{sv}",
+        {
+            "sys_path": GLib.Variant("s", device_name),
+            "modalias": GLib.Variant("s", info.get("modalias", "")),
+            "vendor": GLib.Variant("s", info.get("vendor", "")),
+            "model": GLib.Variant("s", info.get("model", "")),
+            "manual_install": GLib.Variant(
+                "b", bool(info.get("manual_install", False))
+            ),
+            "drivers": GLib.Variant("av", driver_list),
+        },
+    )
+
+
+def _open_apt_cache() -> apt_pkg.Cache:
+    with UbuntuDrivers.detect.detection_phase("apt-open"):
+        apt_pkg.init_config()
+        apt_pkg.init_system()
+        try:
+            return apt_pkg.Cache(None)
+        except Exception as ex:
+            raise RuntimeError(f"Failed to initialize apt cache: {ex}") from ex
+
+
+def _build_drivers_variant(
+    on_device: Optional[Callable[[GLib.Variant], None]] = None,
+) -> GLib.Variant:
     """Build the driver list as a D-Bus ``(aa{sv})`` GLib.Variant.
 
     Queries the apt cache and system device drivers, returning a D-Bus
@@ -56,6 +218,8 @@ def _build_drivers_variant() -> GLib.Variant:
         modalias  s     modalias string (empty if unavailable)
         vendor    s     human-readable vendor name (empty if unavailable)
         model     s     human-readable model name (empty if unavailable)
+        manual_install  b   whether all its driver packages were installed
+                            manually
         drivers   av    array of driver a{sv} dicts (recommended first)
 
     Each driver dict (``a{sv}``) contains::
@@ -66,62 +230,354 @@ def _build_drivers_variant() -> GLib.Variant:
         builtin     b   whether the driver is built into the kernel
         recommended b   whether this is the recommended driver
         support     s   apt Support field value (e.g. "PB"), empty if absent
+        linux_modules   s   linux-modules metapackage with prebuilt kernel
+                            modules for the running kernel, empty if none
+        open_preferred  b   whether the package prefers the open kernel
+                            modules
+
+    If *on_device* is given, it is called with the ``a{sv}`` dict of each
+    device as soon as that device has been resolved.  Its ``recommended``
+    flags only consider that device, see
+    :func:`UbuntuDrivers.detect.system_device_drivers`.
 
     Raises:
         RuntimeError: if the apt cache cannot be initialized.
     """
-    apt_pkg.init_config()
-    apt_pkg.init_system()
+    return _detect_drivers(on_device)[0]
+
+
+def _detect_drivers(
+    on_device: Optional[Callable[[GLib.Variant], None]] = None,
+    build_modalias_map: Callable[
+        [apt_pkg.Cache], _ModaliasMap
+    ] = UbuntuDrivers.detect.apt_cache_modalias_map,
+) -> Tuple[GLib.Variant, _ModaliasMap]:
+    """Like :func:`_build_drivers_variant`, but also return the apt modalias
+    map the devices were resolved against.
+
+    The map is obtained from *build_modalias_map*, so that callers can reuse
+    or keep one.
+    """
+    cache = _open_apt_cache()
+    # the cache is walked once for the whole detection, and freed with it
+    with aptscan.scanning(cache):
+        modalias_map = build_modalias_map(cache)
+
+        def device_resolved(
+            device_name: str, info: UbuntuDrivers.detect.DeviceInfo
+        ) -> None:
+            assert on_device is not None
+            on_device(_device_variant(device_name, info, _driver_details(cache, info)))
+
+        devices = UbuntuDrivers.detect.system_device_drivers(
+            apt_cache=cache,
+            sys_path=sys_path,
+            freeonly=False,
+            on_device=device_resolved if on_device is not None else None,
+            modalias_map=modalias_map,
+        )
+
+        device_list = [
+            _device_variant(
+                device_name,
+                devices[device_name],
+                _driver_details(cache, devices[device_name]),
+            )
+            for device_name in sorted(devices)
+        ]
+        value = GLib.Variant.new_tuple(
+            GLib.Variant.new_array(GLib.VariantType.new("a{sv}"), device_list)
+        )
+        return value, modalias_map
+
+
+def _run_worker(
+    options: List[str],
+    request: Any = None,
+    on_device: Optional[Callable[[GLib.Variant], None]] = None,
+) -> Dict[str, Any]:
+    """Run :mod:`UbuntuDrivers.service.worker` with *options*.
+
+    *request*, if given, is pickled to the worker's stdin.  Devices the
+    worker streams are passed to *on_device*, and the phase boundaries it
+    reports to :data:`UbuntuDrivers.detect.phase_hooks`, both in the calling
+    thread; if a hook raises, the worker is killed.  Returns the payload of
+    every other message by kind.
+
+    Raises:
+        RuntimeError: if the worker cannot initialize the apt cache.
+        ChildProcessError: if the worker fails.
+    """
+    env = dict(os.environ)
+    if sys_path is not None:
+        env["UBUNTU_DRIVERS_SYS_DIR"] = sys_path
+
+    read_fd, write_fd = os.pipe()
     try:
-        cache = apt_pkg.Cache(None)
-    except Exception as ex:
-        raise RuntimeError(f"Failed to initialize apt cache: {ex}") from ex
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "UbuntuDrivers.service.worker", str(write_fd)]
+            + options,
+            stdin=subprocess.DEVNULL if request is None else subprocess.PIPE,
+            pass_fds=(write_fd,),
+            env=env,
+        )
+    except BaseException:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
 
-    devices = UbuntuDrivers.detect.system_device_drivers(
-        apt_cache=cache, sys_path=sys_path, freeonly=False
-    )
+    payloads: Dict[str, Any] = {}
+    try:
+        if worker.stdin is not None:
+            with worker.stdin:
+                pickle.dump(request, worker.stdin)
+        with os.fdopen(read_fd, "rb") as pipe:
+            while True:
+                try:
+                    message = pickle.load(pipe)
+                except EOFError:
+                    break
+                kind = message[0]
+                if kind == "phase":
+                    for hook in UbuntuDrivers.detect.phase_hooks:
+                        hook(message[1], message[2])
+                elif kind == "device":
+                    if on_device is not None:
+                        on_device(
+                            GLib.Variant.new_from_bytes(
+                                GLib.VariantType.new("a{sv}"),
+                                GLib.Bytes.new(message[1]),
+                                False,
+                            )
+                        )
+                elif kind == "error":
+                    if message[1]:
+                        raise RuntimeError(message[2])
+                    raise ChildProcessError(message[2])
+                else:
+                    payloads[kind] = message[1]
+    except BaseException:
+        worker.kill()
+        raise
+    finally:
+        worker.wait()
+
+    if worker.returncode != 0:
+        raise ChildProcessError(f"worker exited with status {worker.returncode}")
+    return payloads
+
+
+def _detect_in_worker(
+    on_device: Optional[Callable[[GLib.Variant], None]] = None,
+    with_map: bool = False,
+    map_only: bool = False,
+) -> Tuple[Optional[GLib.Variant], Optional[_ModaliasMap]]:
+    """Run :func:`_detect_drivers` in a worker process, see :func:`_run_worker`.
+
+    Returns the ``(aa{sv})`` value (None with *map_only*) and the apt modalias
+    map if *with_map* or *map_only* is set.
+    """
+    options = []
+    if on_device is not None:
+        options.append("--stream")
+    if with_map:
+        options.append("--modalias-map")
+    if map_only:
+        options.append("--map-only")
+    payloads = _run_worker(options, on_device=on_device)
+
+    value = None
+    if "result" in payloads:
+        value = GLib.Variant.new_from_bytes(
+            GLib.VariantType.new(f"({_DRIVERS_SIGNATURE})"),
+            GLib.Bytes.new(payloads["result"]),
+            False,
+        )
+    modalias_map = payloads.get("modalias-map")
+    if (value is None and not map_only) or (
+        modalias_map is None and (with_map or map_only)
+    ):
+        raise ChildProcessError("detection worker sent an incomplete result")
+    return value, modalias_map
 
-    device_list = []
 
-    for device_name in sorted(devices):
-        info = devices[device_name]
-        drivers_info = info.get("drivers", {})
+def _resolve_devices(
+    cache: apt_pkg.Cache, modalias_map: _ModaliasMap, devices: Dict[str, str]
+) -> List[Tuple[str, GLib.Variant]]:
+    """Resolve the drivers of *devices*, a sysfs path → modalias map.
 
-        driver_list = []
-        for pkg_name, pkg_info in sorted(
-            drivers_info.items(),
-            key=lambda item: (not item[1].get("recommended", False), item[0]),
-        ):
-            source = "distro" if pkg_info.get("from_distro", False) else "third-party"
-            driver_list.append(
-                GLib.Variant(
-                    "a{sv}",
-                    {
-                        "name": GLib.Variant("s", pkg_name),
-                        "source": GLib.Variant("s", source),
-                        "free": GLib.Variant("b", bool(pkg_info.get("free", False))),
-                        "builtin": GLib.Variant(
-                            "b", bool(pkg_info.get("builtin", False))
-                        ),
-                        "recommended": GLib.Variant(
-                            "b", bool(pkg_info.get("recommended", False))
+    Returns the ``a{sv}`` dict (see :func:`_build_drivers_variant`) of each
+    device that has drivers, by sysfs path.
+    """
+    # all lookups below share one walk over the cache
+    with aptscan.scanning(cache):
+        resolved = []
+        for device_name, modalias in sorted(devices.items()):
+            info = UbuntuDrivers.detect.modalias_device_drivers(
+                cache, modalias, device_name, modalias_map=modalias_map
+            )
+            if device_name in info:
+                resolved.append(
+                    (
+                        device_name,
+                        _device_variant(
+                            device_name,
+                            info[device_name],
+                            _driver_details(cache, info[device_name]),
                         ),
-                        "support": GLib.Variant("s", pkg_info.get("support") or ""),
-                    },
+                    )
                 )
+        return resolved
+
+
+def _plan_key(options: Dict[str, Any]) -> _PlanKey:
+    """Validate the ``a{sv}`` options of ``PlanInstall()``.
+
+    Raises:
+        ValueError: if an option is unknown or has the wrong type.
+    """
+    for name, value in options.items():
+        if name not in _PLAN_OPTIONS:
+            raise ValueError(f"Unknown option: {name}")
+        if type(value) is not type(_PLAN_OPTIONS[name]):
+            raise ValueError(
+                f"Option {name} must be of type {type(_PLAN_OPTIONS[name]).__name__}"
             )
+    options = {**_PLAN_OPTIONS, **options}
+    return (
+        options["free_only"],
+        options["include_oem"],
+        options["include_dkms"],
+        options["driver"],
+    )
+
+
+def _plan_driver(
+    packages: Dict[str, UbuntuDrivers.detect.PackageInfo], driver: str
+) -> Optional[str]:
+    """Normalize the ``driver`` option of ``PlanInstall()``.
 
-        device_list.append(
-            {
-                "sys_path": GLib.Variant("s", device_name),
-                "modalias": GLib.Variant("s", info.get("modalias", "")),
-                "vendor": GLib.Variant("s", info.get("vendor", "")),
-                "model": GLib.Variant("s", info.get("model", "")),
-                "drivers": GLib.Variant("av", driver_list),
+    Different spellings of the same request, like "390", "nvidia:390" and
+    "nvidia-driver-390", select the same candidate *packages* and so get the
+    same plan. Returns the selected packages, comma separated, "" if no
+    driver was asked for, or None if it selects no candidate at all.
+    """
+    if not driver:
+        return ""
+    drivers = UbuntuDrivers.detect._gpgpu_drivers(driver)
+    if not drivers:
+        return None
+    selected = UbuntuDrivers.detect._gpgpu_allowed(packages, drivers)
+    return ",".join(sorted(set(selected))) or None
+
+
+def _plan_packages(
+    result: GLib.Variant, free_only: bool, include_oem: bool
+) -> Dict[str, UbuntuDrivers.detect.PackageInfo]:
+    """Rebuild the :func:`UbuntuDrivers.detect.system_driver_packages`
+    candidates that the ``drivers()`` *result* was made from, with the fields
+    that the planner ranks NVIDIA drivers by.
+
+    Builtin drivers are not packages to install, so they are left out.
+    """
+    packages: Dict[str, UbuntuDrivers.detect.PackageInfo] = {}
+    for device in result.unpack()[0]:
+        for driver in device["drivers"]:
+            name = driver["name"]
+            if driver["builtin"] or (free_only and not driver["free"]):
+                continue
+            if not include_oem and fnmatch.fnmatch(name, "oem-*-meta"):
+                continue
+            packages[name] = {
+                "free": driver["free"],
+                "from_distro": driver["source"] == "distro",
+                "recommended": driver["recommended"],
+                "support": driver["support"] or None,
+                "open_preferred": driver["open_preferred"],
             }
+    return packages
+
+
+def _plan_install(
+    cache: apt_pkg.Cache,
+    packages: Dict[str, UbuntuDrivers.detect.PackageInfo],
+    include_dkms: bool,
+    driver: str,
+) -> List[str]:
+    """Return what "ubuntu-drivers install [driver]" would install from the
+    candidate *packages*, without changing anything."""
+    # The NVIDIA drivers are ranked by the lookup cache, which
+    # system_driver_packages() fills in "ubuntu-drivers install"; here it may
+    # be empty (in the worker) or left over from another detection.
+    for name, info in packages.items():
+        if name.startswith("nvidia-"):
+            UbuntuDrivers.detect.lookup_cache[name] = dict(info)
+    return UbuntuDrivers.detect.auto_install_filter(
+        cache, include_dkms, packages, driver, get_recommended=False, simulate=True
+    )
+
+
+class _ResultIndex:
+    """Lookup tables over one ``drivers()`` result for the query methods.
+
+    The replies for ``GetDevice`` and ``Recommended`` are built up front.
+    ``DriversForModaliases`` resolves against the apt modalias map, which is
+    None when the result came from the result cache without running
+    detection; answers are memoized per modalias, for the
+    ``_MODALIAS_MEMO_SIZE`` most recently asked ones.
+
+    Args:
+        result: The ``(aa{sv})`` value of ``drivers()``.
+        modalias_map: The apt modalias map *result* was resolved against.
+    """
+
+    def __init__(
+        self, result: GLib.Variant, modalias_map: Optional[_ModaliasMap]
+    ) -> None:
+        self.modalias_map = modalias_map
+        self._devices: Dict[str, GLib.Variant] = {}
+        self._modalias_packages: collections.OrderedDict[str, List[str]] = (
+            collections.OrderedDict()
         )
 
-    return GLib.Variant(f"({_DRIVERS_SIGNATURE})", (device_list,))
+        recommended: Dict[str, str] = {}
+        devices = result.get_child_value(0)
+        for i in range(devices.n_children()):
+            device = devices.get_child_value(i)
+            sys_path = device.lookup_value("sys_path", None).get_string()
+            self._devices[sys_path] = GLib.Variant.new_tuple(device)
+            drivers = device.lookup_value("drivers", None)
+            for j in range(drivers.n_children()):
+                driver = drivers.get_child_value(j).get_variant()
+                if driver.lookup_value("recommended", None).get_boolean():
+                    recommended[sys_path] = driver.lookup_value(
+                        "name", None
+                    ).get_string()
+                    break
+        self.recommended = GLib.Variant("(a{ss})", (recommended,))
+
+    def device(self, sys_path: str) -> Optional[GLib.Variant]:
+        """Return the ``(a{sv})`` reply for *sys_path*, if it has drivers."""
+        return self._devices.get(sys_path)
+
+    def drivers_for_modaliases(self, modaliases: List[str]) -> GLib.Variant:
+        """Return the ``(a{sas})`` reply mapping each modalias to its packages."""
+        assert self.modalias_map is not None
+        packages = {}
+        for modalias in modaliases:
+            if modalias in self._modalias_packages:
+                self._modalias_packages.move_to_end(modalias)
+            else:
+                self._modalias_packages[modalias] = sorted(
+                    UbuntuDrivers.detect.modalias_map_packages(
+                        self.modalias_map, modalias
+                    )
+                )
+                if len(self._modalias_packages) > _MODALIAS_MEMO_SIZE:
+                    self._modalias_packages.popitem(last=False)
+            packages[modalias] = self._modalias_packages[modalias]
+        return GLib.Variant("(a{sas})", (packages,))
 
 
 class _IdleManager:
@@ -129,20 +585,25 @@ class _IdleManager:
     for shutting down the `DriversService` after a period of inactivity.
 
     Callers call :meth:`hold` when async work begins and :meth:`release` when
-    it ends. The timeout is only active while no work is in progress.
+    it ends, and :meth:`activity` for every incoming call. The timeout is only
+    active while no work is in progress.
 
     Args:
         on_timeout: Callable invoked when the inactivity timeout fires.
         timeout_seconds: Seconds of inactivity before invoking `on_timeout`.
+        policy: Optional _IdlePolicy which records the calls and chooses the
+            timeout instead of `timeout_seconds`.
     """
 
     def __init__(
         self,
         on_timeout: Callable[[], object],
         timeout_seconds: int = DEFAULT_IDLE_TIMEOUT_SECONDS,
+        policy: Optional[_IdlePolicy] = None,
     ) -> None:
         self._on_timeout_cb = on_timeout
         self._timeout_seconds = timeout_seconds
+        self._policy = policy
         self._held: bool = False
         self._timeout_id: Optional[int] = None
 
@@ -160,14 +621,27 @@ class _IdleManager:
         self._held = False
         self._schedule()
 
+    def activity(self) -> None:
+        """Note an incoming call and restart a pending countdown."""
+        if self._policy is not None:
+            self._policy.record_call()
+        if self._timeout_id is not None:
+            self._schedule()
+
     def cancel(self) -> None:
         """Cancel any pending timeout permanently (used during shutdown)."""
         self._cancel()
 
+    def timeout_seconds(self) -> int:
+        """Return the current length of the inactivity timeout."""
+        if self._policy is not None:
+            return self._policy.timeout_seconds()
+        return self._timeout_seconds
+
     def _schedule(self) -> None:
         self._cancel()
         self._timeout_id = GLib.timeout_add_seconds(
-            self._timeout_seconds, self._on_timeout
+            self.timeout_seconds(), self._on_timeout
         )
 
     def _cancel(self) -> None:
@@ -182,6 +656,415 @@ class _IdleManager:
         return _SOURCE_REMOVE
 
 
+class _IdlePolicy:
+    """Chooses the idle timeout from the gaps between past calls.
+
+    Clients tend to call in bursts -- at login, when Software & Updates
+    opens, when apport collects a report -- and each burst that finds the
+    service gone pays for activation and detection again.  So the last
+    `history_size` gaps between consecutive calls are kept, including the
+    gap to the first call of an activation, and if most of them are shorter
+    than `maximum` the timeout grows to cover nine out of ten of those short
+    gaps.  Otherwise the next call is not expected any time soon, and the
+    timeout stays at `default`.
+
+    Args:
+        path: JSON file keeping the history across activations.
+        default: The shortest, and the fallback, timeout in seconds.
+        maximum: The longest timeout in seconds.
+        history_size: Number of gaps to learn from.
+        clock: Returns the current wall-clock time in seconds.
+    """
+
+    # Gaps needed before the history is trusted.
+    MIN_SAMPLES = 4
+
+    def __init__(
+        self,
+        path: str = DEFAULT_IDLE_HISTORY_PATH,
+        default: int = DEFAULT_IDLE_TIMEOUT_SECONDS,
+        maximum: int = MAX_IDLE_TIMEOUT_SECONDS,
+        history_size: int = DEFAULT_IDLE_HISTORY_SIZE,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._path = path
+        self._default = default
+        self._maximum = maximum
+        self._clock = clock
+        self._gaps: Deque[float] = collections.deque(maxlen=history_size)
+        self._last_call: Optional[float] = None
+
+    def load(self) -> None:
+        """Read the history written by :meth:`save`, if there is a valid one."""
+        try:
+            with open(self._path) as f:
+                history = json.load(f)
+            last_call = history["last_call"]
+            gaps = [float(gap) for gap in history["gaps"]]
+        except (OSError, ValueError, TypeError, KeyError) as ex:
+            logging.debug("Cannot read idle history %s: %s", self._path, ex)
+            return
+        self._gaps.extend(gaps)
+        self._last_call = float(last_call) if last_call is not None else None
+
+    def save(self) -> None:
+        """Atomically replace the history file."""
+        directory = os.path.dirname(self._path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".idle-history-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(
+                        {"last_call": self._last_call, "gaps": list(self._gaps)}, f
+                    )
+                os.replace(tmp_path, self._path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as ex:
+            logging.warning("Cannot write idle history %s: %s", self._path, ex)
+
+    def record_call(self) -> None:
+        """Note that a call arrived now."""
+        now = self._clock()
+        # a clock set backwards yields no usable gap
+        if self._last_call is not None and now >= self._last_call:
+            self._gaps.append(now - self._last_call)
+        self._last_call = now
+
+    def timeout_seconds(self) -> int:
+        """Return the idle timeout for the history so far."""
+        short = sorted(gap for gap in self._gaps if gap <= self._maximum)
+        if len(short) < self.MIN_SAMPLES or 2 * len(short) <= len(self._gaps):
+            return self._default
+        gap = short[(len(short) * 9 - 1) // 10]
+        return max(self._default, min(self._maximum, math.ceil(gap)))
+
+
+class _StateWatcher:
+    """Watches the package state and invokes a callback once it settles.
+
+    Every path gets a ``Gio.FileMonitor``: a directory monitor if it is a
+    directory, a file monitor otherwise.  File monitors also work for paths
+    that do not exist yet, so e.g. a custom GPU list created later is still
+    noticed.  Each event restarts the settle timer, and `on_change` runs on
+    the main loop once no event arrived for `settle_ms`.
+
+    Args:
+        on_change: Callable invoked after the package state changed.
+        paths: Files and directories to watch.
+        settle_ms: Quiet period in milliseconds before invoking `on_change`.
+    """
+
+    def __init__(
+        self,
+        on_change: Callable[[], object],
+        paths: Sequence[str] = _STATE_PATHS,
+        settle_ms: int = DEFAULT_STATE_SETTLE_MS,
+    ) -> None:
+        self._on_change_cb = on_change
+        self._paths = paths
+        self._settle_ms = settle_ms
+        self._monitors: List[Gio.FileMonitor] = []
+        self._settle_id: Optional[int] = None
+
+    def start(self) -> None:
+        """Start watching.  Paths that cannot be monitored are skipped."""
+        for path in self._paths:
+            gfile = Gio.File.new_for_path(path)
+            try:
+                if os.path.isdir(path):
+                    monitor = gfile.monitor_directory(
+                        Gio.FileMonitorFlags.WATCH_MOVES, None
+                    )
+                else:
+                    monitor = gfile.monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error as ex:
+                logging.warning("Cannot watch %s: %s", path, ex.message)
+                continue
+            monitor.connect("changed", self._on_event)
+            self._monitors.append(monitor)
+
+    def stop(self) -> None:
+        """Stop watching and drop any pending notification."""
+        for monitor in self._monitors:
+            monitor.cancel()
+        self._monitors.clear()
+        if self._settle_id is not None:
+            GLib.source_remove(self._settle_id)
+            self._settle_id = None
+
+    def _on_event(
+        self,
+        _monitor: Gio.FileMonitor,
+        _file: Gio.File,
+        _other_file: Optional[Gio.File],
+        _event_type: Gio.FileMonitorEvent,
+    ) -> None:
+        if self._settle_id is not None:
+            GLib.source_remove(self._settle_id)
+        self._settle_id = GLib.timeout_add(self._settle_ms, self._on_settled)
+
+    def _on_settled(self) -> bool:
+        self._settle_id = None
+        self._on_change_cb()
+        return _SOURCE_REMOVE
+
+
+class _HotplugMonitor:
+    """Reports devices being added to or removed from the system.
+
+    Events come from udev through GUdev, which is optional: without it
+    :meth:`start` returns False, and hardware changes are only picked up by
+    the next activation.  ``add`` events of devices without a modalias are
+    ignored, since no driver package can match them.
+
+    Args:
+        on_event: Callable invoked on the main loop with the action
+            (``"add"`` or ``"remove"``), the sysfs path and the modalias of
+            a device.
+        subsystems: Subsystems to listen on; all of them if empty.
+    """
+
+    def __init__(
+        self,
+        on_event: Callable[[str, str, str], object],
+        subsystems: Sequence[str] = _HOTPLUG_SUBSYSTEMS,
+    ) -> None:
+        self._on_event_cb = on_event
+        self._subsystems = subsystems
+        self._client: Any = None
+
+    def start(self) -> bool:
+        """Start listening; return whether udev events can be received."""
+        try:
+            import gi
+
+            gi.require_version("GUdev", "1.0")
+            from gi.repository import GUdev
+        except (ImportError, ValueError) as ex:
+            logging.info("Not watching for hardware changes: %s", ex)
+            return False
+        self._client = GUdev.Client.new(list(self._subsystems))
+        self._client.connect("uevent", self.on_uevent)
+        return True
+
+    def stop(self) -> None:
+        """Stop listening."""
+        self._client = None
+
+    def on_uevent(self, _client: Any, action: str, device: Any) -> None:
+        """Handle the ``uevent`` signal of a ``GUdev.Client``; *device* needs
+        ``get_sysfs_path()`` and ``get_property()``."""
+        sys_path = device.get_sysfs_path()
+        modalias = device.get_property("MODALIAS") or ""
+        if action == "remove" or (action == "add" and modalias):
+            self._on_event_cb(action, sys_path, modalias)
+
+
+class _ResultCache:
+    """Persistent copy of the detection result.
+
+    The result is stored as a serialized ``(uss(aa{sv}))`` GVariant: format
+    version, hardware fingerprint, package state identity and the
+    ``drivers()`` return value.  Looking it up maps the file and hands out the
+    embedded return value without copying it.  The data is in host byte
+    order, which is fine for a cache that never leaves the machine.
+
+    Both :meth:`lookup` and :meth:`store` only touch the file system, so they
+    are safe to call from the detection thread.
+
+    Args:
+        path: Location of the cache file.
+        state_paths: Files and directories whose status makes up the package
+            state identity.
+    """
+
+    _TYPE = f"(uss({_DRIVERS_SIGNATURE}))"
+
+    def __init__(
+        self,
+        path: str = DEFAULT_RESULT_CACHE_PATH,
+        state_paths: Sequence[str] = _STATE_PATHS,
+    ) -> None:
+        self._path = path
+        self._state_paths = state_paths
+
+    def state_identity(self) -> str:
+        """Digest of everything besides the hardware that detection depends on.
+
+        This covers the running kernel release, the size and mtime of the
+        package state paths (and of the entries of those that are directories)
+        and of the detection plugins.
+        """
+        plugin_dir = os.environ.get(
+            "UBUNTU_DRIVERS_DETECT_DIR", "/usr/share/ubuntu-drivers-common/detect/"
+        )
+        digest = hashlib.sha256()
+        digest.update(f"{os.uname().release}\n".encode())
+        for path in [*self._state_paths, plugin_dir]:
+            digest.update(self._stat_tag(path))
+            if os.path.isdir(path):
+                for entry in sorted(os.listdir(path)):
+                    digest.update(self._stat_tag(os.path.join(path, entry)))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _stat_tag(path: str) -> bytes:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return f"{path}\0-\n".encode()
+        return f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode()
+
+    def lookup(self, hardware: str, state: str) -> Optional[GLib.Variant]:
+        """Return the cached ``drivers()`` value if it matches both tags."""
+        try:
+            mapped = GLib.MappedFile.new(self._path, False)
+        except GLib.Error:
+            return None
+
+        variant = GLib.Variant.new_from_bytes(
+            GLib.VariantType.new(self._TYPE), mapped.get_bytes(), False
+        )
+        # Anything not in normal form was not written by store(); treat it
+        # like a mismatch rather than serving whatever it decodes to.
+        if not variant.is_normal_form():
+            logging.warning("Ignoring malformed result cache %s", self._path)
+            return None
+        if (
+            variant.get_child_value(0).get_uint32() != _RESULT_CACHE_VERSION
+            or variant.get_child_value(1).get_string() != hardware
+            or variant.get_child_value(2).get_string() != state
+        ):
+            return None
+        return variant.get_child_value(3)
+
+    def store(self, hardware: str, state: str, value: GLib.Variant) -> None:
+        """Atomically replace the cache file with *value* and its tags."""
+        variant = GLib.Variant.new_tuple(
+            GLib.Variant("u", _RESULT_CACHE_VERSION),
+            GLib.Variant("s", hardware),
+            GLib.Variant("s", state),
+            value,
+        )
+        directory = os.path.dirname(self._path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".drivers-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(variant.get_data_as_bytes().get_data())
+                os.replace(tmp_path, self._path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as ex:
+            logging.warning("Cannot write result cache %s: %s", self._path, ex)
+
+
+class _DetectionStats:
+    """Timings and counters reported by ``com.ubuntu.Drivers.Debug.Stats()``.
+
+    :meth:`begin` and :meth:`finish` bracket one detection on the main
+    thread; in between, :meth:`phase` is called from the detection thread
+    for every :func:`UbuntuDrivers.detect.detection_phase` boundary.  Only
+    finished detections are reported, so the main thread never reads a
+    record that is still being written.
+
+    Args:
+        history: Number of finished detections to keep.
+    """
+
+    def __init__(self, history: int = DEFAULT_STATS_HISTORY) -> None:
+        self._detections: Deque[Dict[str, Any]] = collections.deque(maxlen=history)
+        self._current: Optional[Dict[str, Any]] = None
+        self._phase_started: Dict[str, float] = {}
+        self.counters: Dict[str, int] = collections.Counter()
+
+    def begin(self) -> None:
+        self._current = {
+            "started": GLib.get_real_time(),
+            "monotonic": time.monotonic(),
+            "phases": collections.defaultdict(float),
+            "phase_counts": collections.Counter(),
+            "result_cache_hit": False,
+        }
+        self._phase_started = {}
+
+    def phase(self, name: str, started: bool) -> None:
+        # Called in the detection thread.
+        current = self._current
+        if current is None:
+            return
+        now = time.monotonic()
+        if started:
+            self._phase_started[name] = now
+            current["phase_counts"][name] += 1
+            if name == "spawn":
+                self.counters["subprocess_spawns"] += 1
+        elif name in self._phase_started:
+            current["phases"][name] += now - self._phase_started.pop(name)
+
+    def result_cache_hit(self) -> None:
+        # Called in the detection thread.
+        if self._current is not None:
+            self._current["result_cache_hit"] = True
+
+    def finish(self, outcome: str) -> None:
+        current = self._current
+        if current is None:
+            return
+        self._current = None
+        current["duration"] = time.monotonic() - current.pop("monotonic")
+        current["outcome"] = outcome
+        self._detections.append(current)
+        self.counters["detections"] += 1
+
+    def variant(self, pending: int) -> GLib.Variant:
+        """Return the ``(a{sv})`` reply of ``Stats()``."""
+        detections = [
+            GLib.Variant(
+                "a{sv}",
+                {
+                    "started": GLib.Variant("x", d["started"]),
+                    "duration": GLib.Variant("d", d["duration"]),
+                    "outcome": GLib.Variant("s", d["outcome"]),
+                    "result_cache_hit": GLib.Variant("b", d["result_cache_hit"]),
+                    "phases": GLib.Variant("a{sd}", dict(d["phases"])),
+                    "phase_counts": GLib.Variant("a{su}", dict(d["phase_counts"])),
+                },
+            )
+            for d in self._detections
+        ]
+        stats = {
+            name: GLib.Variant("t", self.counters[name])
+            for name in (
+                "detections",
+                "cache_hits",
+                "result_cache_hits",
+                "result_cache_misses",
+                "coalesced_calls",
+                "worker_spawns",
+                "subprocess_spawns",
+            )
+        }
+        stats["detection_history"] = GLib.Variant.new_array(
+            GLib.VariantType.new("a{sv}"), detections
+        )
+        stats["pending_calls"] = GLib.Variant("u", pending)
+        # ru_maxrss is in KiB on Linux.  Workers are only accounted for in
+        # RUSAGE_CHILDREN once they have been waited for, which they are.
+        stats["peak_rss_kib"] = GLib.Variant(
+            "t", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        )
+        stats["peak_worker_rss_kib"] = GLib.Variant(
+            "t", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        )
+        return GLib.Variant.new_tuple(GLib.Variant("a{sv}", stats))
+
+
 class DriversService:
     """D-Bus object that exposes driver detection results on com.ubuntu.Drivers.
 
@@ -193,19 +1076,90 @@ class DriversService:
     calls are queued and all receive the same result when detection completes.
     After a result is cached it is returned immediately to callers.
 
-    The cache is never refreshed in place, and serving it does not restart the
-    inactivity timer, so the idle timeout doubles as the upper bound on how
-    stale a reply can be: once it fires the process exits and the next call
-    activates a fresh one.  Use :meth:`invalidate_cache` to force re-detection
-    within the lifetime of a single process.
-
-    The object exposes a single interface:
+    :meth:`refresh` drops the cached result and re-runs detection in the
+    background; the service runner calls it whenever the package state
+    changes, so the cache is warm again by the time the next caller arrives.
+    A result computed while the state changed underneath it is handed to the
+    callers that were already waiting but is not cached.  Every call, cached
+    or not, restarts the inactivity timer; keeping the result current is up
+    to the watchers, not to the idle timeout.
+
+    ``Prewarm`` returns at once and, unless there is a result or detection
+    already runs, starts detection in the background, so that a caller
+    expected shortly is answered from the cache.  It does not count as a
+    call for the idle policy.
+
+    With a `result_cache`, every detection result is also written to disk,
+    and a new process answers its first call from there -- without opening
+    the apt cache -- as long as the hardware and the package state still
+    match the ones the result was computed for.
+
+    ``StartDetection`` is the streaming counterpart of ``drivers``: it returns
+    at once, and the service then emits ``DeviceDetected`` with the ``a{sv}``
+    dict of every device followed by ``DetectionFinished``.  Devices are
+    emitted from the detection thread as soon as they are resolved.  Their
+    ``recommended`` flags only consider the device itself, so any device
+    whose final entry turns out different is emitted once more before
+    ``DetectionFinished``; the last report for a device wins.  When the
+    result is already cached, all devices are emitted right away.
+
+    ``GetDevice``, ``DriversForModaliases`` and ``Recommended`` answer
+    narrower questions from a :class:`_ResultIndex` over the cached result,
+    so their replies stay small and need no walk over all devices.  Calls
+    that arrive before there is a result wait for detection like
+    ``drivers`` does.
+
+    ``PlanInstall`` returns the packages ``ubuntu-drivers install`` would
+    install for the given options (``free_only``, ``include_oem``,
+    ``include_dkms`` and ``driver``, as on the command line).  It filters the
+    driver candidates of the cached result with
+    :func:`UbuntuDrivers.detect.auto_install_filter` in simulation mode, so
+    only the apt cache is opened and detection is not run again.  Plans are
+    memoized per option set until the cached result is invalidated.
+
+    The unique bus names of waiting callers are watched, and once the last
+    one has left the bus, detection is cancelled at the next phase boundary
+    (see :func:`UbuntuDrivers.detect.detection_phase`) rather than run to
+    completion for nobody.  Detection started by :meth:`refresh` or for
+    ``StartDetection`` has no single caller and is never cancelled.  The
+    apt modalias map is kept once built, cancelled or not, until the package
+    state changes.
+
+    :meth:`device_event` keeps the cached result in step with hotplugged
+    hardware (fed by a :class:`_HotplugMonitor`): only the added device is
+    resolved -- against the kept modalias map when there is one -- and the
+    removed one dropped, and ``DevicesChanged`` then names the sysfs paths of
+    both.  An added device's ``recommended`` flags only consider that device.
+
+    Detection phase timings, cache and call counters and the peak memory use
+    are reported by ``com.ubuntu.Drivers.Debug.Stats`` (see
+    :class:`_DetectionStats`).
+
+    The object exposes two interfaces:
 
         interface com.ubuntu.Drivers
             method drivers() -> aa{sv}
+            method GetDevice(s sys_path) -> a{sv}
+            method DriversForModaliases(as modaliases) -> a{sas}
+            method Recommended() -> a{ss}
+            method PlanInstall(a{sv} options) -> as
+            method StartDetection()
+            method Prewarm()
+            signal DeviceDetected(a{sv})
+            signal DetectionFinished()
+            signal DevicesChanged(as added, as removed)
+
+        interface com.ubuntu.Drivers.Debug
+            method Stats() -> a{sv}
 
     Args:
         idle_manager: Instance of _IdleManager to manage inactivity timeouts.
+        result_cache: Optional _ResultCache to persist results across
+            activations.
+        out_of_process: Run detection in a short-lived worker process (see
+            :func:`_detect_in_worker`), so that the apt cache is never loaded
+            into the service.  The modalias map is then only sent back once
+            a ``DriversForModaliases`` call needs it.
     """
 
     BUS_NAME = "com.ubuntu.Drivers"
@@ -216,48 +1170,146 @@ class DriversService:
     <method name="drivers">
       <arg type="aa{sv}" direction="out"/>
     </method>
+    <method name="GetDevice">
+      <arg name="sys_path" type="s" direction="in"/>
+      <arg type="a{sv}" direction="out"/>
+    </method>
+    <method name="DriversForModaliases">
+      <arg name="modaliases" type="as" direction="in"/>
+      <arg type="a{sas}" direction="out"/>
+    </method>
+    <method name="Recommended">
+      <arg type="a{ss}" direction="out"/>
+    </method>
+    <method name="PlanInstall">
+      <arg name="options" type="a{sv}" direction="in"/>
+      <arg type="as" direction="out"/>
+    </method>
+    <method name="StartDetection"/>
+    <method name="Prewarm"/>
+    <signal name="DeviceDetected">
+      <arg type="a{sv}"/>
+    </signal>
+    <signal name="DetectionFinished"/>
+    <signal name="DevicesChanged">
+      <arg name="added" type="as"/>
+      <arg name="removed" type="as"/>
+    </signal>
+  </interface>
+  <interface name="com.ubuntu.Drivers.Debug">
+    <method name="Stats">
+      <arg type="a{sv}" direction="out"/>
+    </method>
   </interface>
 </node>
 """
+    _QUERY_METHODS = (
+        "drivers",
+        "GetDevice",
+        "DriversForModaliases",
+        "Recommended",
+        "PlanInstall",
+    )
 
     def __init__(
         self,
         idle_manager: _IdleManager,
+        result_cache: Optional[_ResultCache] = None,
+        out_of_process: bool = False,
     ) -> None:
         self._idle_manager = idle_manager
+        self._result_cache = result_cache
+        self._out_of_process = out_of_process
         self._object_registration_id: Optional[int] = None
-        self._interface_info = Gio.DBusNodeInfo.new_for_xml(
+        self._connection: Optional[Gio.DBusConnection] = None
+        self._interface_infos = Gio.DBusNodeInfo.new_for_xml(
             self._INTROSPECTION_XML
-        ).interfaces[0]
+        ).interfaces
+        self._debug_registration_id: Optional[int] = None
+        self._stats = _DetectionStats()
+        # PlanInstall() results for the cached result, the _PLAN_MEMO_SIZE
+        # most recently asked for, and the calls waiting for a plan task, by
+        # option set
+        self._plans: collections.OrderedDict[_PlanKey, List[str]] = (
+            collections.OrderedDict()
+        )
+        self._plan_invocations: Dict[_PlanKey, List[Gio.DBusMethodInvocation]] = {}
 
         self._cached_result: Optional[GLib.Variant] = None
+        self._index: Optional[_ResultIndex] = None
         self._pending_invocations: List[Gio.DBusMethodInvocation] = []
         self._task_running = False
+        # Bumped on every invalidation; a detection that started under an
+        # older generation must not populate the cache.
+        self._generation = 0
+        self._task_generation = 0
+        # Whether the running task must produce the modalias map even if the
+        # result itself comes from the result cache.
+        self._task_needs_map = False
+        # The last modalias map built, and the generation it belongs to.  It
+        # is set from the detection thread as soon as it is built.
+        self._modalias_map: Optional[_ModaliasMap] = None
+        self._modalias_map_generation = -1
+        # Whether the running task was started without a caller to wait for
+        # it, and how to cancel it otherwise.
+        self._task_background = False
+        self._task_cancellable: Optional[Gio.Cancellable] = None
+        # NameOwnerChanged subscriptions by the unique name of a waiting caller
+        self._caller_watches: Dict[str, int] = {}
+        # Set by StartDetection() until DetectionFinished is emitted.
+        # Devices emitted by the detection thread are recorded in _streamed
+        # by sys_path, and only read back when the task has completed.
+        self._streaming = False
+        self._task_streaming = False
+        self._streamed: Dict[str, GLib.Variant] = {}
+        # Hotplugged devices (sysfs path → modalias) waiting to be resolved,
+        # and those being resolved by the running hotplug task.
+        self._hotplug_queue: Dict[str, str] = {}
+        self._hotplug_resolving: Dict[str, str] = {}
+        self._hotplug_running = False
 
     def export(self, connection: Gio.DBusConnection) -> None:
         """Register the D-Bus object on *connection*."""
         if self._object_registration_id is not None:
             return
+        self._connection = connection
 
         # register_object_with_closures2() is required for the async pattern
         # used here: the older closure API does not keep the invocation alive
         # once the handler returns, and _handle_method_call() holds onto it
         # until detection finishes.  Fall back only where it is unavailable.
         if hasattr(connection, "register_object_with_closures2"):
-            self._object_registration_id = connection.register_object_with_closures2(
-                self.OBJ_PATH,
-                self._interface_info,
-                self._handle_method_call,
-                None,
-                None,
-            )
+            register = connection.register_object_with_closures2
+        else:
+            register = connection.register_object
+        self._object_registration_id = register(
+            self.OBJ_PATH,
+            self._interface_infos[0],
+            self._handle_method_call,
+            None,
+            None,
+        )
+        self._debug_registration_id = register(
+            self.OBJ_PATH, self._interface_infos[1], self._handle_debug_call, None, None
+        )
+
+    def _handle_debug_call(
+        self,
+        _connection: Gio.DBusConnection,
+        _sender: str,
+        _object_path: str,
+        _interface_name: str,
+        method_name: str,
+        _parameters: GLib.Variant,
+        invocation: Gio.DBusMethodInvocation,
+    ) -> None:
+        """Dispatch a call to the com.ubuntu.Drivers.Debug interface."""
+        if method_name == "Stats":
+            invocation.return_value(self._stats.variant(len(self._pending_invocations)))
         else:
-            self._object_registration_id = connection.register_object(
-                self.OBJ_PATH,
-                self._interface_info,
-                self._handle_method_call,
-                None,
-                None,
+            invocation.return_dbus_error(
+                "org.freedesktop.DBus.Error.UnknownMethod",
+                f"Unknown method: {method_name}",
             )
 
     def _handle_method_call(
@@ -267,37 +1319,292 @@ class DriversService:
         _object_path: str,
         _interface_name: str,
         method_name: str,
-        _parameters: GLib.Variant,
+        parameters: GLib.Variant,
         invocation: Gio.DBusMethodInvocation,
     ) -> None:
         """Dispatch an incoming D-Bus method call."""
-        if method_name != "drivers":
+        if method_name == "Prewarm":
+            invocation.return_value(None)
+            if self._cached_result is None and not self._task_running:
+                self._start_detection(background=True)
+            return
+
+        self._idle_manager.activity()
+        if method_name == "StartDetection":
+            self._start_streaming(invocation)
+            return
+
+        if method_name not in self._QUERY_METHODS:
             invocation.return_dbus_error(
                 "org.freedesktop.DBus.Error.UnknownMethod",
                 f"Unknown method: {method_name}",
             )
             return
 
-        if self._cached_result is not None:
-            # Deliberately does not touch the idle manager: a cache hit must
-            # not extend the lifetime of the process, because the cache is
-            # never refreshed while it lives.  The idle timeout is therefore
-            # also the upper bound on how stale a reply can be.
-            invocation.return_value(self._cached_result)
-            return
+        if method_name == "PlanInstall":
+            try:
+                _plan_key(parameters.unpack()[0])
+            except ValueError as ex:
+                invocation.return_dbus_error(
+                    "org.freedesktop.DBus.Error.InvalidArgs", str(ex)
+                )
+                return
+
+        if self._cached_result is not None and self._index is not None:
+            if (
+                method_name != "DriversForModaliases"
+                or self._index.modalias_map is not None
+            ):
+                self._stats.counters["cache_hits"] += 1
+                self._answer(invocation, self._cached_result, self._index)
+                return
 
         self._pending_invocations.append(invocation)
+        self._watch_caller(invocation.get_sender())
+
+        if not self._task_running:
+            self._start_detection()
+        else:
+            self._stats.counters["coalesced_calls"] += 1
+
+    def _watch_caller(self, sender: Optional[str]) -> None:
+        if self._connection is None or not sender or sender in self._caller_watches:
+            return
+        self._caller_watches[sender] = self._connection.signal_subscribe(
+            "org.freedesktop.DBus",
+            "org.freedesktop.DBus",
+            "NameOwnerChanged",
+            "/org/freedesktop/DBus",
+            sender,
+            Gio.DBusSignalFlags.NONE,
+            self._on_name_owner_changed,
+        )
+
+    def _unwatch_callers(self) -> None:
+        """Drop the watches of all callers that are no longer waiting."""
+        waiting = {invocation.get_sender() for invocation in self._pending_invocations}
+        for sender in list(self._caller_watches):
+            if sender not in waiting:
+                subscription = self._caller_watches.pop(sender)
+                if self._connection is not None:
+                    self._connection.signal_unsubscribe(subscription)
+
+    def _on_name_owner_changed(
+        self,
+        _connection: Gio.DBusConnection,
+        _sender: str,
+        _object_path: str,
+        _interface_name: str,
+        _signal_name: str,
+        parameters: GLib.Variant,
+    ) -> None:
+        name, _old_owner, new_owner = parameters.unpack()
+        if new_owner:
+            return
+
+        # A caller that left the bus cannot be answered anymore.
+        self._pending_invocations[:] = [
+            invocation
+            for invocation in self._pending_invocations
+            if invocation.get_sender() != name
+        ]
+        self._unwatch_callers()
+
+        if (
+            not self._pending_invocations
+            and not self._task_background
+            and not self._streaming
+            and self._task_cancellable is not None
+        ):
+            logging.debug("all callers left, cancelling detection")
+            self._task_cancellable.cancel()
+
+    def _answer(
+        self,
+        invocation: Gio.DBusMethodInvocation,
+        result: GLib.Variant,
+        index: _ResultIndex,
+    ) -> None:
+        """Answer a query method call from *result* and its *index*."""
+        method_name = invocation.get_method_name()
+        if method_name == "PlanInstall":
+            self._plan(invocation, result)
+        elif method_name == "GetDevice":
+            (sys_path,) = invocation.get_parameters().unpack()
+            device = index.device(sys_path)
+            if device is None:
+                invocation.return_dbus_error(
+                    _ERROR_NO_SUCH_DEVICE, f"No drivers for device {sys_path}"
+                )
+            else:
+                invocation.return_value(device)
+        elif method_name == "DriversForModaliases":
+            (modaliases,) = invocation.get_parameters().unpack()
+            invocation.return_value(index.drivers_for_modaliases(modaliases))
+        elif method_name == "Recommended":
+            invocation.return_value(index.recommended)
+        else:
+            invocation.return_value(result)
+
+    def _plan(self, invocation: Gio.DBusMethodInvocation, result: GLib.Variant) -> None:
+        """Answer a PlanInstall() call for *result*, from the memoized plan
+        or else from a plan task."""
+        free_only, include_oem, include_dkms, driver = _plan_key(
+            invocation.get_parameters().unpack()[0]
+        )
+        packages = _plan_packages(result, free_only, include_oem)
+        selected = _plan_driver(packages, driver)
+        if selected is None:
+            invocation.return_value(GLib.Variant("(as)", ([],)))
+            return
+        key = (free_only, include_oem, include_dkms, selected)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            invocation.return_value(GLib.Variant("(as)", (plan,)))
+            return
+
+        waiting = self._plan_invocations.setdefault(key, [])
+        waiting.append(invocation)
+        if len(waiting) > 1:
+            return
+
+        self._idle_manager.hold()
+        task = Gio.Task.new(None, None, self._on_plan_done, (key, self._generation))
+        task.run_in_thread(
+            lambda task, _obj, _data, _cancel: self._run_plan(
+                task, packages, include_dkms, driver
+            )
+        )
+
+    def _run_plan(
+        self,
+        task: Gio.Task,
+        packages: Dict[str, UbuntuDrivers.detect.PackageInfo],
+        include_dkms: bool,
+        driver: str,
+    ) -> None:
+        try:
+            if self._out_of_process:
+                self._stats.counters["worker_spawns"] += 1
+                plan = _run_worker(
+                    ["--plan"], request=(packages, include_dkms, driver)
+                )["plan"]
+            else:
+                plan = _plan_install(_open_apt_cache(), packages, include_dkms, driver)
+            task.return_value(GLib.Variant("as", plan))
+        except RuntimeError as ex:
+            task.return_error(GLib.Error(str(ex), _ERROR_CACHE_FAILURE, 0))
+        except Exception as ex:
+            logging.exception("PlanInstall(): planning failed")
+            task.return_error(GLib.Error(str(ex), _ERROR_FAILED, 0))
+
+    def _on_plan_done(
+        self, _source: None, result: Gio.Task, data: Tuple[_PlanKey, int]
+    ) -> None:
+        key, generation = data
+        invocations = self._plan_invocations.pop(key, [])
+        try:
+            plan = result.propagate_value().value.unpack()
+        except GLib.Error as ex:
+            for invocation in invocations:
+                invocation.return_dbus_error(_dbus_error_name(ex.domain), ex.message)
+        else:
+            # A plan made for an invalidated result is handed out once, but
+            # not memoized.
+            if generation == self._generation:
+                self._plans[key] = plan
+                if len(self._plans) > _PLAN_MEMO_SIZE:
+                    self._plans.popitem(last=False)
+            for invocation in invocations:
+                invocation.return_value(GLib.Variant("(as)", (plan,)))
+        finally:
+            self._idle_manager.release()
+
+    def _start_streaming(self, invocation: Gio.DBusMethodInvocation) -> None:
+        # Reply first, so that the caller sees the reply before any signal.
+        invocation.return_value(None)
+
+        if self._cached_result is not None:
+            self._stats.counters["cache_hits"] += 1
+            self._emit_devices(self._cached_result)
+            self._emit_signal("DetectionFinished", None)
+            return
 
+        self._streaming = True
         if not self._task_running:
-            self._task_running = True
-            self._idle_manager.hold()
-            task = Gio.Task.new(None, None, self._on_done, None)
-            task.set_return_on_cancel(True)
-            task.run_in_thread(self._run)
+            self._start_detection()
 
-    def _run(self, task: Gio.Task, _obj: None, _data: None, _cancel: None) -> None:
+    def _emit_signal(self, name: str, parameters: Optional[GLib.Variant]) -> None:
+        if self._connection is None:
+            return
+        try:
+            self._connection.emit_signal(
+                None, self.OBJ_PATH, self.BUS_NAME, name, parameters
+            )
+        except GLib.Error as ex:
+            logging.warning("Cannot emit %s: %s", name, ex.message)
+
+    def _emit_devices(self, result: GLib.Variant) -> None:
+        """Emit DeviceDetected for the devices of *result* that were not
+        streamed with identical contents."""
+        devices = result.get_child_value(0)
+        for i in range(devices.n_children()):
+            device = devices.get_child_value(i)
+            sys_path = device.lookup_value("sys_path", None).get_string()
+            streamed = self._streamed.get(sys_path)
+            if streamed is None or not streamed.equal(device):
+                self._emit_signal("DeviceDetected", GLib.Variant.new_tuple(device))
+
+    def _stream_device(self, device: GLib.Variant) -> None:
+        # Called in the detection thread; GDBusConnection is thread safe.
+        self._emit_signal("DeviceDetected", GLib.Variant.new_tuple(device))
+        self._streamed[device.lookup_value("sys_path", None).get_string()] = device
+
+    def _start_detection(self, background: bool = False) -> None:
+        self._task_running = True
+        self._task_generation = self._generation
+        self._task_streaming = self._streaming
+        self._task_background = background
+        self._streamed = {}
+        self._task_needs_map = any(
+            invocation.get_method_name() == "DriversForModaliases"
+            for invocation in self._pending_invocations
+        )
+        self._idle_manager.hold()
+        self._stats.begin()
+        self._task_cancellable = Gio.Cancellable()
+        task = Gio.Task.new(None, self._task_cancellable, self._on_done, None)
+        # Cancellation is cooperative: the detection thread notices it at the
+        # next phase boundary, and a result it completed anyway is kept.
+        task.set_return_on_cancel(False)
+        task.set_check_cancellable(False)
+        task.run_in_thread(self._run)
+
+    def _run(
+        self,
+        task: Gio.Task,
+        _obj: None,
+        _data: None,
+        cancellable: Optional[Gio.Cancellable],
+    ) -> None:
+        thread = threading.get_ident()
+
+        def phase_boundary(phase: str, started: bool) -> None:
+            # phase_hooks is global, so leave other threads' detection alone
+            if threading.get_ident() != thread:
+                return
+            self._stats.phase(phase, started)
+            if cancellable is not None:
+                cancellable.set_error_if_cancelled()
+
+        UbuntuDrivers.detect.phase_hooks.append(phase_boundary)
         try:
-            task.return_value(_build_drivers_variant())
+            task.return_value(self._detect())
+        except GLib.Error as ex:
+            if not ex.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                logging.exception("drivers(): detection failed")
+            task.return_error(ex)
         except RuntimeError as ex:
             task.return_error(GLib.Error(str(ex), _ERROR_CACHE_FAILURE, 0))
         except Exception as ex:
@@ -307,15 +1614,81 @@ class DriversService:
             # caller would ever be answered.
             logging.exception("drivers(): detection failed")
             task.return_error(GLib.Error(str(ex), _ERROR_FAILED, 0))
+        finally:
+            UbuntuDrivers.detect.phase_hooks.remove(phase_boundary)
+
+    # The methods below are called in the detection thread.
+
+    def _kept_modalias_map(self) -> Optional[_ModaliasMap]:
+        if self._modalias_map_generation != self._task_generation:
+            return None
+        return self._modalias_map
+
+    def _keep_modalias_map(self, modalias_map: _ModaliasMap) -> None:
+        self._modalias_map_generation = self._task_generation
+        self._modalias_map = modalias_map
+
+    def _get_modalias_map(self, cache: apt_pkg.Cache) -> _ModaliasMap:
+        modalias_map = self._kept_modalias_map()
+        if modalias_map is None:
+            modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+            self._keep_modalias_map(modalias_map)
+        return modalias_map
+
+    def _run_detection(self) -> GLib.Variant:
+        on_device = self._stream_device if self._task_streaming else None
+        if not self._out_of_process:
+            return _detect_drivers(on_device, self._get_modalias_map)[0]
+
+        self._stats.counters["worker_spawns"] += 1
+        value, modalias_map = _detect_in_worker(
+            on_device,
+            with_map=self._task_needs_map and self._kept_modalias_map() is None,
+        )
+        if modalias_map is not None:
+            self._keep_modalias_map(modalias_map)
+        assert value is not None
+        return value
+
+    def _detect(self) -> GLib.Variant:
+        if self._result_cache is None:
+            return self._run_detection()
+
+        # Both tags are taken before detection starts: should the state
+        # change while it runs, the stored result merely misses next time.
+        hardware = UbuntuDrivers.detect.hardware_fingerprint(
+            UbuntuDrivers.detect.system_modaliases(sys_path)
+        )
+        state = self._result_cache.state_identity()
+        value = self._result_cache.lookup(hardware, state)
+        if value is None:
+            self._stats.counters["result_cache_misses"] += 1
+            value = self._run_detection()
+            self._result_cache.store(hardware, state, value)
+            return value
+
+        self._stats.counters["result_cache_hits"] += 1
+        self._stats.result_cache_hit()
+        if self._task_needs_map and self._kept_modalias_map() is None:
+            if self._out_of_process:
+                self._stats.counters["worker_spawns"] += 1
+                modalias_map = _detect_in_worker(map_only=True)[1]
+                assert modalias_map is not None
+                self._keep_modalias_map(modalias_map)
+            else:
+                self._get_modalias_map(_open_apt_cache())
+        return value
 
     def _on_done(self, _source: None, result: Gio.Task, _data: None) -> None:
         value = None
         error_name = ""
         message = ""
 
+        cancelled = False
         try:
             value = result.propagate_value().value
         except GLib.Error as ex:
+            cancelled = ex.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED)
             error_name = _dbus_error_name(ex.domain)
             message = ex.message
         except Exception as ex:
@@ -323,22 +1696,224 @@ class DriversService:
             error_name = _ERROR_FAILED
             message = str(ex)
 
+        stale = self._task_generation != self._generation
+        if cancelled:
+            self._stats.finish("cancelled")
+        elif error_name:
+            self._stats.finish("failed")
+        else:
+            self._stats.finish("stale" if stale else "ok")
+        # DriversForModaliases() calls that arrived after a result cache hit
+        # started the task have no modalias map to be answered from yet, and
+        # calls that arrived after the task was cancelled have no result.
+        waiting: List[Gio.DBusMethodInvocation] = []
+
         try:
-            if error_name:
+            if cancelled:
+                waiting = list(self._pending_invocations)
+            elif error_name:
+                if not self._pending_invocations:
+                    logging.warning("background detection failed: %s", message)
                 for invocation in self._pending_invocations:
                     invocation.return_dbus_error(error_name, message)
             else:
-                self._cached_result = value
+                modalias_map = None
+                if self._modalias_map_generation == self._task_generation:
+                    modalias_map = self._modalias_map
+                index = _ResultIndex(value, modalias_map)
+                if not stale:
+                    self._cached_result = value
+                    self._index = index
                 for invocation in self._pending_invocations:
-                    invocation.return_value(value)
+                    if (
+                        invocation.get_method_name() == "DriversForModaliases"
+                        and index.modalias_map is None
+                    ):
+                        waiting.append(invocation)
+                    else:
+                        self._answer(invocation, value, index)
+            if self._streaming and not cancelled:
+                if not error_name:
+                    self._emit_devices(value)
+                self._emit_signal("DetectionFinished", None)
         finally:
-            self._pending_invocations.clear()
+            self._pending_invocations[:] = waiting
+            self._unwatch_callers()
+            if not cancelled:
+                self._streaming = False
+            # The streamed entries only matter for the task's own final
+            # emission; a later cache hit has to emit every device.
+            self._streamed = {}
             self._task_running = False
+            self._task_cancellable = None
             self._idle_manager.release()
 
+        if stale or waiting or (cancelled and self._streaming):
+            # The package state changed while detection was running, or there
+            # are callers it could not answer; start over so the cache ends up
+            # matching the current state.
+            self._start_detection(background=stale and not waiting)
+
+    def device_event(self, action: str, device_name: str, modalias: str) -> None:
+        """Update the cached result for a device that was hotplugged.
+
+        *action* is ``"add"`` or ``"remove"``, *device_name* the sysfs path of
+        the device.  Without a cached result there is nothing to update, and
+        while detection runs it is unknown whether it saw the device, so it
+        is restarted instead.  Removing a device that is neither in the
+        cached result nor being resolved changes nothing and is ignored.
+        """
+        if (
+            action == "remove"
+            and self._index is not None
+            and self._index.device(device_name) is None
+            and device_name not in self._hotplug_queue
+            and device_name not in self._hotplug_resolving
+        ):
+            return
+        if self._task_running:
+            self.refresh()
+            return
+        if self._cached_result is None:
+            return
+
+        if action == "remove":
+            self._hotplug_queue.pop(device_name, None)
+            self._hotplug_resolving.pop(device_name, None)
+            self._patch_result([], [device_name])
+        elif action == "add":
+            self._hotplug_queue[device_name] = modalias
+            if not self._hotplug_running:
+                self._start_hotplug()
+
+    def _start_hotplug(self) -> None:
+        devices = self._hotplug_resolving = self._hotplug_queue
+        self._hotplug_queue = {}
+        self._hotplug_running = True
+        modalias_map = None
+        if self._modalias_map_generation == self._generation:
+            modalias_map = self._modalias_map
+        self._idle_manager.hold()
+        task = Gio.Task.new(None, None, self._on_hotplug_done, self._generation)
+        task.run_in_thread(
+            lambda task, _obj, _data, _cancel: self._run_hotplug(
+                task, dict(devices), modalias_map
+            )
+        )
+
+    def _run_hotplug(
+        self,
+        task: Gio.Task,
+        devices: Dict[str, str],
+        modalias_map: Optional[_ModaliasMap],
+    ) -> None:
+        try:
+            if self._out_of_process:
+                self._stats.counters["worker_spawns"] += 1
+                resolved = [
+                    (
+                        name,
+                        GLib.Variant.new_from_bytes(
+                            GLib.VariantType.new("a{sv}"), GLib.Bytes.new(data), False
+                        ),
+                    )
+                    for name, data in _run_worker(["--devices"], request=devices)[
+                        "devices"
+                    ]
+                ]
+            else:
+                cache = _open_apt_cache()
+                if modalias_map is None:
+                    modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+                resolved = _resolve_devices(cache, modalias_map, devices)
+            task.return_value(
+                GLib.Variant.new_array(
+                    GLib.VariantType.new("a{sv}"), [device for _, device in resolved]
+                )
+            )
+        except Exception as ex:
+            logging.exception("cannot resolve hotplugged devices")
+            task.return_error(GLib.Error(str(ex), _ERROR_FAILED, 0))
+
+    def _on_hotplug_done(
+        self, _source: None, result: Gio.Task, generation: int
+    ) -> None:
+        resolving = self._hotplug_resolving
+        self._hotplug_resolving = {}
+        self._hotplug_running = False
+        self._idle_manager.release()
+
+        # A result invalidated meanwhile is being replaced by a detection that
+        # sees the devices anyway.
+        if generation != self._generation or self._cached_result is None:
+            self._hotplug_queue = {}
+            return
+        try:
+            devices = result.propagate_value().value
+        except GLib.Error:
+            # fall back to a full detection, which finds the devices as well
+            self._hotplug_queue = {}
+            self.refresh()
+            return
+
+        # devices removed while they were being resolved stay removed
+        added = []
+        for i in range(devices.n_children()):
+            device = devices.get_child_value(i)
+            if device.lookup_value("sys_path", None).get_string() in resolving:
+                added.append(device)
+        self._patch_result(added, [])
+        if self._hotplug_queue:
+            self._start_hotplug()
+
+    def _patch_result(self, added: List[GLib.Variant], removed: List[str]) -> None:
+        """Add the ``a{sv}`` dicts *added* to the cached result, drop the
+        devices *removed* from it, and announce the changes."""
+        assert self._cached_result is not None and self._index is not None
+        devices: Dict[str, GLib.Variant] = {}
+        old_devices = self._cached_result.get_child_value(0)
+        for i in range(old_devices.n_children()):
+            device = old_devices.get_child_value(i)
+            devices[device.lookup_value("sys_path", None).get_string()] = device
+
+        gone = [name for name in removed if devices.pop(name, None) is not None]
+        new = []
+        for device in added:
+            name = device.lookup_value("sys_path", None).get_string()
+            devices[name] = device
+            new.append(name)
+        if not gone and not new:
+            return
+
+        self._cached_result = GLib.Variant.new_tuple(
+            GLib.Variant.new_array(
+                GLib.VariantType.new("a{sv}"),
+                [devices[name] for name in sorted(devices)],
+            )
+        )
+        self._index = _ResultIndex(self._cached_result, self._index.modalias_map)
+        self._plans.clear()
+        self._emit_signal("DevicesChanged", GLib.Variant("(asas)", (new, gone)))
+
     def invalidate_cache(self) -> None:
         """Drop the cached result so the next call re-runs detection."""
         self._cached_result = None
+        self._index = None
+        self._plans.clear()
+        self._generation += 1
+
+    def refresh(self) -> None:
+        """Drop the cached result and re-run detection in the background.
+
+        If detection is already running it is marked stale and restarted once
+        it finishes, so at most one detection runs at a time.
+        """
+        self.invalidate_cache()
+        if not self._task_running:
+            self._start_detection(background=True)
+        else:
+            # refresh() asks for a result regardless of any callers
+            self._task_background = True
 
     def unexport(self, connection: Gio.DBusConnection) -> None:
         """Unregister the D-Bus object from *connection*."""
@@ -346,6 +1921,9 @@ class DriversService:
             return
         connection.unregister_object(self._object_registration_id)
         self._object_registration_id = None
+        if self._debug_registration_id is not None:
+            connection.unregister_object(self._debug_registration_id)
+            self._debug_registration_id = None
 
 
 class _ServiceRunner:
@@ -353,7 +1931,9 @@ class _ServiceRunner:
 
     Args:
         loop: The GLib main loop to quit once the bus name is released.
-        timeout_seconds: Seconds of inactivity before initiating shutdown.
+        timeout_seconds: Seconds of inactivity before initiating shutdown,
+            when the call history does not suggest waiting longer (see
+            :class:`_IdlePolicy`).
     """
 
     def __init__(
@@ -362,13 +1942,18 @@ class _ServiceRunner:
         timeout_seconds: int = DEFAULT_IDLE_TIMEOUT_SECONDS,
     ) -> None:
         self._loop = loop
+        self._idle_policy = _IdlePolicy(default=timeout_seconds)
+        self._idle_policy.load()
         self._idle_mgr = _IdleManager(
             on_timeout=self._begin_shutdown,
             timeout_seconds=timeout_seconds,
+            policy=self._idle_policy,
         )
         self._service: Optional[DriversService] = None
         self._connection: Optional[Gio.DBusConnection] = None
         self._owner_id: int = 0
+        self._watcher: Optional[_StateWatcher] = None
+        self._hotplug: Optional[_HotplugMonitor] = None
 
     def run(self) -> None:
         """Acquire the bus name, install signal handling, and run the main loop."""
@@ -391,13 +1976,24 @@ class _ServiceRunner:
         try:
             self._loop.run()
         finally:
+            if self._watcher is not None:
+                self._watcher.stop()
+            if self._hotplug is not None:
+                self._hotplug.stop()
             if self._service is not None and self._connection is not None:
                 self._service.unexport(self._connection)
+            self._idle_policy.save()
 
     def on_bus_acquired(self, connection: Gio.DBusConnection, _name: str) -> None:
-        self._service = DriversService(self._idle_mgr)
+        self._service = DriversService(
+            self._idle_mgr, _ResultCache(), out_of_process=True
+        )
         self._service.export(connection)
         self._connection = connection
+        self._watcher = _StateWatcher(self._service.refresh)
+        self._watcher.start()
+        self._hotplug = _HotplugMonitor(self._service.device_event, _HOTPLUG_SUBSYSTEMS)
+        self._hotplug.start()
 
     def on_name_acquired(self, _connection: Gio.DBusConnection, _name: str) -> None:
         self._idle_mgr.start()
@@ -427,6 +2023,10 @@ class _ServiceRunner:
         pending ReleaseName traffic a chance to drain first.
         """
         self._idle_mgr.cancel()
+        if self._watcher is not None:
+            self._watcher.stop()
+        if self._hotplug is not None:
+            self._hotplug.stop()
         owner_id = self._owner_id
         self._owner_id = 0
         if owner_id != 0:
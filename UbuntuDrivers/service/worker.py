@@ -0,0 +1,107 @@
+"""Detection worker process for the ubuntu-drivers D-Bus service.
+
+Run as ``python3 -m UbuntuDrivers.service.worker FD [options]``, it performs
+one detection and writes its progress and result to the inherited file
+descriptor FD as a sequence of pickled tuples:
+
+    ("phase", name, started)        a detection phase boundary
+    ("device", data)                serialized a{sv} of a resolved device
+    ("modalias-map", map)           the apt modalias map
+    ("result", data)                serialized (aa{sv}) drivers() value
+    ("plan", packages)              the PlanInstall() package list
+    ("devices", devices)            (sys_path, data) of resolved devices
+    ("error", cache_failure, msg)   detection failed
+
+Options:
+    --stream        report every device as soon as it is resolved
+    --modalias-map  also send the apt modalias map
+    --map-only      only build and send the apt modalias map
+    --plan          instead of detecting, read a pickled (packages,
+                    include_dkms, driver) tuple from stdin and send the
+                    install plan for it
+    --devices       instead of detecting, read a pickled sysfs path →
+                    modalias dict from stdin and resolve only those devices
+
+The apt cache, and whatever the detection plugins allocate, thereby lives
+and dies with this process instead of the long-running service.
+"""
+
+import os
+import pickle
+import sys
+from typing import Any, BinaryIO, List
+
+import UbuntuDrivers.detect
+from UbuntuDrivers.service import drivers_service
+
+from gi.repository import GLib
+
+
+def _send(pipe: BinaryIO, *message: Any) -> None:
+    pickle.dump(message, pipe, protocol=pickle.HIGHEST_PROTOCOL)
+    pipe.flush()
+
+
+def _run(pipe: BinaryIO, options: List[str]) -> None:
+    UbuntuDrivers.detect.phase_hooks.append(
+        lambda name, started: _send(pipe, "phase", name, started)
+    )
+
+    if "--plan" in options:
+        packages, include_dkms, driver = pickle.load(sys.stdin.buffer)
+        cache = drivers_service._open_apt_cache()
+        _send(
+            pipe,
+            "plan",
+            drivers_service._plan_install(cache, packages, include_dkms, driver),
+        )
+        return
+
+    if "--devices" in options:
+        devices = pickle.load(sys.stdin.buffer)
+        cache = drivers_service._open_apt_cache()
+        modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+        resolved = drivers_service._resolve_devices(cache, modalias_map, devices)
+        _send(
+            pipe,
+            "devices",
+            [
+                (name, device.get_data_as_bytes().get_data())
+                for name, device in resolved
+            ],
+        )
+        return
+
+    if "--map-only" in options:
+        cache = drivers_service._open_apt_cache()
+        modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+        _send(pipe, "modalias-map", modalias_map)
+        return
+
+    def device_resolved(device: GLib.Variant) -> None:
+        _send(pipe, "device", device.get_data_as_bytes().get_data())
+
+    value, modalias_map = drivers_service._detect_drivers(
+        device_resolved if "--stream" in options else None
+    )
+    if "--modalias-map" in options:
+        _send(pipe, "modalias-map", modalias_map)
+    _send(pipe, "result", value.get_data_as_bytes().get_data())
+
+
+def main(argv: List[str]) -> int:
+    """Run one detection, writing to the file descriptor in *argv[1]*."""
+    with os.fdopen(int(argv[1]), "wb") as pipe:
+        try:
+            _run(pipe, argv[2:])
+        except RuntimeError as ex:
+            _send(pipe, "error", True, str(ex))
+            return 1
+        except Exception as ex:
+            _send(pipe, "error", False, f"{type(ex).__name__}: {ex}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
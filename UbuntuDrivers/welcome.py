@@ -0,0 +1,104 @@
+"""Data for the ubuntu-drivers welcome page.
+
+Plain "ubuntu-drivers" only needs to know which driver packages are installed,
+so this reads the dpkg status file directly instead of opening the apt cache,
+and does not import apt_pkg or UbuntuDrivers.detect unless NVIDIA drivers are
+installed and their kernel module has to be checked.
+"""
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import fnmatch
+import os
+from typing import Any, Dict, Iterator, List
+
+# dpkg's database of installed packages; overridable for testing
+dpkg_status = os.environ.get("UBUNTU_DRIVERS_DPKG_STATUS", "/var/lib/dpkg/status")
+
+# dpkg states in which a package has no installed version, like a package
+# without current_ver in apt
+_NOT_INSTALLED_STATES = ("not-installed", "config-files")
+
+
+def installed_packages(status_path: str = dpkg_status) -> Iterator[str]:
+    """Yield the names of the packages installed according to *status_path*.
+
+    The file is read one line at a time and only the Package and Status
+    fields of each stanza are looked at.  A package installed for several
+    architectures is yielded once for each.
+
+    Raises:
+        OSError: if the file cannot be read.
+    """
+    name = None
+    installed = False
+    with open(status_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("Package:"):
+                name = line[8:].strip()
+            elif line.startswith("Status:"):
+                words = line[7:].split()
+                installed = len(words) == 3 and words[2] not in _NOT_INSTALLED_STATES
+            elif not line.strip():
+                if name and installed:
+                    yield name
+                name = None
+                installed = False
+    if name and installed:
+        yield name
+
+
+def gather_welcome_page_data(status_path: str = dpkg_status) -> Dict[str, Any]:
+    """Gather data for the welcome page.
+
+    Returns:
+        dict: A dictionary containing:
+            - cache_error: Error message if the package database couldn't be
+              read, or None
+            - nvidia_drivers: List of installed NVIDIA driver packages
+            - oem_packages: List of installed OEM packages
+            - nvidia_status: NVIDIA module status dict, or None if not applicable
+            - nvidia_status_error: Error message if status check failed, or None
+    """
+    data: Dict[str, Any] = {
+        "cache_error": None,
+        "nvidia_drivers": [],
+        "oem_packages": [],
+        "nvidia_status": None,
+        "nvidia_status_error": None,
+    }
+
+    nvidia_drivers = set()
+    nvidia_modules = set()
+    oem_packages = set()
+    try:
+        for name in installed_packages(status_path):
+            if fnmatch.fnmatch(name, "nvidia-driver-*"):
+                nvidia_drivers.add(name)
+            elif fnmatch.fnmatch(name, "linux-modules-nvidia-*"):
+                nvidia_modules.add(name)
+            elif fnmatch.fnmatch(name, "oem-*-meta"):
+                oem_packages.add(name)
+    except OSError as ex:
+        data["cache_error"] = str(ex)
+        return data
+
+    nvidia: List[str] = sorted(nvidia_drivers or nvidia_modules)
+    data["nvidia_drivers"] = nvidia
+    data["oem_packages"] = sorted(oem_packages)
+
+    # Check NVIDIA module status if NVIDIA drivers are installed
+    if nvidia:
+        try:
+            import UbuntuDrivers.detect
+
+            data["nvidia_status"] = UbuntuDrivers.detect.check_nvidia_module_status()
+        except Exception as e:
+            data["nvidia_status_error"] = str(e)
+
+    return data
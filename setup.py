@@ -49,6 +49,7 @@ setup(
             ["systemd/com.ubuntu.Drivers.service"],
         ),
         ("/usr/share/dbus-1/system.d/", ["systemd/com.ubuntu.Drivers.conf"]),
+        ("/etc/apt/apt.conf.d/", ["apt/20ubuntu-drivers-prewarm"]),
     ]
     + extra_data,
     scripts=["quirks-handler", "ubuntu-drivers"],
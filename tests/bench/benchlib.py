@@ -0,0 +1,83 @@
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Timing and reporting shared by the benchmarks in this directory."""
+
+import json
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+def measure(
+    function: Callable[[], Any],
+    runs: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Dict[str, Any]:
+    """Call *function* *runs* times and summarize its wall and CPU time.
+
+    *setup* is called before every run, outside of the timed part.
+    """
+    wall = []
+    cpu = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        function()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+
+    def summary(times: List[float]) -> Dict[str, float]:
+        return {
+            "min": round(min(times), 6),
+            "median": round(statistics.median(times), 6),
+            "max": round(max(times), 6),
+        }
+
+    return {"runs": runs, "wall_s": summary(wall), "cpu_s": summary(cpu)}
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Print the change of every median wall time from *old* to *new*."""
+    if (old.get("version"), old.get("parameters")) != (
+        new["version"],
+        new["parameters"],
+    ):
+        print(
+            "warning: the compared results are from different parameters",
+            file=sys.stderr,
+        )
+    for name, result in new["results"].items():
+        if name not in old.get("results", {}):
+            continue
+        before = old["results"][name]["wall_s"]["median"]
+        after = result["wall_s"]["median"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(
+            "%-24s %10.4f s → %10.4f s  %+7.1f%%" % (name, before, after, change),
+            file=sys.stderr,
+        )
+
+
+def report(
+    result: Dict[str, Any], output: Optional[str], compare_path: Optional[str]
+) -> None:
+    """Write *result* as JSON to *output*, or stdout, and compare it with the
+    results in *compare_path*, if given."""
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(json.load(f), result)
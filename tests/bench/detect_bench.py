@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Benchmark driver detection on synthetic hardware and package archives.
+
+This builds a package archive with tests/testarchive.py (so it needs dpkg and
+apt-ftparchive) holding BRANCHES nvidia-driver-* packages with Modaliases
+headers, and a fake sysfs tree with DEVICES devices, and then times
+system_modaliases(), apt_cache_modalias_map(), system_driver_packages(),
+system_device_drivers() and auto_install_filter() on them.
+
+Run it from the source tree:
+
+    PYTHONPATH=. tests/bench/detect_bench.py [--branches N] [--devices N]
+        [--runs N] [--output FILE] [--compare FILE]
+
+The results are written as JSON; --compare prints to stderr how they differ
+from an earlier run with the same parameters. The archive and sysfs tree only
+depend on the parameters and --seed, so results of different versions of
+ubuntu-drivers-common are comparable.
+"""
+
+import argparse
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict
+
+TESTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import apt_pkg  # noqa: E402
+
+import benchlib  # noqa: E402
+import testarchive  # noqa: E402
+import UbuntuDrivers.detect  # noqa: E402
+
+# bumped when the archive, the sysfs tree or the output change incompatibly
+BENCH_VERSION = 1
+
+NVIDIA_VENDOR = 0x10DE
+# PCI IDs which each driver branch supports; consecutive branches overlap,
+# like real ones do
+IDS_PER_BRANCH = 150
+IDS_STEP = 40
+BRANCH_FLAVOURS = ["", "-server", "-open", "-server-open"]
+
+# vendors of the other, driverless devices
+OTHER_VENDORS = [0x8086, 0x1022, 0x14E4, 0x10EC, 0x1B21, 0x144D]
+
+
+def nvidia_device_id(n: int) -> int:
+    """Return the n-th synthetic NVIDIA PCI device ID."""
+    return 0x1000 + n
+
+
+def gen_archive(branches: int) -> testarchive.Archive:
+    """Build an archive with *branches* nvidia-driver-* packages."""
+    archive = testarchive.Archive()
+    archive.create_deb(
+        "xserver-xorg-core",
+        version="99:1",
+        dependencies={"Provides": "xorg-video-abi-25"},
+        update_index=False,
+    )
+    for branch in range(branches):
+        first = (branch // len(BRANCH_FLAVOURS)) * IDS_STEP
+        patterns = [
+            "pci:v%08Xd%08Xsv*sd*bc03sc*i*" % (NVIDIA_VENDOR, nvidia_device_id(i))
+            for i in range(first, first + IDS_PER_BRANCH)
+        ]
+        name = "nvidia-driver-%i%s" % (
+            100 + branch // len(BRANCH_FLAVOURS),
+            BRANCH_FLAVOURS[branch % len(BRANCH_FLAVOURS)],
+        )
+        archive.create_deb(
+            name,
+            dependencies={"Depends": "xorg-video-abi-25"},
+            extra_tags={
+                "Modaliases": "nvidia(%s)" % ", ".join(patterns),
+                "Support": "PB" if branch % 3 == 0 else "LTSB",
+            },
+            component="restricted",
+            update_index=False,
+        )
+    # a few free drivers for other hardware
+    for vendor in OTHER_VENDORS:
+        archive.create_deb(
+            "firmware-%04x" % vendor,
+            extra_tags={"Modaliases": "fw(pci:v%08Xd00000F*sv*sd*bc*sc*i*)" % vendor},
+            update_index=False,
+        )
+    archive.update_index()
+    return archive
+
+
+def gen_sysfs(devices: int, branches: int, seed: int) -> str:
+    """Create a sysfs tree with *devices* devices and return its path.
+
+    One in ten devices is an NVIDIA GPU supported by one of the generated
+    driver branches; the others are PCI and USB devices without drivers.
+    """
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp(prefix="bench-sys-")
+    max_id = (branches // len(BRANCH_FLAVOURS)) * IDS_STEP + IDS_PER_BRANCH
+    for i in range(devices):
+        if i % 10 == 0:
+            path = "pci0000:00/0000:%02x:%02x.0" % (i // 32 % 256, i % 32)
+            modalias = "pci:v%08Xd%08Xsv%08Xsd%08Xbc03sc00i00" % (
+                NVIDIA_VENDOR,
+                nvidia_device_id(rng.randrange(max_id)),
+                rng.randrange(0x10000),
+                rng.randrange(0x10000),
+            )
+        elif i % 3 == 0:
+            path = "pci0000:00/0000:00:14.0/usb1/1-%i" % i
+            modalias = "usb:v%04Xp%04Xd0100dc00dsc00dp00ic%02Xisc00ip00in00" % (
+                rng.randrange(0x10000),
+                rng.randrange(0x10000),
+                rng.randrange(0x100),
+            )
+        else:
+            path = "pci0000:00/0000:%02x:%02x.%i" % (i // 32 % 256, i % 32, i % 8)
+            modalias = "pci:v%08Xd%08Xsv%08Xsd%08Xbc%02Xsc00i00" % (
+                rng.choice(OTHER_VENDORS),
+                rng.randrange(0x10000),
+                rng.randrange(0x10000),
+                rng.randrange(0x10000),
+                rng.randrange(0x10),
+            )
+        device_dir = os.path.join(root, "devices", path)
+        os.makedirs(device_dir, exist_ok=True)
+        with open(os.path.join(device_dir, "modalias"), "w") as f:
+            f.write(modalias + "\n")
+    return root
+
+
+class AptRoot:
+    """An apt root directory whose only source is a testarchive.Archive."""
+
+    def __init__(self, archive: testarchive.Archive) -> None:
+        self.path = tempfile.mkdtemp(prefix="bench-apt-")
+        for subdir in [
+            "var/lib/dpkg",
+            "var/cache/apt/archives/partial",
+            "var/lib/apt/lists/partial",
+            "etc/apt/apt.conf.d",
+            "etc/apt/preferences.d",
+        ]:
+            os.makedirs(os.path.join(self.path, subdir))
+        open(os.path.join(self.path, "var/lib/dpkg/status"), "w").close()
+        with open(os.path.join(self.path, "etc/apt/sources.list"), "w") as f:
+            f.write(
+                "deb [trusted=yes] file://%s devel main restricted\n" % archive.path
+            )
+        subprocess.run(
+            ["apt-get", "update", "-o", "Dir=%s" % self.path],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+
+    def open_cache(self) -> apt_pkg.Cache:
+        apt_pkg.init_config()
+        apt_pkg.config["Dir"] = self.path
+        apt_pkg.config["Dir::State::status"] = os.path.join(
+            self.path, "var/lib/dpkg/status"
+        )
+        apt_pkg.init_system()
+        return apt_pkg.Cache(None)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def run(branches: int, devices: int, runs: int, seed: int) -> Dict[str, Any]:
+    """Build the synthetic system and benchmark detection on it."""
+    archive = gen_archive(branches)
+    apt_root = AptRoot(archive)
+    sys_path = gen_sysfs(devices, branches, seed)
+    try:
+        cache = apt_root.open_cache()
+        modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+        packages = UbuntuDrivers.detect.system_driver_packages(
+            cache, sys_path, modalias_map=modalias_map
+        )
+
+        benchmarks = {
+            "system_modaliases": lambda: UbuntuDrivers.detect.system_modaliases(
+                sys_path
+            ),
+            "apt_cache_modalias_map": lambda: UbuntuDrivers.detect.apt_cache_modalias_map(
+                cache
+            ),
+            "system_driver_packages": lambda: UbuntuDrivers.detect.system_driver_packages(
+                cache, sys_path
+            ),
+            "system_device_drivers": lambda: UbuntuDrivers.detect.system_device_drivers(
+                cache, sys_path
+            ),
+            "auto_install_filter": lambda: UbuntuDrivers.detect.auto_install_filter(
+                cache, False, packages
+            ),
+        }
+        # do not let one run answer the next from detect's memoization
+        results = {
+            name: benchlib.measure(f, runs, UbuntuDrivers.detect.lookup_cache.clear)
+            for name, f in benchmarks.items()
+        }
+        results["system_driver_packages"]["packages"] = len(packages)
+    finally:
+        apt_root.remove()
+        shutil.rmtree(sys_path, ignore_errors=True)
+
+    return {
+        "version": BENCH_VERSION,
+        "parameters": {"branches": branches, "devices": devices, "seed": seed},
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--branches", type=int, default=200, help="driver packages (default: 200)"
+    )
+    parser.add_argument(
+        "--devices", type=int, default=300, help="sysfs devices (default: 300)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="runs per function (default: 5)"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="sysfs tree seed")
+    parser.add_argument(
+        "--output", metavar="FILE", help="write the results there instead of stdout"
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="compare with the results in FILE"
+    )
+    args = parser.parse_args()
+
+    result = run(args.branches, args.devices, args.runs, args.seed)
+
+    benchlib.report(result, args.output, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Benchmark reading quirk files on a generated corpus.
+
+This writes QUIRKS quirks for random handlers and DMI data, split over FILES
+quirk files, and then times parsing all of them with
+Quirks.quirkreader.ReadQuirk, building a Quirks.quirkstore.QuirkStore from
+them, looking up one handler's quirks in an up to date store, and matching
+them against one system's DMI data with Quirks.quirkindex.QuirkIndex, as
+quirks-handler does.
+
+Run it from the source tree:
+
+    PYTHONPATH=. tests/bench/quirk_bench.py [--quirks N] [--files N]
+        [--runs N] [--output FILE] [--compare FILE]
+
+The results are written as JSON; --compare prints to stderr how they differ
+from an earlier run with the same parameters. The corpus only depends on the
+parameters and --seed, so results of different versions of
+ubuntu-drivers-common are comparable.
+"""
+
+import argparse
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import benchlib  # noqa: E402
+import Quirks.quirkindex  # noqa: E402
+import Quirks.quirkreader  # noqa: E402
+import Quirks.quirkstore  # noqa: E402
+
+# bumped when the corpus or the output change incompatibly
+BENCH_VERSION = 1
+
+HANDLERS = [
+    "nvidia-driver-%i%s" % (b, f) for b in range(390, 580, 5) for f in ["", "-open"]
+]
+VENDORS = [
+    "Dell Inc.",
+    "LENOVO",
+    "HP",
+    "ASUSTeK COMPUTER INC.",
+    "Acer",
+    "Micro-Star International Co., Ltd.",
+]
+
+QUIRK = """# generated quirk {n}
+Section "Quirk"
+    Identifier "Quirk {n} for {product}"
+    Handler "{handlers}"
+    Match "sys_vendor" "{vendor}"
+    Match "product_name" "{product}|{product} rev{n}"
+    Match "bios_version" "{bios}"
+    XorgSnippet
+        Section "Device"
+            Identifier "My Card"
+            Driver "nvidia"
+            Option "NoLogo" "True"
+        EndSection
+
+        Section "Screen"
+            Identifier "My Screen"
+            Option "RegistryDwords" "EnableBrightnessControl={n}"
+        EndSection
+    EndXorgSnippet
+EndSection
+
+"""
+
+
+def gen_corpus(quirks: int, files: int, seed: int) -> str:
+    """Write *quirks* quirks into *files* files and return their directory."""
+    rng = random.Random(seed)
+    path = tempfile.mkdtemp(prefix="bench-quirks-")
+    for i in range(files):
+        with open(os.path.join(path, "quirks-%04i" % i), "w") as f:
+            for n in range(i, quirks, files):
+                f.write(
+                    QUIRK.format(
+                        n=n,
+                        handlers="|".join(rng.sample(HANDLERS, rng.randint(1, 4))),
+                        vendor=rng.choice(VENDORS),
+                        product="Model %04X" % rng.randrange(0x10000),
+                        bios="%i.%i.%i"
+                        % (rng.randint(1, 3), rng.randrange(30), rng.randrange(10)),
+                    )
+                )
+    return path
+
+
+def run(quirks: int, files: int, runs: int, seed: int) -> Dict[str, Any]:
+    """Generate the corpus and benchmark reading it."""
+    corpus = gen_corpus(quirks, files, seed)
+    cache_dir = tempfile.mkdtemp(prefix="bench-quirks-cache-")
+    cache = os.path.join(cache_dir, "quirks.json")
+    names = sorted(os.path.join(corpus, name) for name in os.listdir(corpus))
+
+    def read_all() -> int:
+        return sum(
+            len(Quirks.quirkreader.ReadQuirk(name).get_quirks()) for name in names
+        )
+
+    def store_rebuild() -> None:
+        if os.path.exists(cache):
+            os.unlink(cache)
+        Quirks.quirkstore.QuirkStore(corpus, cache)
+
+    def store_lookup() -> None:
+        Quirks.quirkstore.QuirkStore(corpus, cache).get_quirks(HANDLERS[0])
+
+    # a system for which some quirks of the corpus have been written
+    system_info = {
+        "sys_vendor": VENDORS[0],
+        "product_name": "Model %04X" % random.Random(seed).randrange(0x10000),
+    }
+
+    def match() -> None:
+        quirks = Quirks.quirkstore.QuirkStore(corpus, cache).get_quirks(HANDLERS[0])
+        index = Quirks.quirkindex.QuirkIndex(quirks, HANDLERS[0])
+        for quirk in index.candidates(HANDLERS[0], system_info):
+            all(
+                Quirks.quirkindex.tag_matches(values, system_info.get(tag))
+                for tag, values in quirk.match_tags.items()
+            )
+
+    try:
+        parsed = read_all()
+        results = {
+            "read_quirks": benchlib.measure(read_all, runs),
+            "quirk_store_rebuild": benchlib.measure(store_rebuild, runs),
+            "quirk_store_lookup": benchlib.measure(store_lookup, runs),
+            "quirk_match": benchlib.measure(match, runs),
+        }
+        results["read_quirks"]["quirks"] = parsed
+    finally:
+        shutil.rmtree(corpus, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        "version": BENCH_VERSION,
+        "parameters": {"quirks": quirks, "files": files, "seed": seed},
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--quirks", type=int, default=10000, help="quirks (default: 10000)"
+    )
+    parser.add_argument(
+        "--files", type=int, default=100, help="quirk files (default: 100)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="runs per function (default: 5)"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="corpus seed")
+    parser.add_argument(
+        "--output", metavar="FILE", help="write the results there instead of stdout"
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="compare with the results in FILE"
+    )
+    args = parser.parse_args()
+
+    result = run(args.quirks, args.files, args.runs, args.seed)
+
+    benchlib.report(result, args.output, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,14 +18,16 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from Quirks import quirkreader, quirkapplier
+from Quirks import quirkreader, quirkapplier, quirkstore
+from xkit import xorgparser
 
-# from xkit import xorgparser
 # from xkit.xorgparser import *
 import sys
 import unittest
 import os
 import logging
+import shutil
+import tempfile
 import settings
 
 
@@ -330,6 +332,340 @@ EndSection
         self.assertTrue(quirk_matches)
         self.assertTrue(matches_number == 1)
 
+    def test_read_quirks_stream(self):
+        """Several quirks in one file, with comments and bare values"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        with open(tempFile, "w") as confFile:
+            confFile.write(
+                """
+# first quirk
+Section "Quirk"
+    Identifier "Test Latitude E6530"
+    Handler "nvidia-current|nvidia-current-updates" # both
+    Match "sys_vendor" "Dell Inc."
+    Match "product_name" "Latitude E6530|Latitude #2"
+    XorgSnippet
+        # not part of the snippet
+        Section "Device"
+            Identifier "My Card"
+        EndSection
+    EndXorgSnippet
+EndSection
+
+section "quirk"
+    Identifier ThinkPad T420s
+    handler "nvidia-current"
+    match sys_vendor LENOVO
+endsection
+
+Section "Quirk"
+    Handler "nvidia-current"
+EndSection
+"""
+            )
+
+        quirks = get_quirks_from_file(tempFile)
+        self.assertEqual(
+            [x.id for x in quirks], ["Test Latitude E6530", "ThinkPad T420s"]
+        )
+        self.assertEqual(
+            quirks[0].handler, ["nvidia-current", "nvidia-current-updates"]
+        )
+        self.assertEqual(
+            quirks[0].match_tags["product_name"], ["Latitude E6530", "Latitude #2"]
+        )
+        self.assertEqual(
+            quirks[0].x_snippet,
+            """        Section "Device"
+            Identifier "My Card"
+        EndSection
+""",
+        )
+        self.assertEqual(quirks[1].handler, ["nvidia-current"])
+        self.assertEqual(quirks[1].match_tags["sys_vendor"], ["LENOVO"])
+        self.assertEqual(quirks[1].x_snippet, "")
+
+    def test_read_quirk_section_comment(self):
+        """A Quirk section is found with trailing comments and values"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        with open(tempFile, "w") as confFile:
+            confFile.write(
+                """
+Section "Quirk"  # a comment
+    Identifier "quirk 0"
+EndSection
+
+Section Quirk "extra" # another one
+    Identifier "quirk 1"
+EndSection
+
+Section "Device" # Quirk
+    Identifier "not a quirk"
+EndSection
+"""
+            )
+
+        quirks = get_quirks_from_file(tempFile)
+        self.assertEqual([x.id for x in quirks], ["quirk 0", "quirk 1"])
+
+    def test_quirk_index(self):
+        """Only the quirks for the handler, vendor and product are applied"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        with open(tempFile, "w") as confFile:
+            for n, (handler, vendor, product) in enumerate(
+                [
+                    ("nvidia-current", "Dell Inc.", "Latitude E6530"),
+                    ("nvidia-current", "Dell Inc.", "Latitude E6530|Latitude E6535"),
+                    ("nvidia-current", "Dell Inc.", "Latitude E6540|Latitude E6545"),
+                    ("nvidia-current", "LENOVO", "Latitude E6530"),
+                    ("nvidia-current", "Dell Inc.", ""),
+                    ("nvidia-current", "", ""),
+                    ("fglrx", "Dell Inc.", "Latitude E6530"),
+                ]
+            ):
+                confFile.write('Section "Quirk"\n')
+                confFile.write('    Identifier "quirk %i"\n' % n)
+                confFile.write('    Handler "%s"\n' % handler)
+                if vendor:
+                    confFile.write('    Match "sys_vendor" "%s"\n' % vendor)
+                if product:
+                    confFile.write('    Match "product_name" "%s"\n' % product)
+                if n == 5:
+                    confFile.write('    Match "board_name" "P6T SE|P6T"\n')
+                confFile.write("EndSection\n")
+
+        a = quirkapplier.QuirkChecker("nvidia-current", path=destination)
+        a._system_info = {
+            "sys_vendor": "Dell Inc.",
+            "product_name": "Latitude E6530",
+            "board_name": "P7P55D",
+        }
+        a._xorg_conf_d_path = os.path.join(destination, "xorg.conf.d")
+        applied = []
+        a._apply_quirk = applied.append
+        a.enable_quirks()
+        self.assertEqual([x.id for x in applied], ["quirk 0", "quirk 1", "quirk 4"])
+
+        # a system without DMI information matches everything, and the
+        # quirks are not indexed again
+        a._system_info = {}
+        del applied[:]
+        index = quirkapplier.QuirkIndex
+
+        def no_indexing(quirks, handler=None):
+            raise AssertionError("quirks indexed again")
+
+        quirkapplier.QuirkIndex = no_indexing
+        try:
+            a.enable_quirks()
+        finally:
+            quirkapplier.QuirkIndex = index
+        self.assertEqual(
+            [x.id for x in applied],
+            ["quirk 0", "quirk 1", "quirk 2", "quirk 3", "quirk 4", "quirk 5"],
+        )
+
+    def test_apply_quirk(self):
+        """Snippets are parsed in memory, once, and written to xorg.conf.d"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        with open(tempFile, "w") as confFile:
+            confFile.write(
+                """
+Section "Quirk"
+    Identifier "Test Latitude E6530"
+    Handler "nvidia-current"
+    Match "sys_vendor" "Dell Inc."
+    XorgSnippet
+        Section "Device"
+            Identifier "My Card"
+            Driver "nvidia"
+        EndSection
+    EndXorgSnippet
+EndSection
+"""
+            )
+
+        work_dir = tempfile.mkdtemp()
+        cache = os.path.join(work_dir, "quirks.json")
+        parser = xorgparser.Parser
+        try:
+            a = quirkapplier.QuirkChecker(
+                "nvidia-current", path=destination, cache_path=cache
+            )
+            a._system_info = {"sys_vendor": "Dell Inc."}
+            a._xorg_conf_d_path = work_dir
+            quirk = [x for x in a._quirks if x.id == "Test Latitude E6530"][0]
+            self.assertTrue(quirk.x_config)
+
+            # the cached snippet is written without parsing it again
+            def no_parsing(source):
+                raise AssertionError("snippet parsed again")
+
+            xorgparser.Parser = no_parsing
+            b = quirkapplier.QuirkChecker(
+                "nvidia-current", path=destination, cache_path=cache
+            )
+            b._system_info = a._system_info
+            b._xorg_conf_d_path = work_dir
+            b.enable_quirks()
+            conf = os.path.join(work_dir, "10-nvidia-current-test-latitude-e6530.conf")
+            with open(conf) as f:
+                self.assertTrue(f.read().endswith(quirk.x_config))
+
+            b.disable_quirks()
+            self.assertFalse(os.path.exists(conf))
+        finally:
+            xorgparser.Parser = parser
+            shutil.rmtree(work_dir)
+
+    def test_apply_quirks_changes(self):
+        """Only changed files are written, and only stale ones removed"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        quirk = """
+Section "Quirk"
+    Identifier "Test %s"
+    Handler "nvidia-current"
+    Match "product_name" "%s"
+    XorgSnippet
+        Section "Device"
+            Identifier "My Card"
+            Option "NoLogo" "%s"
+        EndSection
+    EndXorgSnippet
+EndSection
+"""
+        with open(tempFile, "w") as confFile:
+            confFile.write(quirk % ("E6530", "Latitude E6530", "True"))
+            confFile.write(quirk % ("E6540", "Latitude E6540", "True"))
+
+        work_dir = tempfile.mkdtemp()
+        e6530 = os.path.join(work_dir, "10-nvidia-current-test-e6530.conf")
+        e6540 = os.path.join(work_dir, "10-nvidia-current-test-e6540.conf")
+        # not written by quirks-handler, or for another handler
+        other = os.path.join(work_dir, "10-nvidia-current-mine.conf")
+        updates = os.path.join(work_dir, "10-nvidia-current-updates-test.conf")
+        with open(other, "w") as f:
+            f.write('Section "Device"\nEndSection\n')
+        with open(updates, "w") as f:
+            f.write(
+                "# Written by quirks-handler for nvidia-current-updates, do not edit\n"
+            )
+
+        def checker(product):
+            a = quirkapplier.QuirkChecker("nvidia-current", path=destination)
+            a._system_info = {"product_name": product}
+            a._xorg_conf_d_path = work_dir
+            return a
+
+        try:
+            changes = checker("Latitude E6530").enable_quirks()
+            self.assertEqual(changes["written"], [e6530])
+            self.assertEqual(changes["removed"], [])
+            mtime = os.stat(e6530).st_mtime_ns
+
+            changes = checker("Latitude E6530").enable_quirks()
+            self.assertEqual(changes["written"], [])
+            self.assertEqual(changes["unchanged"], [e6530])
+            self.assertEqual(os.stat(e6530).st_mtime_ns, mtime)
+
+            with open(tempFile, "w") as confFile:
+                confFile.write(quirk % ("E6530", "Latitude E6530", "False"))
+                confFile.write(quirk % ("E6540", "Latitude E6540", "True"))
+            changes = checker("Latitude E6530").enable_quirks()
+            self.assertEqual(changes["written"], [e6530])
+            with open(e6530) as f:
+                self.assertIn('"False"', f.read())
+
+            # the quirk of the other product replaces the stale one
+            changes = checker("Latitude E6540").enable_quirks()
+            self.assertEqual(changes["written"], [e6540])
+            self.assertEqual(changes["removed"], [e6530])
+
+            changes = checker("Latitude E6540").disable_quirks()
+            self.assertEqual(changes["removed"], [e6540])
+            changes = checker("Latitude E6540").disable_quirks()
+            self.assertEqual(changes, {"written": [], "unchanged": [], "removed": []})
+
+            self.assertEqual(
+                sorted(os.listdir(work_dir)),
+                [os.path.basename(other), os.path.basename(updates)],
+            )
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_quirk_store(self):
+        """Parsed quirks are cached until a quirk file changes"""
+        self.this_function_name = sys._getframe().f_code.co_name
+
+        quirk = """
+Section "Quirk"
+    Identifier "Test Latitude E6530"
+    Handler "nvidia-current|nvidia-current-updates"
+    Match "sys_vendor" "Dell Inc."
+    Match "product_name" "Latitude E6530"
+    XorgSnippet
+        Section "Device"
+            Identifier "My Card"
+            Driver "nvidia"
+        EndSection
+    EndXorgSnippet
+EndSection
+"""
+        with open(tempFile, "w") as confFile:
+            confFile.write(quirk)
+
+        cache_dir = tempfile.mkdtemp()
+        cache = os.path.join(cache_dir, "quirks.json")
+        read_quirk = quirkreader.ReadQuirk
+        try:
+            a = quirkapplier.QuirkChecker(
+                "nvidia-current", path=destination, cache_path=cache
+            )
+            self.assertTrue(os.path.exists(cache))
+            ids = [x.id for x in a._quirks]
+            self.assertIn("Test Latitude E6530", ids)
+            a._system_info = {
+                "sys_vendor": "Dell Inc.",
+                "product_name": "Latitude E6530",
+            }
+            self.assertTrue(
+                a.matches_tags(
+                    [x for x in a._quirks if x.id == "Test Latitude E6530"][0]
+                )
+            )
+
+            # the unchanged directory is not parsed again
+            def no_parsing(path):
+                raise AssertionError("%s parsed again" % path)
+
+            quirkreader.ReadQuirk = no_parsing
+            b = quirkapplier.QuirkChecker(
+                "NVIDIA-current-updates", path=destination, cache_path=cache
+            )
+            self.assertIn("Test Latitude E6530", [x.id for x in b._quirks])
+            self.assertEqual(
+                quirkstore.QuirkStore(destination, cache).get_quirks("fglrx"), []
+            )
+
+            # a changed quirk file is
+            quirkreader.ReadQuirk = read_quirk
+            with open(tempFile, "w") as confFile:
+                confFile.write(quirk.replace("E6530", "E6540") + "\n")
+            c = quirkapplier.QuirkChecker(
+                "nvidia-current", path=destination, cache_path=cache
+            )
+            ids = [x.id for x in c._quirks]
+            self.assertIn("Test Latitude E6540", ids)
+            self.assertNotIn("Test Latitude E6530", ids)
+        finally:
+            quirkreader.ReadQuirk = read_quirk
+            shutil.rmtree(cache_dir)
+
 
 def main():
     return 0
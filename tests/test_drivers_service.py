@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 
+import json
 import os
+import re
+import runpy
 import shutil
 import signal
 import subprocess
+import sys
 import tempfile
 import threading
+import time
 import unittest
 import xml.etree.ElementTree as ET
 from unittest.mock import patch
@@ -13,7 +18,8 @@ from unittest.mock import patch
 import apt_pkg
 import gi
 
-from UbuntuDrivers.service import drivers_service
+import UbuntuDrivers.detect
+from UbuntuDrivers.service import client, drivers_service
 
 import testarchive
 
@@ -27,6 +33,10 @@ from gi.repository import Gio, GLib, UMockdev  # noqa: E402
 _MODALIAS_NV = "pci:v000010DEd000010C3sv00003842sd00002670bc03sc03i00"
 _MODALIAS_WHITE = "pci:v00001234d00sv00000001sd00bc00sc00i00"
 
+_UBUNTU_DRIVERS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ubuntu-drivers"
+)
+
 
 class _AptChroot:
     """Minimal apt chroot backed by a testarchive.Archive.
@@ -165,6 +175,19 @@ def _normalize_dbus_value(value):
     return value
 
 
+def _iterate_main_context(condition, timeout=5.0, context=None):
+    """Run *context* (the default one if None) until *condition()* holds or
+    *timeout* expires."""
+    if context is None:
+        context = GLib.MainContext.default()
+    deadline = GLib.get_monotonic_time() + int(timeout * 1000000)
+    while not condition() and GLib.get_monotonic_time() < deadline:
+        context.iteration(False)
+        # avoid spinning while waiting on file monitor events or worker threads
+        GLib.usleep(1000)
+    return condition()
+
+
 def _write_dbus_system_config(path: str, socket_path: str) -> str:
     """Write a minimal dbus-daemon system-bus config to `path`.
 
@@ -294,6 +317,11 @@ class DriversServiceDbusTests(unittest.TestCase):
             "org.freedesktop.DBus.Introspectable",
             None,
         )
+        # The proxies share the process-wide system bus connection, which by
+        # default terminates the process once the bus goes away.  The daemon
+        # is killed in tearDownClass(), and later tests that iterate the
+        # default main context would dispatch that close.
+        cls._drivers_proxy.get_connection().set_exit_on_close(False)
 
     @classmethod
     def tearDownClass(cls):
@@ -361,6 +389,309 @@ class DriversServiceDbusTests(unittest.TestCase):
         self.assertEqual(graphics["vendor"], "NVIDIA Corporation")
         self.assertIn("GeForce", graphics["model"])
 
+    def _start_detection(self):
+        """Call StartDetection() and return the signals up to DetectionFinished
+        as (name, parameters) tuples."""
+        signals = []
+        connection = self._drivers_proxy.get_connection()
+        # the service thread runs the default main context, so collect the
+        # signals on a private one
+        context = GLib.MainContext.new()
+        context.push_thread_default()
+        try:
+            subscription = connection.signal_subscribe(
+                drivers_service.DriversService.BUS_NAME,
+                drivers_service.DriversService.BUS_NAME,
+                None,
+                drivers_service.DriversService.OBJ_PATH,
+                None,
+                Gio.DBusSignalFlags.NONE,
+                lambda _c, _s, _p, _i, name, params: signals.append(
+                    (name, _normalize_dbus_value(params))
+                ),
+            )
+            self._drivers_proxy.call_sync(
+                "StartDetection", None, Gio.DBusCallFlags.NONE, 5000, None
+            )
+            _iterate_main_context(
+                lambda: signals and signals[-1][0] == "DetectionFinished",
+                context=context,
+            )
+            connection.signal_unsubscribe(subscription)
+        finally:
+            context.pop_thread_default()
+        return signals
+
+    def test_dbus_start_detection(self):
+        """StartDetection() emits every device, then DetectionFinished."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            signals = self._start_detection()
+            result = self._call_drivers()
+
+        self.assertEqual(signals[-1], ("DetectionFinished", ()))
+        # the last report for each device is the final one
+        streamed = {}
+        for name, params in signals[:-1]:
+            self.assertEqual(name, "DeviceDetected")
+            streamed[params[0]["sys_path"]] = params[0]
+        self.assertEqual(streamed, {e["sys_path"]: e for e in result})
+
+    def test_dbus_start_detection_cached(self):
+        """StartDetection() emits a cached result once per device."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            result = self._call_drivers()
+            signals = self._start_detection()
+
+        self.assertEqual(
+            signals,
+            [("DeviceDetected", (e,)) for e in result] + [("DetectionFinished", ())],
+        )
+
+    def test_dbus_get_device(self):
+        """GetDevice() returns the drivers() entry of a single device."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            result = self._call_drivers()
+            graphics = next(
+                e for e in result if os.path.basename(e["sys_path"]) == "graphics"
+            )
+            reply = self._drivers_proxy.call_sync(
+                "GetDevice",
+                GLib.Variant("(s)", (graphics["sys_path"],)),
+                Gio.DBusCallFlags.NONE,
+                5000,
+                None,
+            )
+
+        self.assertEqual(_normalize_dbus_value(reply)[0], graphics)
+
+    def test_dbus_get_device_unknown(self):
+        """GetDevice() fails with NoSuchDevice for a device without drivers."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            with self.assertRaises(GLib.Error) as ctx:
+                self._drivers_proxy.call_sync(
+                    "GetDevice",
+                    GLib.Variant("(s)", (os.path.join(self._sys_dir, "devices/grey"),)),
+                    Gio.DBusCallFlags.NONE,
+                    5000,
+                    None,
+                )
+
+        self.assertIn("NoSuchDevice", ctx.exception.message)
+
+    def test_dbus_recommended(self):
+        """Recommended() maps each device to its recommended driver."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            reply = self._drivers_proxy.call_sync(
+                "Recommended", None, Gio.DBusCallFlags.NONE, 5000, None
+            )
+
+        recommended = {
+            os.path.basename(k): v for k, v in _normalize_dbus_value(reply)[0].items()
+        }
+        # vanilla is the only driver for "white", but not a recommended one
+        self.assertEqual(recommended, {"graphics": "nvidia-driver-450"})
+
+    def _plan_install(self, **options):
+        reply = self._drivers_proxy.call_sync(
+            "PlanInstall",
+            GLib.Variant("(a{sv})", (options,)),
+            Gio.DBusCallFlags.NONE,
+            5000,
+            None,
+        )
+        return _normalize_dbus_value(reply)[0]
+
+    def test_dbus_plan_install(self):
+        """PlanInstall() matches the package list of "ubuntu-drivers install"."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            plan = self._plan_install()
+            self.assertEqual(
+                plan,
+                UbuntuDrivers.detect.get_desktop_package_list(
+                    apt_pkg.Cache(None), self._sys_dir
+                ),
+            )
+            self.assertIn("nvidia-driver-450", plan)
+
+            self.assertEqual(
+                self._plan_install(driver=GLib.Variant("s", "390")),
+                ["nvidia-driver-390"],
+            )
+            self.assertEqual(self._plan_install(free_only=GLib.Variant("b", True)), [])
+
+            # memoized until the result is invalidated, also for other
+            # spellings of the same driver
+            with patch.object(drivers_service, "_plan_install") as plan_install:
+                self.assertEqual(self._plan_install(), plan)
+                self.assertEqual(
+                    self._plan_install(driver=GLib.Variant("s", "nvidia:390")),
+                    ["nvidia-driver-390"],
+                )
+                self.assertEqual(
+                    self._plan_install(driver=GLib.Variant("s", "amdgpu")), []
+                )
+            plan_install.assert_not_called()
+
+    def test_dbus_plan_install_invalid_option(self):
+        """PlanInstall() rejects unknown options and wrongly typed values."""
+        for options in (
+            {"gpgpu": GLib.Variant("b", True)},
+            {"driver": GLib.Variant("i", 390)},
+        ):
+            with self.assertRaises(GLib.Error) as ctx:
+                self._plan_install(**options)
+            self.assertIn("InvalidArgs", ctx.exception.message)
+
+    def test_client_device_drivers(self):
+        """client.device_drivers() matches system_device_drivers()."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            devices = client.device_drivers(client.drivers())
+            expected = UbuntuDrivers.detect.system_device_drivers(
+                apt_pkg.Cache(None), self._sys_dir
+            )
+
+        self.assertEqual(set(devices), set(expected))
+        for device, info in expected.items():
+            self.assertEqual(devices[device]["modalias"], info["modalias"])
+            self.assertEqual(set(devices[device]["drivers"]), set(info["drivers"]))
+            for name, driver in info["drivers"].items():
+                self.assertEqual(
+                    devices[device]["drivers"][name]["recommended"],
+                    driver.get("recommended", False),
+                )
+
+    def test_client_driver_packages(self):
+        """client.driver_packages() matches system_driver_packages()."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            packages, linux_modules = client.driver_packages(client.drivers())
+            expected = UbuntuDrivers.detect.system_driver_packages(
+                apt_pkg.Cache(None), self._sys_dir
+            )
+
+        self.assertEqual(set(packages), set(expected))
+        self.assertEqual(set(linux_modules), set(expected))
+        for name, info in expected.items():
+            for key in ("syspath", "free", "from_distro"):
+                self.assertEqual(packages[name][key], info[key], (name, key))
+            self.assertEqual(
+                packages[name]["recommended"], info.get("recommended", False)
+            )
+            self.assertEqual(packages[name]["support"], info.get("support"))
+            self.assertIsNone(linux_modules[name])
+
+    def _run_ubuntu_drivers(self, *args, **env):
+        # no devices for local detection, so that the output shows where it
+        # came from
+        sys_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sys_dir)
+        return subprocess.run(
+            [sys.executable, _UBUNTU_DRIVERS] + list(args),
+            env=dict(
+                os.environ,
+                PYTHONPATH=os.path.dirname(_UBUNTU_DRIVERS),
+                UBUNTU_DRIVERS_SYS_DIR=sys_dir,
+                **env,
+            ),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    def test_cli_devices_via_service(self):
+        """ "ubuntu-drivers devices --via-service" shows the service's result."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            ud = self._run_ubuntu_drivers("devices", "--via-service", "--format=json")
+        self.assertEqual(ud.returncode, 0, ud.stderr)
+        self.assertEqual(ud.stderr, "")
+
+        records = {
+            os.path.basename(record["device"]): record
+            for record in json.loads(ud.stdout)
+        }
+        self.assertEqual(set(records), {"white", "graphics"})
+        self.assertEqual(records["graphics"]["modalias"], _MODALIAS_NV)
+        drivers = records["graphics"]["drivers"]
+        self.assertTrue(drivers["nvidia-driver-450"]["recommended"])
+        self.assertFalse(drivers["nvidia-driver-390"]["recommended"])
+        self.assertTrue(drivers["xserver-xorg-video-nouveau"]["builtin"])
+
+    def test_cli_list_via_service(self):
+        """ "ubuntu-drivers list --via-service" shows the service's result."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            ud = self._run_ubuntu_drivers("list", "--via-service")
+        self.assertEqual(ud.returncode, 0, ud.stderr)
+
+        packages = ud.stdout.splitlines()
+        self.assertEqual(
+            set(packages), {"vanilla", "nvidia-driver-450", "nvidia-driver-390"}
+        )
+        # most preferred first, like without --via-service
+        self.assertLess(
+            packages.index("nvidia-driver-450"), packages.index("nvidia-driver-390")
+        )
+
+    def test_cli_via_service_unavailable(self):
+        """--via-service falls back to local detection without a service."""
+        ud = self._run_ubuntu_drivers(
+            "devices",
+            "--via-service",
+            DBUS_SYSTEM_BUS_ADDRESS="unix:path=" + os.path.join(self._tmpdir, "none"),
+        )
+        self.assertEqual(ud.returncode, 0, ud.stderr)
+        self.assertIn("detecting locally", ud.stderr)
+        self.assertEqual(ud.stdout, "")
+
+    def test_dbus_debug_stats(self):
+        """Debug.Stats() reports the phases of the last detection and cache hits."""
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            for _ in range(2):
+                self._call_drivers()
+            reply = self._drivers_proxy.get_connection().call_sync(
+                drivers_service.DriversService.BUS_NAME,
+                drivers_service.DriversService.OBJ_PATH,
+                "com.ubuntu.Drivers.Debug",
+                "Stats",
+                None,
+                GLib.VariantType.new("(a{sv})"),
+                Gio.DBusCallFlags.NONE,
+                5000,
+                None,
+            )
+
+        stats = _normalize_dbus_value(reply)[0]
+        self.assertGreaterEqual(stats["cache_hits"], 1)
+        self.assertEqual(stats["pending_calls"], 0)
+        self.assertGreater(stats["peak_rss_kib"], 0)
+        last = stats["detection_history"][-1]
+        self.assertEqual(last["outcome"], "ok")
+        self.assertFalse(last["result_cache_hit"])
+        for phase in ("apt-open", "modalias-scan", "index-build", "plugins"):
+            self.assertIn(phase, last["phases"])
+        # one per device with a modalias, whether a package covers it or not
+        self.assertEqual(last["phase_counts"]["device-resolution"], 3)
+        self.assertGreaterEqual(last["duration"], last["phases"]["index-build"])
+
+    def test_dbus_drivers_for_modaliases(self):
+        """DriversForModaliases() also resolves hardware that is not present."""
+        absent = "pci:v0000BEEFd00001234sv00000001sd00000000bc03sc00i00"
+        with patch.object(drivers_service, "sys_path", self._sys_dir):
+            reply = self._drivers_proxy.call_sync(
+                "DriversForModaliases",
+                GLib.Variant("(as)", ([_MODALIAS_NV, absent, "pci:vDEADBEEFd00"],)),
+                Gio.DBusCallFlags.NONE,
+                5000,
+                None,
+            )
+
+        self.assertEqual(
+            _normalize_dbus_value(reply)[0],
+            {
+                _MODALIAS_NV: ["nvidia-driver-390", "nvidia-driver-450"],
+                absent: ["vanilla"],
+                "pci:vDEADBEEFd00": [],
+            },
+        )
+
     def test_dbus_drivers_signature(self):
         """The drivers method is advertised with the correct D-Bus signature."""
         xml_variant = self._introspection_proxy.call_sync(
@@ -605,5 +936,1175 @@ class BuildDriversPayloadTests(unittest.TestCase):
         self.assertIn("apt cache error", str(ctx.exception))
 
 
+class DetectInWorkerTests(unittest.TestCase):
+    """Tests for _detect_in_worker().
+
+    The worker process does not inherit the apt configuration of the test
+    process, so it is pointed at the apt chroot with APT_CONFIG.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._archive = gen_fakearchive()
+        cls._chroot = _AptChroot()
+        cls._chroot.setup(cls._archive)
+        cls._apt_config = os.path.join(cls._chroot.path, "etc/apt/apt.conf")
+        with open(cls._apt_config, "w") as f:
+            f.write(f'Dir "{cls._chroot.path}/";\n')
+            f.write(f'Dir::State::status "{cls._chroot.path}/var/lib/dpkg/status";\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, "_chroot"):
+            cls._chroot.remove()
+
+    def setUp(self):
+        self._umockdev = gen_fakehw()
+        self._plugin_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._plugin_dir)
+        for p in (
+            patch.dict(
+                os.environ,
+                {
+                    "UBUNTU_DRIVERS_DETECT_DIR": self._plugin_dir,
+                    "APT_CONFIG": self._apt_config,
+                },
+            ),
+            patch.object(drivers_service, "sys_path", self._umockdev.get_sys_dir()),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_worker_matches_in_process(self):
+        """The worker streams the devices and returns the in-process result."""
+        devices = []
+        value, modalias_map = drivers_service._detect_in_worker(
+            devices.append, with_map=True
+        )
+
+        result = _normalize_dbus_value(value)[0]
+        self.assertEqual(result, _call_build_drivers())
+        self.assertEqual(
+            sorted(_normalize_dbus_value(d)["sys_path"] for d in devices),
+            sorted(e["sys_path"] for e in result),
+        )
+        self.assertIn("pci", modalias_map)
+
+    def test_worker_map_only(self):
+        """With map_only, the worker only returns the modalias map."""
+        value, modalias_map = drivers_service._detect_in_worker(map_only=True)
+
+        self.assertIsNone(value)
+        self.assertEqual(
+            UbuntuDrivers.detect.modalias_map_packages(modalias_map, _MODALIAS_WHITE),
+            {"vanilla"},
+        )
+
+    def test_worker_plan(self):
+        """The worker plans an installation like PlanInstall() does in-process."""
+        packages = drivers_service._plan_packages(
+            drivers_service._build_drivers_variant(), False, True
+        )
+        payloads = drivers_service._run_worker(
+            ["--plan"], request=(packages, False, "")
+        )
+
+        self.assertEqual(
+            payloads["plan"],
+            drivers_service._plan_install(apt_pkg.Cache(None), packages, False, ""),
+        )
+        self.assertIn("nvidia-driver-450", payloads["plan"])
+
+    def test_worker_devices(self):
+        """The worker resolves single devices like the in-process code does."""
+        devices = {
+            "/sys/devices/white": _MODALIAS_WHITE,
+            "/sys/devices/unknown": "pci:v0000FFFFd0000FFFFsv00sd00bc00sc00i00",
+        }
+        payloads = drivers_service._run_worker(["--devices"], request=devices)
+
+        cache = apt_pkg.Cache(None)
+        expected = drivers_service._resolve_devices(
+            cache, UbuntuDrivers.detect.apt_cache_modalias_map(cache), devices
+        )
+        self.assertEqual(
+            [(name, data) for name, data in payloads["devices"]],
+            [(name, d.get_data_as_bytes().get_data()) for name, d in expected],
+        )
+        self.assertEqual([name for name, _ in expected], ["/sys/devices/white"])
+        self.assertEqual(
+            [d["name"] for d in _normalize_dbus_value(expected[0][1])["drivers"]],
+            ["vanilla"],
+        )
+
+    def test_worker_crash(self):
+        """A detect plugin killing its process only fails that detection."""
+        with open(os.path.join(self._plugin_dir, "crash.py"), "w") as f:
+            f.write(
+                "import os, signal\n"
+                "def detect(apt_cache):\n"
+                "    os.kill(os.getpid(), signal.SIGKILL)\n"
+            )
+
+        with self.assertRaises(ChildProcessError) as ctx:
+            drivers_service._detect_in_worker()
+        self.assertIn(str(-signal.SIGKILL), str(ctx.exception))
+
+    def test_worker_phase_hook_raises(self):
+        """Phase boundaries are replayed, and a raising hook stops the worker."""
+        phases = []
+
+        def hook(phase, started):
+            phases.append((phase, started))
+            if phase == "device-resolution":
+                raise KeyboardInterrupt()
+
+        UbuntuDrivers.detect.phase_hooks.append(hook)
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                drivers_service._detect_in_worker()
+        finally:
+            UbuntuDrivers.detect.phase_hooks.remove(hook)
+
+        self.assertIn(("modalias-scan", False), phases)
+        self.assertEqual(phases[-1], ("device-resolution", True))
+
+    def test_service_out_of_process(self):
+        """DriversService(out_of_process=True) caches the worker's result."""
+        idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self.addCleanup(idle_mgr.cancel)
+        service = drivers_service.DriversService(idle_mgr, out_of_process=True)
+
+        with patch.object(
+            drivers_service, "_open_apt_cache", side_effect=AssertionError
+        ):
+            service.refresh()
+            self.assertTrue(
+                _iterate_main_context(
+                    lambda: service._cached_result is not None, timeout=30
+                )
+            )
+
+        self.assertEqual(
+            _normalize_dbus_value(service._cached_result)[0], _call_build_drivers()
+        )
+        self.assertIsNone(service._modalias_map)
+
+
+class PlanBranchesTests(unittest.TestCase):
+    """PlanInstall() against an archive with several NVIDIA branches, where
+    the newest one is not the recommended one."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._archive = gen_fakearchive()
+        for name, support in (
+            ("nvidia-driver-550", "PB"),
+            ("nvidia-driver-560", "NFB"),
+        ):
+            cls._archive.create_deb(
+                name,
+                dependencies={"Depends": "xorg-video-abi-4"},
+                extra_tags={
+                    "Modaliases": "nv(pci:v000010DEd000010C3sv*sd*bc03sc*i*)",
+                    "Support": support,
+                },
+            )
+        cls._chroot = _AptChroot()
+        cls._chroot.setup(cls._archive)
+        cls._apt_config = os.path.join(cls._chroot.path, "etc/apt/apt.conf")
+        with open(cls._apt_config, "w") as f:
+            f.write(f'Dir "{cls._chroot.path}/";\n')
+            f.write(f'Dir::State::status "{cls._chroot.path}/var/lib/dpkg/status";\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, "_chroot"):
+            cls._chroot.remove()
+
+    def setUp(self):
+        self._umockdev = gen_fakehw()
+        self._plugin_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._plugin_dir)
+        for p in (
+            patch.dict(
+                os.environ,
+                {
+                    "UBUNTU_DRIVERS_DETECT_DIR": self._plugin_dir,
+                    "UBUNTU_DRIVERS_SYS_DIR": self._umockdev.get_sys_dir(),
+                    "APT_CONFIG": self._apt_config,
+                },
+            ),
+            patch.object(drivers_service, "sys_path", self._umockdev.get_sys_dir()),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+
+        idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self.addCleanup(idle_mgr.cancel)
+        # detection and planning both run in workers, which start without
+        # anything in UbuntuDrivers.detect.lookup_cache
+        self._service = drivers_service.DriversService(idle_mgr, out_of_process=True)
+        self._connection = _FakeConnection()
+        self._service.export(self._connection)
+
+    def _call(self, method, parameters, _reply_type=None, _timeout_ms=None):
+        """Call *method* of the service, like client._call() does over D-Bus."""
+        invocation = _FakeInvocation(method, parameters)
+        self._service._handle_method_call(
+            self._connection,
+            ":1.1",
+            drivers_service.DriversService.OBJ_PATH,
+            drivers_service.DriversService.BUS_NAME,
+            method,
+            parameters,
+            invocation,
+        )
+        self.assertTrue(
+            _iterate_main_context(lambda: invocation.value is not None, timeout=30)
+        )
+        return invocation.value.unpack()[0]
+
+    def _local_plan(self):
+        return UbuntuDrivers.detect.get_desktop_package_list(
+            apt_pkg.Cache(None), self._umockdev.get_sys_dir()
+        )
+
+    def test_plan_install_matches_local(self):
+        """PlanInstall() picks the branch that "ubuntu-drivers install" picks."""
+        plan = self._call("PlanInstall", GLib.Variant("(a{sv})", ({},)))
+
+        expected = self._local_plan()
+        self.assertIn("nvidia-driver-550", expected)
+        self.assertEqual(plan, expected)
+
+    def _cli_install(self, via_service):
+        """Run "ubuntu-drivers install" with --via-service or --local, and
+        return the packages it installs."""
+        ud = runpy.run_path(_UBUNTU_DRIVERS, run_name="ubuntu_drivers")
+        config = ud["Config"]()
+        config.via_service = via_service
+
+        # the chroot has no kernel to check
+        with patch(
+            "UbuntuDrivers.kerneldetection.KernelDetection.get_kernel_update_warning",
+            return_value=False,
+        ), patch.object(client, "_call", self._call), patch(
+            "UbuntuDrivers.detect.nvidia_desktop_pre_installation_hook"
+        ), patch(
+            "UbuntuDrivers.detect.nvidia_desktop_post_installation_hook"
+        ), patch(
+            "UbuntuDrivers.installer.Installer"
+        ) as engine:
+            engine.return_value.installs.return_value = []
+            engine.return_value.removals.return_value = []
+            self.assertEqual(ud["command_install"](config), 0)
+
+        engine.return_value.commit.assert_called_once_with()
+        ((to_install,), _) = engine.return_value.mark_install.call_args
+        return to_install
+
+    def test_cli_install_via_service_matches_local(self):
+        """ "ubuntu-drivers install --via-service" installs what --local does."""
+        via_service = self._cli_install(True)
+        local = self._cli_install(False)
+
+        self.assertIn("nvidia-driver-550", local)
+        self.assertEqual(via_service, local)
+
+
+class DetectionStatsTests(unittest.TestCase):
+    """Unit tests for _DetectionStats."""
+
+    def test_phases_and_history(self):
+        """Phase times add up per name, and only the last detections are kept."""
+        stats = drivers_service._DetectionStats(history=2)
+        for outcome in ("ok", "cancelled", "failed"):
+            stats.begin()
+            for _ in range(2):
+                stats.phase("device-resolution", True)
+                stats.phase("spawn", True)
+                stats.phase("spawn", False)
+                stats.phase("device-resolution", False)
+            stats.finish(outcome)
+        # a boundary outside of a detection is ignored
+        stats.phase("plugins", True)
+        stats.counters["coalesced_calls"] += 3
+
+        result = _normalize_dbus_value(stats.variant(1))[0]
+        self.assertEqual(
+            [d["outcome"] for d in result["detection_history"]], ["cancelled", "failed"]
+        )
+        last = result["detection_history"][-1]
+        self.assertEqual(last["phase_counts"], {"device-resolution": 2, "spawn": 2})
+        self.assertGreaterEqual(
+            last["phases"]["device-resolution"], last["phases"]["spawn"]
+        )
+        self.assertEqual(result["detections"], 3)
+        self.assertEqual(result["subprocess_spawns"], 6)
+        self.assertEqual(result["coalesced_calls"], 3)
+        self.assertEqual(result["pending_calls"], 1)
+
+
+class ResultIndexTests(unittest.TestCase):
+    """Unit tests for _ResultIndex."""
+
+    def test_modalias_memo_bounded(self):
+        """DriversForModaliases() answers are memoized for recent modaliases only."""
+        index = drivers_service._ResultIndex(_fake_result("fake"), {})
+        with patch.object(drivers_service, "_MODALIAS_MEMO_SIZE", 2), patch.object(
+            UbuntuDrivers.detect, "modalias_map_packages", return_value={"vanilla"}
+        ) as packages:
+            for modalias in ("a", "b", "a", "c", "a", "b"):
+                reply = index.drivers_for_modaliases([modalias])
+                self.assertEqual(
+                    _normalize_dbus_value(reply)[0], {modalias: ["vanilla"]}
+                )
+            # "b" was the least recently used one when "c" was added
+            self.assertEqual(
+                [c.args[1] for c in packages.call_args_list], ["a", "b", "c", "b"]
+            )
+            self.assertEqual(list(index._modalias_packages), ["a", "b"])
+
+
+class PlanDriverTests(unittest.TestCase):
+    """Unit tests for _plan_driver()."""
+
+    def test_normalize(self):
+        """Spellings of the same driver option select the same packages."""
+        packages = {
+            name: {"free": False, "from_distro": True, "recommended": False}
+            for name in ("nvidia-driver-390", "nvidia-driver-450", "vanilla")
+        }
+        for driver in ("390", "nvidia:390", "nvidia-driver-390"):
+            self.assertEqual(
+                drivers_service._plan_driver(packages, driver), "nvidia-driver-390"
+            )
+        self.assertEqual(
+            drivers_service._plan_driver(packages, "nvidia"),
+            "nvidia-driver-390,nvidia-driver-450",
+        )
+        self.assertEqual(drivers_service._plan_driver(packages, ""), "")
+        for driver in ("amdgpu", "535", "390,450", "x" * 1000):
+            self.assertIsNone(drivers_service._plan_driver(packages, driver))
+
+
+class StateWatcherTests(unittest.TestCase):
+    """Unit tests for _StateWatcher, using temporary files in place of the
+    dpkg and apt state."""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._status = os.path.join(self._tmpdir, "status")
+        with open(self._status, "w") as f:
+            f.write("Package: foo\n")
+        self._lists = os.path.join(self._tmpdir, "lists")
+        os.mkdir(self._lists)
+        self._missing = os.path.join(self._tmpdir, "custom_supported_gpus.json")
+
+        self._calls = 0
+        self._watcher = drivers_service._StateWatcher(
+            self._on_change,
+            paths=(self._status, self._lists, self._missing),
+            settle_ms=100,
+        )
+        self._watcher.start()
+
+    def tearDown(self):
+        self._watcher.stop()
+        shutil.rmtree(self._tmpdir)
+
+    def _on_change(self):
+        self._calls += 1
+
+    def test_file_change_is_debounced(self):
+        """A burst of writes results in a single callback once changes settle."""
+        for i in range(5):
+            with open(self._status, "a") as f:
+                f.write(f"Version: {i}\n")
+
+        self.assertTrue(_iterate_main_context(lambda: self._calls > 0))
+        # give a second, spurious callback the chance to show up
+        _iterate_main_context(lambda: False, timeout=0.3)
+        self.assertEqual(self._calls, 1)
+
+    def test_directory_entry_created(self):
+        """Creating a file in a watched directory triggers the callback."""
+        with open(os.path.join(self._lists, "archive_Packages"), "w") as f:
+            f.write("Package: bar\n")
+
+        self.assertTrue(_iterate_main_context(lambda: self._calls > 0))
+
+    def test_missing_file_created(self):
+        """A path that does not exist yet is picked up once it is created."""
+        with open(self._missing, "w") as f:
+            f.write("{}")
+
+        self.assertTrue(_iterate_main_context(lambda: self._calls > 0))
+
+    def test_stop_drops_pending_change(self):
+        """stop() cancels a change that has not settled yet."""
+        with open(self._status, "a") as f:
+            f.write("Version: 1\n")
+        # deliver the monitor event, but not the settle timeout
+        _iterate_main_context(lambda: self._watcher._settle_id is not None)
+        self._watcher.stop()
+
+        _iterate_main_context(lambda: False, timeout=0.3)
+        self.assertEqual(self._calls, 0)
+
+
+def _fake_result(modalias):
+    """Return a drivers() value with a single device using *modalias*."""
+    device = drivers_service._device_variant(
+        "/sys/devices/fake",
+        {"modalias": modalias, "drivers": {"vanilla": {"free": True}}},
+    )
+    return GLib.Variant.new_tuple(
+        GLib.Variant.new_array(GLib.VariantType.new("a{sv}"), [device])
+    )
+
+
+class DriversServiceRefreshTests(unittest.TestCase):
+    """Unit tests for DriversService.refresh(), with detection replaced by a
+    counter so no hardware or apt state is needed."""
+
+    def setUp(self):
+        self._runs = 0
+        self._idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self._service = drivers_service.DriversService(self._idle_mgr)
+
+    def tearDown(self):
+        self._idle_mgr.cancel()
+
+    def _fake_detect(self, on_device=None, build_modalias_map=None):
+        self._runs += 1
+        return _fake_result(str(self._runs)), {}
+
+    def test_refresh_warms_cache(self):
+        """refresh() re-runs detection in the background and caches the result."""
+        with patch.object(drivers_service, "_detect_drivers", self._fake_detect):
+            self._service.refresh()
+            self.assertTrue(
+                _iterate_main_context(lambda: self._service._cached_result is not None)
+            )
+
+        self.assertEqual(self._runs, 1)
+        self.assertFalse(self._service._task_running)
+
+    def test_refresh_during_detection_restarts(self):
+        """A refresh while detection runs discards that result and detects again."""
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def blocking_detect(on_device=None, build_modalias_map=None):
+            started.set()
+            proceed.wait(5)
+            return self._fake_detect()
+
+        with patch.object(drivers_service, "_detect_drivers", blocking_detect):
+            self._service.refresh()
+            self.assertTrue(started.wait(5))
+            self._service.refresh()
+            proceed.set()
+            self.assertTrue(
+                _iterate_main_context(
+                    lambda: self._service._cached_result is not None
+                    and not self._service._task_running
+                )
+            )
+
+        self.assertEqual(self._runs, 2)
+        self.assertEqual(
+            _normalize_dbus_value(self._service._cached_result)[0][0]["modalias"], "2"
+        )
+
+
+class ResultCacheTests(unittest.TestCase):
+    """Unit tests for _ResultCache, with temporary files standing in for the
+    package state."""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._status = os.path.join(self._tmpdir, "status")
+        with open(self._status, "w") as f:
+            f.write("Package: foo\n")
+        self._lists = os.path.join(self._tmpdir, "lists")
+        os.mkdir(self._lists)
+        self._path = os.path.join(self._tmpdir, "cache", "drivers.gvariant")
+        self._cache = drivers_service._ResultCache(
+            self._path, state_paths=(self._status, self._lists)
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_roundtrip(self):
+        """store() followed by lookup() with the same tags returns the value."""
+        self.assertIsNone(self._cache.lookup("hw", "state"))
+        self._cache.store("hw", "state", _fake_result("a"))
+
+        value = self._cache.lookup("hw", "state")
+        self.assertEqual(value.get_type_string(), "(aa{sv})")
+        self.assertEqual(_normalize_dbus_value(value)[0][0]["modalias"], "a")
+        self.assertEqual(os.listdir(os.path.dirname(self._path)), ["drivers.gvariant"])
+
+    def test_tag_mismatch(self):
+        """lookup() misses when the hardware or the package state differ."""
+        self._cache.store("hw", "state", _fake_result("a"))
+
+        self.assertIsNone(self._cache.lookup("other-hw", "state"))
+        self.assertIsNone(self._cache.lookup("hw", "other-state"))
+
+    def test_malformed_file(self):
+        """lookup() ignores a file that was not written by store()."""
+        os.makedirs(os.path.dirname(self._path))
+        with open(self._path, "wb") as f:
+            f.write(b"\xff" * 64)
+
+        self.assertIsNone(self._cache.lookup("hw", "state"))
+
+    def test_state_identity(self):
+        """state_identity() changes with the state files, the list entries and
+        the running kernel."""
+        identity = self._cache.state_identity()
+        self.assertEqual(identity, self._cache.state_identity())
+
+        with open(os.path.join(self._lists, "archive_Packages"), "w") as f:
+            f.write("Package: bar\n")
+        self.assertNotEqual(identity, self._cache.state_identity())
+
+        identity = self._cache.state_identity()
+        with open(self._status, "a") as f:
+            f.write("Version: 1\n")
+        self.assertNotEqual(identity, self._cache.state_identity())
+
+        identity = self._cache.state_identity()
+        uname = os.uname()
+        new_kernel = os.uname_result(uname[:2] + ("99.0.0-1-generic",) + uname[3:])
+        with patch("os.uname", return_value=new_kernel):
+            self.assertNotEqual(identity, self._cache.state_identity())
+        self.assertEqual(identity, self._cache.state_identity())
+
+    def test_service_answers_from_disk(self):
+        """A new DriversService serves the stored result without detection."""
+        runs = []
+
+        def fake_detect(on_device=None, build_modalias_map=None):
+            runs.append(1)
+            return _fake_result(str(len(runs))), {}
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect), patch(
+            "UbuntuDrivers.detect.system_modaliases",
+            return_value={"pci:v1": "/sys/devices/a"},
+        ):
+            for _ in range(2):
+                idle_mgr = drivers_service._IdleManager(
+                    lambda: None, timeout_seconds=300
+                )
+                service = drivers_service.DriversService(idle_mgr, self._cache)
+                service.refresh()
+                self.assertTrue(
+                    _iterate_main_context(lambda: service._cached_result is not None)
+                )
+                idle_mgr.cancel()
+                self.assertEqual(
+                    _normalize_dbus_value(service._cached_result)[0][0]["modalias"], "1"
+                )
+
+        self.assertEqual(len(runs), 1)
+
+    def test_modalias_map_after_cache_hit(self):
+        """DriversForModaliases() builds only the modalias map on a cache hit."""
+        modalias_map = {"pci": (re.compile("pci:v1.*"), {"pci:v1*": {"vanilla"}})}
+
+        with patch(
+            "UbuntuDrivers.detect.system_modaliases",
+            return_value={"pci:v1": "/sys/devices/a"},
+        ):
+            self._cache.store(
+                UbuntuDrivers.detect.hardware_fingerprint({"pci:v1": "/sys/devices/a"}),
+                self._cache.state_identity(),
+                _fake_result("pci:v1"),
+            )
+            idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+            service = drivers_service.DriversService(idle_mgr, self._cache)
+            invocation = _FakeInvocation(
+                "DriversForModaliases", GLib.Variant("(as)", (["pci:v1", "usb:v2"],))
+            )
+            with patch.object(
+                drivers_service, "_detect_drivers", side_effect=AssertionError
+            ), patch.object(drivers_service, "_open_apt_cache"), patch(
+                "UbuntuDrivers.detect.apt_cache_modalias_map",
+                return_value=modalias_map,
+            ) as build_map:
+                service._handle_method_call(
+                    None, ":1.1", None, None, "DriversForModaliases", None, invocation
+                )
+                self.assertTrue(_iterate_main_context(lambda: invocation.value))
+            idle_mgr.cancel()
+
+        build_map.assert_called_once()
+        self.assertEqual(
+            _normalize_dbus_value(invocation.value)[0],
+            {"pci:v1": ["vanilla"], "usb:v2": []},
+        )
+
+
+class IdlePolicyTests(unittest.TestCase):
+    """Unit tests for _IdlePolicy, with a fake clock."""
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._path = os.path.join(self._dir, "idle-history.json")
+        self._now = 1000.0
+
+    def _policy(self):
+        return drivers_service._IdlePolicy(
+            self._path, default=300, maximum=1800, clock=lambda: self._now
+        )
+
+    def _calls(self, policy, gaps):
+        for gap in gaps:
+            self._now += gap
+            policy.record_call()
+
+    def test_default_without_history(self):
+        """Too few calls keep the default timeout."""
+        policy = self._policy()
+        self._calls(policy, [0, 600, 600, 600])
+        self.assertEqual(policy.timeout_seconds(), 300)
+
+    def test_bursts_extend_timeout(self):
+        """Calls mostly coming within the maximum extend the timeout."""
+        policy = self._policy()
+        self._calls(policy, [0, 10, 900, 20, 1000, 30, 1100, 86400, 5, 40, 1200])
+        self.assertEqual(policy.timeout_seconds(), 1200)
+
+        # until the long gaps take over
+        self._calls(policy, [3000] * 9)
+        self.assertEqual(policy.timeout_seconds(), 300)
+
+    def test_rare_calls_keep_default(self):
+        """Calls mostly further apart than the maximum keep the default."""
+        policy = self._policy()
+        self._calls(policy, [0, 86400, 5, 86400, 10, 86400, 20, 86400, 30])
+        self.assertEqual(policy.timeout_seconds(), 300)
+
+    def test_history_survives_activations(self):
+        """The history, and the time of the last call, are saved and loaded."""
+        policy = self._policy()
+        self._calls(policy, [0, 600, 700, 800])
+        policy.save()
+
+        self._now += 900
+        policy = self._policy()
+        policy.load()
+        policy.record_call()
+        self.assertEqual(policy.timeout_seconds(), 900)
+
+    def test_malformed_history(self):
+        """A malformed history file is ignored."""
+        with open(self._path, "w") as f:
+            f.write('{"gaps": "x"}')
+        policy = self._policy()
+        policy.load()
+        policy.record_call()
+        self.assertEqual(policy.timeout_seconds(), 300)
+
+    def test_idle_manager_records_calls(self):
+        """Calls reaching the idle manager are learned from."""
+        policy = self._policy()
+        idle_mgr = drivers_service._IdleManager(lambda: None, policy=policy)
+        self.addCleanup(idle_mgr.cancel)
+        idle_mgr.start()
+        for _ in range(5):
+            self._now += 1000
+            idle_mgr.activity()
+        self.assertEqual(idle_mgr.timeout_seconds(), 1000)
+
+
+class _FakeConnection:
+    """Stands in for the Gio.DBusConnection and records emitted signals."""
+
+    def __init__(self):
+        self.signals = []
+        self.subscriptions = {}
+
+    def register_object_with_closures2(self, *_args):
+        return 1
+
+    def emit_signal(self, _destination, _path, _interface, name, parameters):
+        self.signals.append((name, parameters))
+
+    def signal_subscribe(self, _sender, _interface, _member, _path, arg0, _flags, cb):
+        subscription = len(self.signals) + len(self.subscriptions) + 1
+        self.subscriptions[subscription] = (arg0, cb)
+        return subscription
+
+    def signal_unsubscribe(self, subscription):
+        del self.subscriptions[subscription]
+
+    def disconnect(self, name):
+        """Emit NameOwnerChanged for *name* leaving the bus."""
+        for arg0, cb in list(self.subscriptions.values()):
+            if arg0 == name:
+                cb(
+                    self,
+                    "org.freedesktop.DBus",
+                    "/org/freedesktop/DBus",
+                    "org.freedesktop.DBus",
+                    "NameOwnerChanged",
+                    GLib.Variant("(sss)", (name, name, "")),
+                )
+
+
+class _FakeInvocation:
+    """Stands in for a Gio.DBusMethodInvocation and records the reply."""
+
+    def __init__(self, method_name="StartDetection", parameters=None, sender=":1.1"):
+        self._method_name = method_name
+        self._parameters = parameters
+        self._sender = sender
+        self.value = None
+        self.error = None
+
+    def get_method_name(self):
+        return self._method_name
+
+    def get_sender(self):
+        return self._sender
+
+    def get_parameters(self):
+        return self._parameters
+
+    def return_value(self, value):
+        self.value = value
+
+    def return_dbus_error(self, name, _message):
+        self.error = name
+
+
+class StartDetectionTests(unittest.TestCase):
+    """Unit tests for the StartDetection() signal sequence, with detection
+    replaced by canned device entries."""
+
+    def setUp(self):
+        self._idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self._service = drivers_service.DriversService(self._idle_mgr)
+        self._connection = _FakeConnection()
+        self._service.export(self._connection)
+
+    def tearDown(self):
+        self._idle_mgr.cancel()
+
+    def _start_detection(self):
+        self._service._handle_method_call(
+            self._connection,
+            ":1.1",
+            drivers_service.DriversService.OBJ_PATH,
+            drivers_service.DriversService.BUS_NAME,
+            "StartDetection",
+            None,
+            _FakeInvocation(),
+        )
+        self.assertTrue(
+            _iterate_main_context(
+                lambda: self._connection.signals
+                and self._connection.signals[-1][0] == "DetectionFinished"
+            )
+        )
+        return [
+            (name, _normalize_dbus_value(params) if params is not None else None)
+            for name, params in self._connection.signals
+        ]
+
+    def test_changed_device_is_emitted_again(self):
+        """A device whose final entry differs from the streamed one is re-emitted."""
+        nvidia = {"drivers": {"nvidia-driver-450": {"recommended": True}}}
+        outranked = {"drivers": {"nvidia-driver-450": {"recommended": False}}}
+        white = {"drivers": {"vanilla": {"free": True}}}
+
+        def fake_detect(on_device=None, build_modalias_map=None):
+            on_device(drivers_service._device_variant("/sys/devices/graphics", nvidia))
+            on_device(drivers_service._device_variant("/sys/devices/white", white))
+            return (
+                GLib.Variant.new_tuple(
+                    GLib.Variant.new_array(
+                        GLib.VariantType.new("a{sv}"),
+                        [
+                            drivers_service._device_variant(
+                                "/sys/devices/graphics", outranked
+                            ),
+                            drivers_service._device_variant(
+                                "/sys/devices/white", white
+                            ),
+                        ],
+                    )
+                ),
+                {},
+            )
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect):
+            signals = self._start_detection()
+
+        self.assertEqual(
+            [
+                (name, params[0]["sys_path"] if params else None)
+                for name, params in signals
+            ],
+            [
+                ("DeviceDetected", "/sys/devices/graphics"),
+                ("DeviceDetected", "/sys/devices/white"),
+                ("DeviceDetected", "/sys/devices/graphics"),
+                ("DetectionFinished", None),
+            ],
+        )
+        self.assertFalse(signals[2][1][0]["drivers"][0]["recommended"])
+
+    def test_second_start_detection_emits_all_devices(self):
+        """A StartDetection() answered from the cached result emits every
+        device, including those streamed by the previous one."""
+        white = {"drivers": {"vanilla": {"free": True}}}
+
+        def fake_detect(on_device=None, build_modalias_map=None):
+            device = drivers_service._device_variant("/sys/devices/white", white)
+            on_device(device)
+            return (
+                GLib.Variant.new_tuple(
+                    GLib.Variant.new_array(GLib.VariantType.new("a{sv}"), [device])
+                ),
+                {},
+            )
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect):
+            first = self._start_detection()
+            self._connection.signals.clear()
+            second = self._start_detection()
+
+        expected = [
+            ("DeviceDetected", "/sys/devices/white"),
+            ("DetectionFinished", None),
+        ]
+        for signals in (first, second):
+            self.assertEqual(
+                [
+                    (name, params[0]["sys_path"] if params else None)
+                    for name, params in signals
+                ],
+                expected,
+            )
+
+    def test_detection_failure_finishes(self):
+        """DetectionFinished is emitted even when detection fails."""
+
+        def failing_detect(on_device=None, build_modalias_map=None):
+            raise RuntimeError("apt cache error")
+
+        with patch.object(drivers_service, "_detect_drivers", failing_detect):
+            signals = self._start_detection()
+
+        self.assertEqual(signals, [("DetectionFinished", None)])
+
+
+class PrewarmTests(unittest.TestCase):
+    """Unit tests for Prewarm(), with detection replaced by a counter."""
+
+    def setUp(self):
+        self._runs = 0
+        self._idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self._service = drivers_service.DriversService(self._idle_mgr)
+        self._connection = _FakeConnection()
+        self._service.export(self._connection)
+
+    def tearDown(self):
+        self._idle_mgr.cancel()
+
+    def _fake_detect(self, on_device=None, build_modalias_map=None):
+        self._runs += 1
+        return _fake_result(str(self._runs)), {}
+
+    def _call(self, method_name):
+        invocation = _FakeInvocation(method_name)
+        self._service._handle_method_call(
+            self._connection, ":1.1", None, None, method_name, None, invocation
+        )
+        return invocation
+
+    def test_prewarm_caches_result(self):
+        """Prewarm() returns at once and detects in the background, once."""
+        with patch.object(
+            drivers_service, "_detect_drivers", self._fake_detect
+        ), patch.object(self._idle_mgr, "activity") as activity:
+            self._call("Prewarm")
+            self.assertTrue(
+                _iterate_main_context(lambda: self._service._cached_result is not None)
+            )
+            self._call("Prewarm")
+            drivers = self._call("drivers")
+
+        self.assertEqual(self._runs, 1)
+        self.assertFalse(self._service._task_running)
+        self.assertEqual(_normalize_dbus_value(drivers.value)[0][0]["modalias"], "1")
+        # only the drivers() call counts for the idle policy
+        self.assertEqual(activity.call_count, 1)
+
+
+class CallerCancellationTests(unittest.TestCase):
+    """Unit tests for cancelling detection once every waiting caller has left
+    the bus, with detection replaced by a loop over phase boundaries."""
+
+    def setUp(self):
+        self._idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self._service = drivers_service.DriversService(self._idle_mgr)
+        self._connection = _FakeConnection()
+        self._service.export(self._connection)
+        self._started = threading.Event()
+        self._map_builds = 0
+
+    def tearDown(self):
+        self._idle_mgr.cancel()
+
+    def _build_map(self, _cache):
+        self._map_builds += 1
+        return {}
+
+    def _endless_detect(self, on_device=None, build_modalias_map=None):
+        build_modalias_map(None)
+        self._started.set()
+        while True:
+            with UbuntuDrivers.detect.detection_phase("device-resolution"):
+                time.sleep(0.01)
+
+    def _call(self, sender):
+        invocation = _FakeInvocation("drivers", sender=sender)
+        self._service._handle_method_call(
+            self._connection, sender, None, None, "drivers", None, invocation
+        )
+        return invocation
+
+    def test_last_caller_leaving_cancels(self):
+        """Detection stops when the last waiting caller disconnects."""
+        with patch.object(
+            drivers_service, "_detect_drivers", self._endless_detect
+        ), patch("UbuntuDrivers.detect.apt_cache_modalias_map", self._build_map):
+            first = self._call(":1.1")
+            second = self._call(":1.2")
+            self.assertTrue(self._started.wait(5))
+
+            self._connection.disconnect(":1.1")
+            self.assertTrue(self._service._task_running)
+            self._connection.disconnect(":1.2")
+            self.assertTrue(
+                _iterate_main_context(lambda: not self._service._task_running)
+            )
+
+        self.assertIsNone(first.value)
+        self.assertIsNone(second.value)
+        self.assertIsNone(self._service._cached_result)
+        self.assertEqual(self._connection.subscriptions, {})
+        self.assertFalse(self._idle_mgr._held)
+        self.assertEqual(UbuntuDrivers.detect.phase_hooks, [])
+
+        # The modalias map built before the cancellation is reused.
+        def fake_detect(on_device=None, build_modalias_map=None):
+            build_modalias_map(None)
+            return _fake_result("a"), {}
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect), patch(
+            "UbuntuDrivers.detect.apt_cache_modalias_map", self._build_map
+        ):
+            third = self._call(":1.3")
+            self.assertTrue(_iterate_main_context(lambda: third.value is not None))
+
+        self.assertEqual(self._map_builds, 1)
+
+    def test_refresh_is_not_cancelled(self):
+        """Detection started by refresh() outlives the callers that joined it."""
+
+        def fake_detect(on_device=None, build_modalias_map=None):
+            self._started.set()
+            for _ in range(20):
+                with UbuntuDrivers.detect.detection_phase("device-resolution"):
+                    time.sleep(0.01)
+            return _fake_result("a"), {}
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect):
+            self._service.refresh()
+            self.assertTrue(self._started.wait(5))
+            self._call(":1.1")
+            self._connection.disconnect(":1.1")
+            self.assertTrue(
+                _iterate_main_context(lambda: self._service._cached_result is not None)
+            )
+
+
+class _FakeUdevDevice:
+    """Stands in for a GUdev.Device."""
+
+    def __init__(self, sys_path, modalias=None):
+        self._sys_path = sys_path
+        self._modalias = modalias
+
+    def get_sysfs_path(self):
+        return self._sys_path
+
+    def get_property(self, name):
+        return self._modalias if name == "MODALIAS" else None
+
+
+class HotplugTests(unittest.TestCase):
+    """Unit tests for patching the cached result on hotplug events, fed as
+    synthetic uevents through a _HotplugMonitor."""
+
+    def setUp(self):
+        self._idle_mgr = drivers_service._IdleManager(lambda: None, timeout_seconds=300)
+        self._service = drivers_service.DriversService(self._idle_mgr)
+        self._connection = _FakeConnection()
+        self._service.export(self._connection)
+        self._monitor = drivers_service._HotplugMonitor(self._service.device_event)
+        self._map_builds = 0
+        self._resolved = []
+
+        def fake_detect(on_device=None, build_modalias_map=None):
+            build_modalias_map(None)
+            return _fake_result("a"), {}
+
+        with patch.object(drivers_service, "_detect_drivers", fake_detect), patch(
+            "UbuntuDrivers.detect.apt_cache_modalias_map", self._build_map
+        ):
+            self._service.refresh()
+            self.assertTrue(
+                _iterate_main_context(lambda: self._service._cached_result is not None)
+            )
+
+    def tearDown(self):
+        self._idle_mgr.cancel()
+
+    def _build_map(self, _cache):
+        self._map_builds += 1
+        return {}
+
+    def _fake_resolve(self, _cache, modalias_map, devices):
+        self._resolved.append(sorted(devices))
+        return [
+            (
+                name,
+                drivers_service._device_variant(
+                    name,
+                    {
+                        "modalias": modalias,
+                        "drivers": {"nvidia-driver-450": {"recommended": True}},
+                    },
+                ),
+            )
+            for name, modalias in devices.items()
+            if modalias == _MODALIAS_NV
+        ]
+
+    def _uevent(self, action, sys_path, modalias=None):
+        self._monitor.on_uevent(None, action, _FakeUdevDevice(sys_path, modalias))
+
+    def _devices_changed(self):
+        return [
+            _normalize_dbus_value(params)
+            for name, params in self._connection.signals
+            if name == "DevicesChanged"
+        ]
+
+    def test_added_device_is_resolved(self):
+        """Only an added device is resolved, and patched into the cached result."""
+        with patch.object(
+            drivers_service, "_resolve_devices", self._fake_resolve
+        ), patch.object(drivers_service, "_open_apt_cache", lambda: None), patch(
+            "UbuntuDrivers.detect.apt_cache_modalias_map", self._build_map
+        ):
+            self._uevent("add", "/sys/devices/egpu", _MODALIAS_NV)
+            self.assertTrue(_iterate_main_context(lambda: self._devices_changed()))
+            self._uevent("add", "/sys/devices/hub", _MODALIAS_WHITE)
+            self.assertTrue(
+                _iterate_main_context(lambda: not self._service._hotplug_running)
+            )
+
+        self.assertEqual(self._resolved, [["/sys/devices/egpu"], ["/sys/devices/hub"]])
+        # the modalias map kept from detection is reused
+        self.assertEqual(self._map_builds, 1)
+        self.assertEqual(self._devices_changed(), [(["/sys/devices/egpu"], [])])
+        self.assertEqual(
+            [
+                d["sys_path"]
+                for d in _normalize_dbus_value(self._service._cached_result)[0]
+            ],
+            ["/sys/devices/egpu", "/sys/devices/fake"],
+        )
+        self.assertEqual(
+            self._service._index.recommended.unpack()[0],
+            {"/sys/devices/egpu": "nvidia-driver-450"},
+        )
+        self.assertFalse(self._idle_mgr._held)
+
+    def test_removed_device_is_dropped(self):
+        """A removed device disappears from the cached result without detection."""
+        with patch.object(drivers_service, "_detect_drivers") as detect:
+            self._uevent("remove", "/sys/devices/unrelated")
+            self._uevent("remove", "/sys/devices/fake")
+
+        detect.assert_not_called()
+        self.assertEqual(self._devices_changed(), [([], ["/sys/devices/fake"])])
+        self.assertEqual(_normalize_dbus_value(self._service._cached_result), ([],))
+        self.assertIsNone(self._service._index.device("/sys/devices/fake"))
+
+    def test_unknown_removed_device_is_ignored(self):
+        """Removing a device that is not in the cached result changes nothing."""
+        result = self._service._cached_result
+        with patch.object(self._service, "_patch_result") as patch_result:
+            self._uevent("remove", "/sys/devices/usb-stick")
+
+        patch_result.assert_not_called()
+        self.assertIs(self._service._cached_result, result)
+
+    def test_monitor_subsystems(self):
+        """The monitor only listens to the subsystems driver packages are for."""
+        self.assertEqual(self._monitor._subsystems, ("pci", "usb"))
+
+    def test_device_without_modalias_is_ignored(self):
+        """Adding a device without a modalias does not reach the service."""
+        with patch.object(self._service, "device_event") as device_event:
+            monitor = drivers_service._HotplugMonitor(device_event)
+            monitor.on_uevent(None, "add", _FakeUdevDevice("/sys/devices/bridge"))
+            monitor.on_uevent(None, "change", _FakeUdevDevice("/sys/devices/egpu", "x"))
+
+        device_event.assert_not_called()
+
+    def test_event_during_detection_restarts(self):
+        """A device changing while detection runs restarts detection."""
+        self._service.invalidate_cache()
+        started = threading.Event()
+        proceed = threading.Event()
+        runs = []
+
+        def blocking_detect(on_device=None, build_modalias_map=None):
+            runs.append(1)
+            started.set()
+            proceed.wait(5)
+            return _fake_result(str(len(runs))), {}
+
+        with patch.object(drivers_service, "_detect_drivers", blocking_detect):
+            self._service.refresh()
+            self.assertTrue(started.wait(5))
+            self._uevent("add", "/sys/devices/egpu", _MODALIAS_NV)
+            proceed.set()
+            self.assertTrue(
+                _iterate_main_context(
+                    lambda: self._service._cached_result is not None
+                    and not self._service._task_running
+                )
+            )
+
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(self._devices_changed(), [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+# (C) 2026 Canonical Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Start-up cost of the ubuntu-drivers command.
+
+Run directly to print a start-up benchmark:
+
+    python3 tests/test_startup.py [RUNS]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from UbuntuDrivers import welcome  # noqa: E402
+
+ubuntu_drivers_path = os.path.join(ROOT, "ubuntu-drivers")
+
+# modules which make up most of the start-up time of the subcommands
+HEAVY_MODULES = ("apt_pkg", "UbuntuDrivers.detect", "UbuntuDrivers.kerneldetection")
+
+DPKG_STATUS = """\
+Package: bash
+Status: install ok installed
+Architecture: amd64
+Description: GNU Bourne Again SHell
+ Package: not-a-field
+
+Package: nvidia-driver-535
+Status: deinstall ok config-files
+Architecture: amd64
+
+Package: oem-somerville-meta
+Status: install ok installed
+Architecture: all
+
+Package: linux-modules-nvidia-535-generic
+Status: purge ok not-installed
+Architecture: amd64
+
+Package: oem-stella-meta
+Status: install ok installed
+Architecture: all"""
+
+
+def run_ubuntu_drivers(args, status_path, importtime=False):
+    """Run ubuntu-drivers and return the completed process."""
+    env = dict(os.environ)
+    env["UBUNTU_DRIVERS_DPKG_STATUS"] = status_path
+    env["PYTHONPATH"] = ROOT
+    python = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    return subprocess.run(
+        python + [ubuntu_drivers_path] + args,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def imported_modules(importtime_log):
+    """Return {module: cumulative µs} from a -X importtime log."""
+    modules = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+class StartupTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.status = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write(DPKG_STATUS)
+
+    def tearDown(self):
+        os.unlink(self.status)
+
+    def test_installed_packages(self):
+        """dpkg status stanzas are parsed per package"""
+        self.assertEqual(
+            list(welcome.installed_packages(self.status)),
+            ["bash", "oem-somerville-meta", "oem-stella-meta"],
+        )
+
+    def test_gather_welcome_page_data(self):
+        data = welcome.gather_welcome_page_data(self.status)
+        self.assertIsNone(data["cache_error"])
+        self.assertEqual(data["nvidia_drivers"], [])
+        self.assertEqual(
+            data["oem_packages"], ["oem-somerville-meta", "oem-stella-meta"]
+        )
+        self.assertIsNone(data["nvidia_status"])
+
+    def test_gather_welcome_page_data_error(self):
+        data = welcome.gather_welcome_page_data(self.status + ".missing")
+        self.assertIn("No such file", data["cache_error"])
+
+    def test_detect_gather_welcome_page_data(self):
+        """the detect function is the welcome module's"""
+        import UbuntuDrivers.detect
+
+        data = welcome.gather_welcome_page_data(self.status)
+        with patch.object(welcome, "gather_welcome_page_data", return_value=data):
+            self.assertIs(UbuntuDrivers.detect.gather_welcome_page_data(), data)
+
+    def test_welcome_page_imports(self):
+        """the welcome page imports neither click nor apt"""
+        p = run_ubuntu_drivers([], self.status, importtime=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertIn("oem-somerville-meta", p.stdout)
+        modules = imported_modules(p.stderr)
+        self.assertIn("UbuntuDrivers.welcome", modules)
+        for module in HEAVY_MODULES + ("click",):
+            self.assertNotIn(module, modules)
+
+    def test_help_imports(self):
+        """--help does not import apt"""
+        p = run_ubuntu_drivers(["--help"], self.status, importtime=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertIn("list-oem", p.stdout)
+        modules = imported_modules(p.stderr)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+
+
+def benchmark(runs):
+    """Print the wall time of the welcome page and --help, and what they import."""
+    fd, status = tempfile.mkstemp()
+    with os.fdopen(fd, "w") as f:
+        f.write(DPKG_STATUS)
+    try:
+        for args in ([], ["--help"]):
+            times = []
+            for _ in range(runs):
+                start = time.monotonic()
+                run_ubuntu_drivers(args, status)
+                times.append(time.monotonic() - start)
+            modules = imported_modules(
+                run_ubuntu_drivers(args, status, importtime=True).stderr
+            )
+            print(
+                "ubuntu-drivers %s: median %.1f ms over %i runs, %i modules"
+                % (
+                    " ".join(args) or "(welcome page)",
+                    statistics.median(times) * 1000,
+                    runs,
+                    len(modules),
+                )
+            )
+            top = sorted(modules.items(), key=lambda i: i[1], reverse=True)[:5]
+            for module, usec in top:
+                print("  %8.1f ms  %s" % (usec / 1000, module))
+    finally:
+        os.unlink(status)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
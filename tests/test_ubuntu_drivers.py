@@ -16,6 +16,9 @@ import sys
 import tempfile
 import shutil
 import logging
+import re
+import fnmatch
+import json
 
 # from gi.repository import GLib
 from gi.repository import UMockdev
@@ -25,6 +28,7 @@ import aptdaemon.test
 
 import UbuntuDrivers.detect
 import UbuntuDrivers.kerneldetection
+from UbuntuDrivers import aptscan, bundle, installer
 
 import testarchive
 
@@ -229,6 +233,91 @@ class DetectTest(unittest.TestCase):
         )
         self.assertTrue(res["pci:vDEADBEEFd00"].endswith("/sys/devices/grey"))
 
+    def test_hardware_fingerprint(self):
+        """hardware_fingerprint() only depends on the devices"""
+
+        res = UbuntuDrivers.detect.system_modaliases(self.umockdev.get_sys_dir())
+        fingerprint = UbuntuDrivers.detect.hardware_fingerprint(res)
+        self.assertEqual(
+            fingerprint,
+            UbuntuDrivers.detect.hardware_fingerprint(
+                dict(reversed(list(res.items())))
+            ),
+        )
+
+        self.umockdev.add_device(
+            "pci", "extra", None, ["modalias", "pci:v0000AAAAd00"], []
+        )
+        res = UbuntuDrivers.detect.system_modaliases(self.umockdev.get_sys_dir())
+        self.assertNotEqual(fingerprint, UbuntuDrivers.detect.hardware_fingerprint(res))
+
+    def test_detection_phase_hooks(self):
+        """phase_hooks see phase boundaries and can abort detection"""
+
+        calls = []
+
+        def hook(phase, started):
+            calls.append((phase, started))
+            if phase == "modalias-scan" and started:
+                raise KeyboardInterrupt()
+
+        UbuntuDrivers.detect.phase_hooks.append(hook)
+        try:
+            self.assertRaises(
+                KeyboardInterrupt,
+                UbuntuDrivers.detect.system_modaliases,
+                self.umockdev.get_sys_dir(),
+            )
+        finally:
+            UbuntuDrivers.detect.phase_hooks.remove(hook)
+        self.assertEqual(calls, [("modalias-scan", True)])
+
+        with UbuntuDrivers.detect.detection_phase("plugins"):
+            pass
+        self.assertEqual(len(calls), 1)
+
+    def test_modalias_map_packages(self):
+        """modalias_map_packages() matches modaliases without an apt cache"""
+
+        patterns = {
+            "pci:v00001234d*sv*sd*bc*sc*i*": {"vanilla"},
+            "pci:v000010DEd000010C3sv*sd*bc03sc*i*": {
+                "nvidia-driver-450",
+                "nvidia-driver-390",
+            },
+        }
+        modalias_map = {
+            "pci": (
+                re.compile(
+                    "|".join(fnmatch.translate(p) for p in patterns), re.IGNORECASE
+                ),
+                patterns,
+            )
+        }
+
+        self.assertEqual(
+            UbuntuDrivers.detect.modalias_map_packages(modalias_map, modalias_nv),
+            {"nvidia-driver-450", "nvidia-driver-390"},
+        )
+        self.assertEqual(
+            UbuntuDrivers.detect.modalias_map_packages(
+                modalias_map, "pci:v00001234d00sv00000001sd00bc00sc00i00"
+            ),
+            {"vanilla"},
+        )
+        self.assertEqual(
+            UbuntuDrivers.detect.modalias_map_packages(
+                modalias_map, "pci:vDEADBEEFd00"
+            ),
+            set(),
+        )
+        self.assertEqual(
+            UbuntuDrivers.detect.modalias_map_packages(
+                modalias_map, "usb:v9876dABCDsv01sd02bc00sc01i05"
+            ),
+            set(),
+        )
+
     def test_system_driver_packages_performance(self):
         """system_driver_packages() performance for a lot of modaliases"""
 
@@ -254,6 +343,131 @@ class DetectTest(unittest.TestCase):
 
         self.assertLess(sec, target)
 
+    def test_apt_scan(self):
+        """aptscan walks the cache once for all its consumers"""
+
+        chroot = aptdaemon.test.Chroot()
+        try:
+            chroot.setup()
+            chroot.add_test_repository()
+            archive = gen_fakearchive()
+            chroot.add_repository(archive.path, True, False)
+
+            apt_pkg.init_config()
+            dpkg_status = os.path.abspath(
+                os.path.join(chroot.path, "var", "lib", "dpkg", "status")
+            )
+            apt_pkg.config.set("Dir::State::status", dpkg_status)
+            apt_pkg.init_system()
+            cache = apt_pkg.Cache(None)
+
+            walks = []
+
+            def hook(phase, started):
+                if phase == "apt-scan" and started:
+                    walks.append(phase)
+
+            UbuntuDrivers.detect.phase_hooks.append(hook)
+            try:
+                scan = aptscan.scan(cache, *aptscan.COLLECTORS)
+                modalias_map = UbuntuDrivers.detect.apt_cache_modalias_map(cache)
+                installed = UbuntuDrivers.detect.get_installed_packages_by_glob(
+                    cache, "*"
+                )
+                UbuntuDrivers.kerneldetection.KernelDetection(
+                    cache
+                ).is_running_kernel_outdated()
+                self.assertIs(aptscan.scan(cache, "nvidia"), scan)
+            finally:
+                UbuntuDrivers.detect.phase_hooks.remove(hook)
+        finally:
+            chroot.remove()
+
+        self.assertEqual(walks, ["apt-scan"])
+        self.assertEqual(scan.nvidia.names, {"nvidia-driver-xxx"})
+        self.assertIn("vanilla", [p.name for p, _ in scan.modalias.packages])
+        self.assertIn("pci:v00001234d*sv*sd*bc*sc*i*", modalias_map["pci"][1])
+        self.assertEqual(installed, sorted(scan.installed.names))
+        self.assertNotIn("vanilla", installed)
+
+        # the scan, and the cache with it, are only kept while they are used
+        del scan
+        self.assertIsNone(aptscan._last_scan())
+
+    def test_system_device_drivers_one_walk(self):
+        """system_device_drivers() walks the apt cache packages once"""
+
+        class CountingCache(apt_pkg.Cache):
+            walks = 0
+
+            @property
+            def packages(self):
+                CountingCache.walks += 1
+                return super().packages
+
+        chroot = aptdaemon.test.Chroot()
+        try:
+            chroot.setup()
+            chroot.add_test_repository()
+            archive = gen_fakearchive()
+            archive.create_deb(
+                "nvidia-driver-440",
+                dependencies={"Depends": "xorg-video-abi-4"},
+                extra_tags={"Modaliases": "nv(pci:v000010DEd000010C3sv*sd*bc03sc*i*)"},
+            )
+            chroot.add_repository(archive.path, True, False)
+            apt_pkg.init_config()
+            dpkg_status = os.path.abspath(
+                os.path.join(chroot.path, "var", "lib", "dpkg", "status")
+            )
+            apt_pkg.config.set("Dir::State::status", dpkg_status)
+            apt_pkg.init_system()
+            cache = CountingCache(None)
+
+            res = UbuntuDrivers.detect.system_device_drivers(
+                cache, sys_path=self.umockdev.get_sys_dir()
+            )
+        finally:
+            chroot.remove()
+
+        graphics = [d for d in res if d.endswith("/sys/devices/graphics")][0]
+        self.assertIn("nvidia-driver-440", res[graphics]["drivers"])
+        self.assertEqual(CountingCache.walks, 1)
+        # the scan is released at the end of the detection
+        self.assertIsNone(aptscan._last_scan)
+
+    def test_set_runtimepm_supported(self):
+        """Plans made elsewhere still tell nvidia-prime about runtime PM"""
+
+        archive = testarchive.Archive()
+        archive.create_deb("nvidia-driver-535")
+        archive.create_deb("nvidia-driver-550", extra_tags={"Runtimepm": "true"})
+        chroot = aptdaemon.test.Chroot()
+        try:
+            chroot.setup()
+            chroot.add_repository(archive.path, True, False)
+            apt_pkg.init_config()
+            dpkg_status = os.path.abspath(
+                os.path.join(chroot.path, "var", "lib", "dpkg", "status")
+            )
+            apt_pkg.config.set("Dir::State::status", dpkg_status)
+            apt_pkg.init_system()
+            cache = apt_pkg.Cache(None)
+
+            with patch("UbuntuDrivers.detect.open", create=True) as mocked_open:
+                UbuntuDrivers.detect.set_runtimepm_supported(
+                    cache, ["nvidia-driver-535", "missing"]
+                )
+                mocked_open.assert_not_called()
+                UbuntuDrivers.detect.set_runtimepm_supported(
+                    cache, ["nvidia-driver-535", "nvidia-driver-550"]
+                )
+                mocked_open.assert_called_once_with(
+                    "/run/nvidia_runtimepm_supported", "w"
+                )
+        finally:
+            chroot.remove()
+
     def test_system_driver_packages_chroot(self):
         """system_driver_packages() for test package repository"""
 
@@ -6737,6 +6951,81 @@ exec /sbin/modinfo "$@"
             set([os.path.basename(d) for d in res]), set(["black", "white", "orange"])
         )
 
+    def test_system_device_drivers_on_device(self):
+        """system_device_drivers() reports each device as it is resolved"""
+
+        with open(os.path.join(self.plugin_dir, "extra.py"), "w") as f:
+            f.write('def detect(apt): return ["special"]\n')
+
+        chroot = aptdaemon.test.Chroot()
+        try:
+            chroot.setup()
+            archive = gen_fakearchive()
+            chroot.add_repository(archive.path, True, False)
+            dpkg_status = os.path.abspath(
+                os.path.join(chroot.path, "var", "lib", "dpkg", "status")
+            )
+            apt_pkg.config.set("Dir::State::status", dpkg_status)
+            apt_pkg.init_system()
+            cache = apt_pkg.Cache(None)
+
+            reported = {}
+
+            def on_device(device_name, info):
+                self.assertNotIn(device_name, reported)
+                reported[device_name] = info
+
+            res = UbuntuDrivers.detect.system_device_drivers(
+                cache, sys_path=self.umockdev.get_sys_dir(), on_device=on_device
+            )
+        finally:
+            chroot.remove()
+
+        # every device is reported exactly once, plugins included, and with
+        # a single NVidia device the per-device ranking is the final one
+        self.assertEqual(reported, res)
+        self.assertIn("extra.py", reported)
+
+    def test_modalias_device_drivers(self):
+        """modalias_device_drivers() resolves a single device"""
+
+        chroot = aptdaemon.test.Chroot()
+        try:
+            chroot.setup()
+            archive = gen_fakearchive()
+            chroot.add_repository(archive.path, True, False)
+            dpkg_status = os.path.abspath(
+                os.path.join(chroot.path, "var", "lib", "dpkg", "status")
+            )
+            apt_pkg.config.set("Dir::State::status", dpkg_status)
+            apt_pkg.init_system()
+            cache = apt_pkg.Cache(None)
+
+            res = UbuntuDrivers.detect.system_device_drivers(
+                cache, sys_path=self.umockdev.get_sys_dir()
+            )
+            devices = {
+                name: UbuntuDrivers.detect.modalias_device_drivers(
+                    cache, info["modalias"], name
+                )
+                for name, info in res.items()
+                if "modalias" in info
+            }
+            unknown = UbuntuDrivers.detect.modalias_device_drivers(
+                cache, "pci:v0000FFFFd0000FFFFsv00sd00bc00sc00i00", "/sys/devices/x"
+            )
+        finally:
+            chroot.remove()
+
+        # the "recommended" flags only consider the device itself, so they
+        # can differ from the system-wide ones
+        self.assertTrue(devices)
+        for name, device in devices.items():
+            self.assertEqual(list(device), [name])
+            self.assertEqual(device[name]["modalias"], res[name]["modalias"])
+            self.assertEqual(set(device[name]["drivers"]), set(res[name]["drivers"]))
+        self.assertEqual(unknown, {})
+
     @unittest.skip(reason="fails after updating aptdaemon to 2.0.1 in Plucky")
     def test_detect_plugin_packages(self):
         """detect_plugin_packages()"""
@@ -7208,6 +7497,177 @@ APT::Get::AllowUnauthenticated "true";
         self.assertTrue("nvidia-driver-xxx - third-party non-free recommended" in out)
         self.assertEqual(ud.returncode, 0)
 
+    def test_devices_ndjson(self):
+        """ubuntu-drivers devices --format ndjson"""
+
+        ud = subprocess.Popen(
+            [self.tool_path, "devices", "--format", "ndjson"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(err, "")
+        self.assertEqual(ud.returncode, 0)
+
+        # the last record for a device wins
+        devices = {}
+        for line in out.splitlines():
+            record = json.loads(line)
+            self.assertEqual(record["type"], "device")
+            devices[os.path.basename(record["device"])] = record
+        self.assertEqual(
+            devices["white"]["modalias"], "pci:v00001234d00sv00000001sd00bc00sc00i00"
+        )
+        self.assertEqual(
+            devices["white"]["drivers"]["vanilla"],
+            {"free": True, "from_distro": False, "support": None},
+        )
+        graphics = devices["graphics"]["drivers"]
+        self.assertTrue(graphics["xserver-xorg-video-nouveau"]["builtin"])
+        self.assertTrue(graphics["nvidia-driver-xxx"]["recommended"])
+
+    def test_list_json(self):
+        """ubuntu-drivers list --format json"""
+
+        ud = subprocess.Popen(
+            [self.tool_path, "list", "--format", "json"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(err, "")
+        self.assertEqual(ud.returncode, 0)
+
+        records = {record["package"]: record for record in json.loads(out)}
+        self.assertEqual(
+            set(records),
+            set(
+                [
+                    "vanilla",
+                    "chocolate",
+                    "bcmwl-kernel-source",
+                    "nvidia-driver-xxx",
+                    "stracciatella",
+                    "tuttifrutti",
+                    "neapolitan",
+                ]
+            ),
+        )
+        self.assertEqual(records["vanilla"]["type"], "package")
+        self.assertTrue(records["vanilla"]["free"])
+        self.assertEqual(
+            records["vanilla"]["modalias"], "pci:v00001234d00sv00000001sd00bc00sc00i00"
+        )
+        self.assertIsNone(records["vanilla"]["linux_modules"])
+
+    def test_fleet_plan(self):
+        """ubuntu-drivers fleet-plan for hardware manifests"""
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        modaliases = {
+            "usb:v9876dABCDsv01sd02bc00sc01i05": "/sys/devices/black",
+            "pci:v00001234d00sv00000001sd00bc00sc00i00": "/sys/devices/white",
+        }
+        manifests = []
+        for name, manifest in [
+            ("one", {"node": "node-1", "modaliases": modaliases}),
+            # same hardware, as a plain list of modaliases
+            ("two", {"modaliases": sorted(modaliases)}),
+            ("none", {"modaliases": ["pci:vDEADBEEFd00"]}),
+            ("broken", {"modaliases": 1}),
+        ]:
+            manifests.append(os.path.join(workdir, name + ".json"))
+            with open(manifests[-1], "w") as f:
+                json.dump(manifest, f)
+
+        ud = subprocess.Popen(
+            [self.tool_path, "fleet-plan", "--apt-root", self.chroot.path, "-j", "2"]
+            + manifests,
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        # the broken manifest fails the run, but not the others
+        self.assertEqual(ud.returncode, 1)
+        self.assertIn("Planned 4 nodes (2 distinct hardware, 1 failed)", err)
+        self.assertIn("nodes/s", err)
+
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(
+            [record["node"] for record in records[:3]], ["node-1", "two", "none"]
+        )
+        for record in records:
+            self.assertEqual(record["type"], "plan")
+        self.assertEqual(records[0]["packages"], ["bcmwl-kernel-source"])
+        self.assertEqual(records[1]["packages"], ["bcmwl-kernel-source"])
+        self.assertEqual(records[0]["fingerprint"], records[1]["fingerprint"])
+        self.assertEqual(records[2]["packages"], [])
+        self.assertEqual(records[3]["manifest"], manifests[3])
+        self.assertIn("modaliases", records[3]["error"])
+        self.assertNotIn("packages", records[3])
+
+    def test_list_profile(self):
+        """ubuntu-drivers --profile list"""
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        trace_path = os.path.join(workdir, "trace.json")
+        stats_path = os.path.join(workdir, "stats")
+
+        ud = subprocess.Popen(
+            [
+                self.tool_path,
+                "--profile=" + trace_path,
+                "--cprofile",
+                stats_path,
+                "list",
+            ],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(ud.returncode, 0, err)
+        self.assertIn("vanilla", out)
+        self.assertIn(trace_path, err)
+        self.assertTrue(os.path.getsize(stats_path) > 0)
+
+        with open(trace_path) as f:
+            events = json.load(f)["traceEvents"]
+        phases = set(event["name"] for event in events)
+        for phase in (
+            "ubuntu-drivers",
+            "apt-open",
+            "kernel-check",
+            "modalias-scan",
+            "index-build",
+            "device-resolution",
+            "plugins",
+        ):
+            self.assertIn(phase, phases)
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            self.assertIn("cpu_ms", event["args"])
+
+        # without a path, the trace goes to the current directory
+        ud = subprocess.Popen(
+            [self.tool_path, "--profile", "list"],
+            cwd=workdir,
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(ud.returncode, 0, err)
+        self.assertIn("vanilla", out)
+        self.assertTrue(
+            os.path.exists(os.path.join(workdir, "ubuntu-drivers-profile.json"))
+        )
+
     def test_devices_detect_plugins(self):
         """ubuntu-drivers devices includes custom detection plugins"""
 
@@ -7283,6 +7743,58 @@ APT::Get::AllowUnauthenticated "true";
 
         # now all packages should be installed, so it should not do anything
 
+    def test_install_simulate_explain(self):
+        """ubuntu-drivers install --simulate --explain"""
+
+        ud = subprocess.Popen(
+            [self.tool_path, "install", "--simulate"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        # no root needed, as nothing is installed
+        self.assertEqual(ud.returncode, 0, err)
+        self.assertEqual(out, "Would install: bcmwl-kernel-source\n")
+
+        ud = subprocess.Popen(
+            [self.tool_path, "install", "--simulate", "--explain"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(ud.returncode, 0, err)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(records[-1]["type"], "transaction")
+        self.assertEqual(records[-1]["packages"], ["bcmwl-kernel-source"])
+        self.assertEqual(records[-1]["changes"], ["bcmwl-kernel-source"])
+        self.assertEqual(records[-1]["count"], 1)
+
+        decisions = {
+            (record["step"], record.get("package")): record
+            for record in records
+            if record["type"] == "decision"
+        }
+        self.assertEqual(
+            decisions[("skipped", "vanilla")]["reason"], "not-auto-installable"
+        )
+        self.assertIn(("selected", "bcmwl-kernel-source"), decisions)
+        for record in decisions.values():
+            self.assertGreaterEqual(record["elapsed_ms"], 0)
+        phases = [record["phase"] for record in records if record["type"] == "phase"]
+        self.assertIn("index-build", phases)
+
+        # nothing was installed
+        ud = subprocess.Popen(
+            [self.tool_path, "install", "--simulate"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertIn("bcmwl-kernel-source", out)
+
     def test_auto_install_packagelist(self):
         """ubuntu-drivers install package list creation"""
 
@@ -7340,6 +7852,30 @@ APT::Get::AllowUnauthenticated "true";
             "available: 1 (auto-install)  [third party]  free  modalias:" in out, out
         )
 
+    def test_debug_json(self):
+        """ubuntu-drivers debug --format json keeps log messages off stdout"""
+
+        ud = subprocess.Popen(
+            [self.tool_path, "debug", "--format", "json"],
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = ud.communicate()
+        self.assertEqual(ud.returncode, 0)
+        records = json.loads(out)
+
+        self.assertIn(
+            modalias_nv,
+            [r["modalias"] for r in records if r["type"] == "modalias"],
+        )
+        packages = {r["package"]: r for r in records if r["type"] == "package"}
+        self.assertEqual(packages["vanilla"]["available"], "1")
+        self.assertIsNone(packages["vanilla"]["installed"])
+        self.assertTrue(
+            [p for p in packages.values() if p["auto_install"] and p["free"]], out
+        )
+
     def test_welcome_page_with_subcommand(self):
         """ubuntu-drivers does not show welcome page when subcommand is provided"""
 
@@ -7358,6 +7894,171 @@ APT::Get::AllowUnauthenticated "true";
         self.assertEqual(ud.returncode, 0)
 
 
+class InstallerTest(unittest.TestCase):
+    """Test UbuntuDrivers.installer"""
+
+    def setUp(self):
+        oem_list = "etc/apt/sources.list.d/oem-pistacchio-meta.list"
+
+        # the archive that the OEM metapackage enables, with a newer version
+        # of it
+        oem_archive = testarchive.Archive()
+        oem_archive.create_deb("oem-extra")
+        oem_archive.create_deb(
+            "oem-pistacchio-meta",
+            version="2",
+            dependencies={"Depends": "oem-extra"},
+            files={oem_list: oem_archive.apt_source + "\n"},
+        )
+
+        archive = testarchive.Archive()
+        archive.create_deb("dep-lib")
+        archive.create_deb(
+            "bcmwl-kernel-source",
+            dependencies={"Depends": "dep-lib"},
+            extra_tags={"Runtimepm": "true"},
+        )
+        archive.create_deb(
+            "oem-pistacchio-meta", files={oem_list: oem_archive.apt_source + "\n"}
+        )
+        archive.create_deb("base-tool", extra_tags={"Essential": "yes"})
+
+        self.chroot = aptdaemon.test.Chroot()
+        self.chroot.setup()
+        self.addCleanup(self.chroot.remove)
+        self.chroot.add_repository(archive.path, True, False)
+
+        # the apt configuration is global, so restore it for the other tests
+        for key in (
+            "Dir",
+            "Dir::State::status",
+            "Debug::NoLocking",
+            "APT::Get::AllowUnauthenticated",
+        ):
+            if apt_pkg.config.exists(key):
+                self.addCleanup(apt_pkg.config.set, key, apt_pkg.config.get(key))
+            else:
+                self.addCleanup(apt_pkg.config.clear, key)
+
+        apt_pkg.init_config()
+        apt_pkg.config.set("Dir", self.chroot.path)
+        apt_pkg.config.set(
+            "Dir::State::status",
+            os.path.join(self.chroot.path, "var/lib/dpkg/status"),
+        )
+        apt_pkg.config.set("Debug::NoLocking", "true")
+        apt_pkg.config.set("APT::Get::AllowUnauthenticated", "true")
+        apt_pkg.init_system()
+        self.engine = installer.Installer(
+            apt_pkg.Cache(None),
+            dpkg_options=[
+                "--root=%s" % self.chroot.path,
+                "--log=%s/var/log/dpkg.log" % self.chroot.path,
+            ],
+        )
+
+    def installed_version(self, package):
+        current = self.engine.cache[package].current_ver
+        return current.ver_str if current else None
+
+    def test_install_oem_upgrade(self):
+        """Installer installs drivers, then upgrades OEM metas from their archive"""
+
+        self.engine.mark_install(["bcmwl-kernel-source", "oem-pistacchio-meta"])
+        self.assertEqual(
+            self.engine.changes(),
+            ["bcmwl-kernel-source", "dep-lib", "oem-pistacchio-meta"],
+        )
+        self.assertTrue(self.engine.commit())
+
+        sources_list = installer.oem_sources_list("oem-pistacchio-meta")
+        self.assertTrue(sources_list.startswith(self.chroot.path))
+        self.engine.update_sources([sources_list])
+        self.assertEqual(self.installed_version("bcmwl-kernel-source"), "1")
+        self.assertEqual(self.installed_version("oem-pistacchio-meta"), "1")
+        # the lists of the other sources are kept
+        self.assertIsNotNone(
+            self.engine.depcache.get_candidate_ver(self.engine.cache["dep-lib"])
+        )
+
+        self.engine.mark_install(["oem-pistacchio-meta"])
+        self.assertEqual(self.engine.changes(), ["oem-extra", "oem-pistacchio-meta"])
+        self.assertTrue(self.engine.commit())
+
+        self.engine.update_sources([])
+        self.assertEqual(self.installed_version("oem-pistacchio-meta"), "2")
+        self.assertEqual(self.installed_version("oem-extra"), "1")
+
+        # nothing left to do
+        self.engine.mark_install(["bcmwl-kernel-source", "oem-pistacchio-meta"])
+        self.assertEqual(self.engine.changes(), [])
+        self.assertFalse(self.engine.commit())
+
+    def test_install_unknown(self):
+        """Installer refuses unknown packages"""
+
+        with self.assertRaises(installer.InstallError):
+            self.engine.mark_install(["bcmwl-kernel-source", "no-such-package"])
+
+    def test_refuse_essential_removal(self):
+        """Installer lists removals and refuses to remove essential packages"""
+
+        self.engine.mark_install(["base-tool", "dep-lib"])
+        self.assertTrue(self.engine.commit())
+        self.engine.update_sources([])
+
+        self.engine.depcache.mark_delete(self.engine.cache["dep-lib"])
+        self.assertEqual(self.engine.removals(), ["dep-lib"])
+        self.assertEqual(self.engine.changes(), ["dep-lib-"])
+        self.engine.depcache.mark_delete(self.engine.cache["base-tool"])
+        self.assertEqual(self.engine.installs(), [])
+        self.assertEqual(self.engine.changes(), ["base-tool-", "dep-lib-"])
+        with self.assertRaisesRegex(installer.InstallError, "base-tool"):
+            self.engine.commit()
+        self.assertEqual(self.installed_version("base-tool"), "1")
+        self.assertEqual(self.installed_version("dep-lib"), "1")
+
+    def test_bundle(self):
+        """Installer installs from an offline bundle"""
+
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        self.assertEqual(
+            sorted(
+                bundle.write_bundle(self.engine.cache, ["bcmwl-kernel-source"], output)
+            ),
+            ["bcmwl-kernel-source_1_all.deb", "dep-lib_1_all.deb"],
+        )
+        self.assertEqual(bundle.read_plan(output), ["bcmwl-kernel-source"])
+        # copies, not links into the archive
+        self.assertFalse(os.path.islink(os.path.join(output, "dep-lib_1_all.deb")))
+
+        # bundles that other users could have changed are refused
+        packages_index = os.path.join(output, "Packages")
+        os.chmod(packages_index, 0o664)
+        with self.assertRaisesRegex(bundle.BundleError, "writable"):
+            bundle.open_bundle_cache(output)
+        os.chmod(packages_index, 0o644)
+
+        # the bundle is the only archive now
+        self.engine = installer.Installer(bundle.open_bundle_cache(output))
+        self.assertNotIn("oem-pistacchio-meta", self.engine.cache)
+        # the bundle keeps the records which installing from it checks
+        with patch("UbuntuDrivers.detect.open", create=True) as mocked_open:
+            UbuntuDrivers.detect.set_runtimepm_supported(
+                self.engine.cache, bundle.read_plan(output)
+            )
+            mocked_open.assert_called_once_with("/run/nvidia_runtimepm_supported", "w")
+        self.engine.mark_install(bundle.read_plan(output))
+        self.assertEqual(self.engine.changes(), ["bcmwl-kernel-source", "dep-lib"])
+        self.assertTrue(self.engine.commit())
+        self.engine.update_sources([])
+        self.assertEqual(self.installed_version("bcmwl-kernel-source"), "1")
+
+        with self.assertRaises(bundle.BundleError):
+            bundle.read_plan(self.chroot.path)
+
+
 class PluginsTest(unittest.TestCase):
     """Test detect-plugins/*"""
 